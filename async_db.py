@@ -0,0 +1,140 @@
+# async_db.py
+"""
+asyncio counterpart of the db_utils calls on the scrape/read hot path, for async
+batch jobs and web handlers. Same SQL and return shapes as db_utils.
+
+One asyncpg pool per event loop multiplexes any number of concurrent callers over
+ASYNC_DB_POOL_MAX connections. asyncpg prepares every statement on first use and
+caches it per connection, and executemany() pipelines all rows of an upsert in a
+single round trip.
+"""
+import json
+import asyncio
+
+import config
+import timing
+import metrics
+import db_utils
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+_pools = {}  # event loop -> asyncpg.Pool
+
+GET_USER_SQL = db_utils._numbered(db_utils.GET_USER_SQL)
+SNAPSHOT_MARKS_SQL = db_utils._numbered(db_utils.SNAPSHOT_MARKS_SQL)
+SNAPSHOT_ATTENDANCE_SQL = db_utils._numbered(db_utils.SNAPSHOT_ATTENDANCE_SQL)
+SNAPSHOT_SGPI_SQL = db_utils._numbered(db_utils.SNAPSHOT_SGPI_SQL)
+UPSERT_CIE_MARKS_SQL = db_utils._numbered(db_utils.UPSERT_CIE_MARKS_SQL)
+UPSERT_ATTENDANCE_SQL = db_utils._numbered(db_utils.UPSERT_ATTENDANCE_SQL)
+UPSERT_SGPI_SQL = db_utils._numbered(db_utils.UPSERT_SGPI_SQL)
+LEADERBOARD_SQL = db_utils._numbered(db_utils.LEADERBOARD_SQL)
+
+async def get_pool():
+    """The shared pool for the running event loop, created on first use (None if unavailable)."""
+    if asyncpg is None:
+        print("asyncpg not installed (pip install asyncpg). Async DB calls are disabled.")
+        return None
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        try:
+            with timing.span("db.async_connect"):
+                pool = await asyncpg.create_pool(
+                    config.NEON_CONNECTION_STRING,
+                    min_size=config.ASYNC_DB_POOL_MIN,
+                    max_size=config.ASYNC_DB_POOL_MAX,
+                    statement_cache_size=config.ASYNC_DB_STATEMENT_CACHE,
+                )
+        except Exception as e:
+            print(f"DB Connection Error: {e}")
+            return None
+        # Another task may have created one while we were connecting
+        if loop in _pools:
+            await pool.close()
+        else:
+            _pools[loop] = pool
+    return _pools[loop]
+
+async def close_pool():
+    pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool:
+        await pool.close()
+
+@timing.timed("db.get_user")
+async def get_user(first_name_query):
+    pool = await get_pool()
+    if not pool: return None
+    try:
+        return db_utils._user_from_row(await pool.fetchrow(GET_USER_SQL, first_name_query.lower().strip()))
+    except Exception as e:
+        print(f"Error fetching user: {e}")
+        return None
+
+@timing.timed("db.load_snapshot")
+async def get_student_data(user_id):
+    """Same shape as db_utils.get_student_data_from_db."""
+    pool = await get_pool()
+    if not pool: return None
+    try:
+        async with pool.acquire() as conn:
+            mark_rows = await conn.fetch(SNAPSHOT_MARKS_SQL, user_id)
+            att_rows = await conn.fetch(SNAPSHOT_ATTENDANCE_SQL, user_id)
+            sgpi_rows = await conn.fetch(SNAPSHOT_SGPI_SQL, user_id)
+        return db_utils._build_snapshot(mark_rows, att_rows, sgpi_rows)
+    except Exception as e:
+        print(f"Error fetching DB: {e}")
+        return None
+
+async def _upsert_many(table, sql, records, user_id, semester):
+    pool = await get_pool()
+    if not pool: return False
+    try:
+        if records:
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.executemany(sql, records)
+            metrics.DB_ROWS_UPSERTED.inc(len(records), table=table)
+        db_utils._notify_write(table, user_id, semester)
+        return True
+    except Exception as e:
+        print(f"Error updating {table}: {e}")
+        return False
+
+@timing.timed("db.upsert_cie_marks")
+async def update_student_marks(user_id, semester, cie_marks_data, scraped_timestamp):
+    if not cie_marks_data or not semester: return False
+    records = db_utils._marks_records(user_id, semester, cie_marks_data, scraped_timestamp)
+    return await _upsert_many("cie_marks", UPSERT_CIE_MARKS_SQL, records, user_id, semester)
+
+@timing.timed("db.upsert_attendance")
+async def update_attendance(user_id, semester, attendance_data):
+    if not attendance_data or not semester: return False
+    records = db_utils._attendance_records(user_id, semester, attendance_data)
+    return await _upsert_many("attendance_records", UPSERT_ATTENDANCE_SQL, records, user_id, semester)
+
+@timing.timed("db.upsert_sgpi")
+async def save_student_sgpi(user_id, semester, sgpi, grade_details):
+    pool = await get_pool()
+    if not pool: return False
+    try:
+        await pool.execute(UPSERT_SGPI_SQL, user_id, semester, sgpi, json.dumps(grade_details))
+        metrics.DB_ROWS_UPSERTED.inc(table="student_performance")
+        db_utils._notify_write("student_performance", user_id, semester)
+        return True
+    except Exception as e:
+        print(f"Error saving SGPI: {e}")
+        return False
+
+@timing.timed("db.leaderboard")
+async def get_semester_leaderboard(semester, limit=5):
+    """[(full_name, sgpi)], like db_utils.get_semester_leaderboard_pg."""
+    pool = await get_pool()
+    if not pool: return []
+    try:
+        return [tuple(r) for r in await pool.fetch(LEADERBOARD_SQL, semester, limit)]
+    except Exception as e:
+        print(f"Error fetching leaderboard: {e}")
+        return []
@@ -0,0 +1,107 @@
+# attendance_forecast.py
+import math
+import time
+import argparse
+import threading
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+import config
+import db_utils
+
+_cache = {}  # (threshold, misses, semester) -> (loaded_at, rows)
+_cache_lock = threading.Lock()
+
+def project(attended, conducted, threshold=None, misses=0):
+    """
+    Forecast for one subject. threshold is a percentage (75 = 75%).
+    Returns None when nothing has been conducted yet, otherwise:
+      percentage     - current attendance %
+      projected      - attendance % after missing the next `misses` lectures
+      can_miss       - further lectures that can be missed while staying >= threshold
+      must_attend    - consecutive lectures needed to get back to threshold
+    (can_miss / must_attend are counted from after the `misses`.)
+    """
+    if threshold is None: threshold = config.ATTENDANCE_THRESHOLD
+    if not conducted or conducted <= 0: return None
+    t = threshold / 100
+
+    held = conducted + misses
+    percentage = (attended / conducted) * 100
+    projected = (attended / held) * 100
+    can_miss = max(math.floor((attended / t) - held), 0) if t > 0 else None
+    must_attend = max(math.ceil(((t * held) - attended) / (1 - t)), 0) if t < 1 else None
+
+    return {
+        "percentage": percentage,
+        "projected": projected,
+        "can_miss": can_miss,
+        "must_attend": must_attend,
+        "at_risk": projected < threshold,
+    }
+
+def status_text(forecast):
+    """'Safe. Miss N' / 'Low. Attend N' label used on the results page."""
+    if not forecast["at_risk"]:
+        return f"✅ Safe. Miss {forecast['can_miss']}"
+    return f"⚠️ Low. Attend {forecast['must_attend']}"
+
+def get_at_risk(threshold=None, misses=0, semester=None, max_age=None):
+    """
+    Every (student, subject) below `threshold` after `misses` more missed lectures,
+    from one set-based query over attendance_records. Results are cached per
+    (threshold, misses, semester) for ATTENDANCE_FORECAST_TTL_SECONDS.
+    """
+    if threshold is None: threshold = config.ATTENDANCE_THRESHOLD
+    if max_age is None: max_age = config.ATTENDANCE_FORECAST_TTL_SECONDS
+    key = (threshold, misses, semester)
+
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and time.monotonic() - cached[0] < max_age:
+            return cached[1]
+
+    rows = db_utils.get_attendance_projections_pg(threshold, misses, semester)
+    if rows is None: return []
+
+    with _cache_lock:
+        _cache[key] = (time.monotonic(), rows)
+    return rows
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+def print_alert_report(threshold=None, misses=0, semester=None):
+    """Batch report: at-risk subjects grouped by student."""
+    if threshold is None: threshold = config.ATTENDANCE_THRESHOLD
+    start = time.perf_counter()
+    rows = get_at_risk(threshold, misses, semester, max_age=0)
+    elapsed = time.perf_counter() - start
+
+    by_student = {}
+    for r in rows:
+        by_student.setdefault((r["full_name"], r["prn"]), []).append(r)
+
+    scope = f"Sem {semester}" if semester else "all semesters"
+    print("\n" + "="*60)
+    print(f"📉 ATTENDANCE ALERTS: below {threshold}% after {misses} more missed lecture(s), {scope}")
+    print(f"   {len(by_student)} student(s), {len(rows)} subject(s) ({elapsed:.2f}s)")
+    print("="*60)
+    for (name, prn), subjects in sorted(by_student.items()):
+        print(f"\n👤 {name} (PRN: {prn})")
+        for r in subjects:
+            subject_name = config.SUBJECT_CODE_TO_NAME_MAP.get(r["subject_code"], r["subject_code"])
+            print(f"   Sem {r['semester']} {subject_name} ({r['subject_code']}): "
+                  f"{r['percentage']:.1f}% → {r['projected']:.1f}%, attend {r['must_attend']} to recover")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lists students below an attendance threshold, now or after k more missed lectures.")
+    parser.add_argument("--threshold", type=float, default=config.ATTENDANCE_THRESHOLD, help="Attendance threshold in percent")
+    parser.add_argument("--misses", type=int, default=0, help="Project after this many more missed lectures per subject")
+    parser.add_argument("--semester", type=int, default=None, help="Only this semester")
+    args = parser.parse_args()
+
+    print_alert_report(args.threshold, args.misses, args.semester)
@@ -0,0 +1,73 @@
+# cohort_analytics.py
+import time
+import threading
+
+import config
+import db_utils
+import metrics
+
+# (kind, semester, *extra) -> (loaded_at, value)
+_cache = {}
+_cache_lock = threading.Lock()
+
+def _cached(key, loader):
+    """
+    Returns the cached value for key, loading it on a miss.
+    Entries are dropped when this process writes the semester (see _on_write) and
+    expire after COHORT_STATS_TTL_SECONDS to pick up writes from other processes.
+    """
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry and time.monotonic() - entry[0] < config.COHORT_STATS_TTL_SECONDS:
+            metrics.CACHE_LOOKUPS.inc(cache="cohort_analytics", result="hit")
+            return entry[1]
+    metrics.CACHE_LOOKUPS.inc(cache="cohort_analytics", result="miss")
+
+    value = loader()
+    if value is not None:
+        with _cache_lock:
+            _cache[key] = (time.monotonic(), value)
+    return value
+
+def _on_write(table, user_id, semester):
+    if table == "student_performance": return
+    with _cache_lock:
+        for key in [k for k in _cache if k[1] == semester]:
+            del _cache[key]
+
+db_utils.add_write_listener(_on_write)
+
+def marks_distribution(semester):
+    """{(subject_code, exam_type): stats}; exam_type 'Total' is the whole subject."""
+    return _cached(("marks", semester), lambda: db_utils.get_cohort_marks_stats_pg(semester)) or {}
+
+def attendance_distribution(semester):
+    return _cached(("attendance", semester), lambda: db_utils.get_cohort_attendance_stats_pg(semester)) or {}
+
+def standing(user_id, semester):
+    return _cached(("standing", semester, user_id), lambda: db_utils.get_cohort_standing_pg(user_id, semester)) or {}
+
+def comparison_rows(user_id, semester):
+    """Table rows for the "How do I compare" panel: one per subject (whole-subject totals)."""
+    dist = marks_distribution(semester)
+    mine = standing(user_id, semester)
+    att = attendance_distribution(semester)
+
+    rows = []
+    for (sub, exam), stats in sorted(dist.items()):
+        if exam != "Total": continue
+        you = mine.get((sub, exam))
+        rows.append({
+            "Subject": f"{config.SUBJECT_CODE_TO_NAME_MAP.get(sub, sub)} ({sub})",
+            "You": f"{you[0]:.1f}%" if you else "-",
+            "Class Mean": f"{stats['mean']:.1f}%",
+            "Median": f"{stats['median']:.1f}%",
+            "Top 10%": f"≥ {stats['p90']:.1f}%",
+            "Ahead Of": f"{you[1]:.0f}% of class" if you else "-",
+            "Class Attendance": f"{att[sub]['median']:.0f}%" if sub in att else "-",
+        })
+    return rows
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
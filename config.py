@@ -2,9 +2,11 @@
 import os
 
 NEON_DB_PASSWORD = os.environ.get("NEON_DB_PASSWORD")
+# Optional full DSN override (e.g. a local Postgres for multi-worker testing)
+DATABASE_URL = os.environ.get("DATABASE_URL")
 
 # Critical check: Ensure password was actually loaded
-if NEON_DB_PASSWORD is None:
+if NEON_DB_PASSWORD is None and not DATABASE_URL:
     import sys
     sys.exit("Database password not configured. Exiting.")
 
@@ -13,13 +15,128 @@ PG_HOST = os.environ.get("NEON_DB_URI", "ep-spring-voice-a1yre8if-pooler.ap-sout
 PG_DBNAME = os.environ.get("PG_DBNAME", "neondb")
 PG_USER = os.environ.get("PG_USER", "neondb_owner")
 
-NEON_CONNECTION_STRING = f"postgresql://{PG_USER}:{NEON_DB_PASSWORD}@{PG_HOST}/{PG_DBNAME}?sslmode=require"
+NEON_CONNECTION_STRING = DATABASE_URL or f"postgresql://{PG_USER}:{NEON_DB_PASSWORD}@{PG_HOST}/{PG_DBNAME}?sslmode=require"
 
 
+# --- DB Write Path ---
+# Pooled connections for the marks / attendance / SGPI upserts (0 = connect per call)
+DB_WRITE_POOL_SIZE = int(os.environ.get("DB_WRITE_POOL_SIZE", "4"))
+# Pooled connections idle longer than this are pinged before reuse (Neon suspends idle computes)
+DB_POOL_IDLE_CHECK_SECONDS = 60
+DB_EXECUTE_PAGE_SIZE = 100        # Prepared EXECUTEs sent per round trip
+
+# --- Async DB Pool (async_db.py) ---
+ASYNC_DB_POOL_MIN = 1
+ASYNC_DB_POOL_MAX = int(os.environ.get("ASYNC_DB_POOL_MAX", "5"))
+# Prepared statements cached per pooled connection. Set to 0 if the pooler rejects them
+# (PgBouncer in transaction mode before 1.21).
+ASYNC_DB_STATEMENT_CACHE = int(os.environ.get("ASYNC_DB_STATEMENT_CACHE", "100"))
+
 # --- Portal Configuration ---
-LOGIN_URL = "https://crce-students.contineo.in/parents/index.php?option=com_studentdashboard&controller=studentdashboard&task=dashboard"
+# Overridable so batch runs can be pointed at a local stub portal
+LOGIN_URL = os.environ.get("CONTINEO_LOGIN_URL", "https://crce-students.contineo.in/parents/index.php?option=com_studentdashboard&controller=studentdashboard&task=dashboard")
 FORM_ACTION_URL = LOGIN_URL
 
+# --- Portal HTTP Transport ---
+# Parallel requests per portal session; also sizes the keep-alive connection pool
+PORTAL_MAX_CONCURRENCY = int(os.environ.get("PORTAL_MAX_CONCURRENCY", "4"))
+PORTAL_CONNECT_TIMEOUT = float(os.environ.get("PORTAL_CONNECT_TIMEOUT", "5"))
+# Read timeouts per page type (seconds)
+PORTAL_READ_TIMEOUTS = {
+    "login": 20,
+    "ciedetails": 15,
+    "attendencelist": 15,
+    "default": 20,
+}
+# Adaptive timeouts: read timeout = clamp(p95 * multiplier, min, the value above)
+PORTAL_ADAPTIVE_TIMEOUTS = os.environ.get("PORTAL_ADAPTIVE_TIMEOUTS", "1") == "1"
+PORTAL_TIMEOUT_P95_MULTIPLIER = 3.0
+PORTAL_MIN_READ_TIMEOUT = 5.0
+PORTAL_LATENCY_WINDOW = 200       # Recent requests per page type used for p50/p95
+PORTAL_LATENCY_MIN_SAMPLES = 20
+# Hedged detail fetches: fire a backup request once the first passes p95.
+# Not used when PORTAL_STREAMING_FETCH is on (streaming fetches are never hedged)
+PORTAL_HEDGE_REQUESTS = os.environ.get("PORTAL_HEDGE_REQUESTS", "1") == "1"
+PORTAL_HEDGE_BUDGET = 10          # Backup requests per minute per process
+# Use an HTTP/2 client (requires `pip install httpx[http2]`)
+PORTAL_HTTP2 = os.environ.get("PORTAL_HTTP2", "0") == "1"
+PORTAL_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36"
+
+# Build subjects from the welcome page charts when they match the stored snapshot,
+# fetching detail pages only for new / changed / ambiguous subjects
+DASHBOARD_FAST_MODE = os.environ.get("DASHBOARD_FAST_MODE", "1") == "1"
+# ...but fetch a subject's detail pages anyway after this many refreshes without them,
+# or once they were last fetched this long ago, so its stored data can't go stale for good
+DELTA_SYNC_MAX_SKIPS = int(os.environ.get("DELTA_SYNC_MAX_SKIPS", "10"))
+DELTA_SYNC_MAX_AGE_HOURS = float(os.environ.get("DELTA_SYNC_MAX_AGE_HOURS", "24"))
+
+# Stream detail pages and stop reading once the chart / table / spans we parse have arrived.
+# Takes precedence over PORTAL_HEDGE_REQUESTS: streamed fetches are not hedged
+PORTAL_STREAMING_FETCH = os.environ.get("PORTAL_STREAMING_FETCH", "0") == "1"
+PORTAL_STREAM_CHUNK_SIZE = 8192
+
+# update_all: parse detail pages in this many worker processes (0 = parse in-process)
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", "0"))
+PARSE_QUEUE_SIZE = 16             # Fetched pages waiting for a parser before fetchers block
+
+# Keep every fetched page, compressed and deduplicated by content hash (empty = off).
+# `python page_archive.py reparse` rebuilds marks/attendance from it without the portal.
+PAGE_ARCHIVE_DIR = os.environ.get("PAGE_ARCHIVE_DIR", "")
+PAGE_ARCHIVE_ZSTD_LEVEL = 10
+
+# --- Streamlit Live Refresh ---
+LIVE_REFRESH_WORKERS = 4          # Background scrape threads per app process
+LIVE_REFRESH_POLL_SECONDS = 2
+# How long a replica waits for another replica's scrape of the same student before scraping itself
+SCRAPE_LOCK_WAIT_SECONDS = 60
+# Hand live refreshes to scrape_worker.py through the scrape_jobs table instead of app threads
+SCRAPE_JOB_QUEUE = os.environ.get("SCRAPE_JOB_QUEUE", "0") == "1"
+# Worker wake-up interval when no NOTIFY arrives (e.g. LISTEN unsupported by the pooler)
+SCRAPE_WORKER_POLL_SECONDS = 5
+
+# --- Portal Retry Policy ---
+PORTAL_MAX_ATTEMPTS = 3           # Total tries per request (1 = no retries)
+PORTAL_RETRY_BASE_DELAY = 1.0     # Seconds, doubled per attempt (with full jitter)
+PORTAL_RETRY_MAX_DELAY = 10.0
+# Max retries per batch run (update_all resets it) or per window in long-lived processes
+PORTAL_RETRY_BUDGET = int(os.environ.get("PORTAL_RETRY_BUDGET", "30"))
+PORTAL_RETRY_WINDOW_SECONDS = 300
+
+# --- Portal Circuit Breaker ---
+PORTAL_BREAKER_FAILURES = 5       # Consecutive failed requests that open the circuit
+PORTAL_BREAKER_COOLDOWN_SECONDS = 60  # Open -> half-open (one probe request) after this long
+# Share breaker state through Postgres so every replica/worker backs off together
+PORTAL_BREAKER_SHARED = os.environ.get("PORTAL_BREAKER_SHARED", "0") == "1"
+PORTAL_BREAKER_SYNC_SECONDS = 5   # How often the shared state is re-read
+
+# --- Instrumentation ---
+# Print every timing span as a JSON log line
+TIMING_LOG = os.environ.get("TIMING_LOG", "0") == "1"
+# Port for the Prometheus /metrics endpoint (0 = disabled)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+
+# --- Batch Refresh Scheduling ---
+# Per-run budget for update_all.py (0 = unlimited)
+REFRESH_BUDGET_SECONDS = int(os.environ.get("REFRESH_BUDGET_SECONDS", "0"))
+REFRESH_MAX_STUDENTS = int(os.environ.get("REFRESH_MAX_STUDENTS", "0"))
+# A Streamlit lookup within this window bumps the student's refresh priority
+LOOKUP_BOOST_WINDOW_HOURS = 48
+# Queue claims older than this are assumed to belong to a crashed worker and get re-issued
+BATCH_CLAIM_TIMEOUT_MINUTES = 15
+
+# --- Attendance Forecasting ---
+ATTENDANCE_THRESHOLD = 75         # Percent
+# How long attendance_forecast.get_at_risk reuses a whole-table projection
+ATTENDANCE_FORECAST_TTL_SECONDS = 300
+
+# --- History Tables ---
+# Monthly partitions created ahead of time for cie_marks_history / attendance_history
+HISTORY_PARTITION_MONTHS_AHEAD = 2
+
+# --- Cohort Analytics ---
+# Cache lifetime for class-wide distributions (writes in this process invalidate sooner)
+COHORT_STATS_TTL_SECONDS = 600
+
 # --- Form Field Names ---
 PRN_FIELD_NAME = "username"
 DAY_FIELD_NAME = "dd"
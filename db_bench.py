@@ -0,0 +1,106 @@
+# db_bench.py
+import time
+import argparse
+from datetime import datetime
+import pytz
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+import db_utils
+import timing
+
+BENCH_TABLE = "cie_marks_bench"
+EXAMS = ("MSE", "TH-ISE1", "TH-ISE2", "ESE", "Lab")
+
+def _synthetic_marks(user_id, subjects=8):
+    """One student's semester of CIE marks in update_student_marks_in_db_pg's row format."""
+    data = {f"CSC7{i:02d}": {exam: {'obtained': (user_id + i + j) % 20, 'max': 20} for j, exam in enumerate(EXAMS)}
+            for i in range(subjects)}
+    return db_utils._marks_records(user_id, 7, data, datetime.now(pytz.utc))
+
+def _report(label, samples, baseline=None):
+    median = timing.percentile(samples, 50) * 1000
+    p95 = timing.percentile(samples, 95) * 1000
+    speedup = f"  ({baseline / median:.2f}x)" if baseline else ""
+    print(f"   {label:<34} median {median:7.2f} ms   p95 {p95:7.2f} ms{speedup}")
+    return median
+
+def benchmark(rounds=50, students=20):
+    """
+    Times the CIE marks upsert the way it used to run (text executemany, one round trip
+    and one plan per row) against the prepared + batched path, on a TEMP copy of
+    cie_marks so real data and the history triggers are untouched. Also times opening a
+    connection per call against checking one out of the write pool.
+    Run it against the direct (non "-pooler") endpoint: temp tables don't survive a
+    transaction-mode pooler. For server CPU, compare total_plan_time / total_exec_time
+    in pg_stat_statements (if enabled) before and after a run.
+    """
+    sql = db_utils.UPSERT_CIE_MARKS_SQL.replace("INSERT INTO cie_marks ", f"INSERT INTO {BENCH_TABLE} ")
+    db_utils.PREPARED_STATEMENTS["bench_upsert_cie_marks"] = (db_utils.PREPARED_STATEMENTS["upsert_cie_marks"][0], sql)
+    batches = [_synthetic_marks(user_id) for user_id in range(1, students + 1)]
+    print(f"🏁 {rounds} rounds, {len(batches[0])} marks rows per upsert")
+
+    with db_utils._write_connection() as conn:
+        if not conn: return
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"""
+                CREATE TEMP TABLE IF NOT EXISTS {BENCH_TABLE} (
+                    user_id INTEGER NOT NULL, semester INTEGER NOT NULL,
+                    subject_code TEXT NOT NULL, exam_type TEXT NOT NULL,
+                    marks NUMERIC(5, 2), max_marks NUMERIC(5, 2),
+                    scraped_at TIMESTAMP WITH TIME ZONE NOT NULL,
+                    UNIQUE (user_id, subject_code, exam_type)
+                );
+            """)
+            conn.commit()
+
+            text, prepared = [], []
+            for r in range(rounds):
+                records = batches[r % students]
+                start = time.perf_counter()
+                cursor.executemany(sql, records)
+                conn.commit()
+                text.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                db_utils._execute_prepared(conn, cursor, "bench_upsert_cie_marks", records)
+                conn.commit()
+                prepared.append(time.perf_counter() - start)
+
+            print("   Upsert one student's marks:")
+            baseline = _report("executemany (text, per row)", text)
+            _report("PREPARE once + batched EXECUTE", prepared, baseline)
+        finally:
+            conn.rollback()
+            cursor.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE};")
+            server_name = db_utils._prepared_name("bench_upsert_cie_marks")
+            if server_name in conn.prepared:
+                cursor.execute(f"DEALLOCATE {server_name};")
+                conn.prepared.discard(server_name)
+            conn.commit()
+            cursor.close()
+
+    connect, checkout = [], []
+    for _ in range(min(rounds, 20)):
+        start = time.perf_counter()
+        fresh = db_utils.get_db_connection()
+        connect.append(time.perf_counter() - start)
+        if fresh: fresh.close()
+
+        start = time.perf_counter()
+        with db_utils._write_connection():
+            checkout.append(time.perf_counter() - start)
+    print("   Get a connection:")
+    baseline = _report("psycopg2.connect per call", connect)
+    _report("write pool checkout", checkout, baseline)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark for the prepared, pooled upsert path.")
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--students", type=int, default=20, help="Distinct synthetic students cycled through")
+    args = parser.parse_args()
+
+    benchmark(args.rounds, args.students)
@@ -1,11 +1,40 @@
 # db_utils.py
+import os
+import re
+import time
+import hashlib
+import itertools
+import threading
+from contextlib import contextmanager
 import psycopg2
+import psycopg2.errors
+import psycopg2.extras
+import psycopg2.pool
 import config 
-from datetime import datetime
+import timing
+import metrics
+from datetime import datetime, date
 import json
 
 DB_NAME_FOR_MESSAGES = "PostgreSQL (Neon.tech)"
 
+# First key of the two-int advisory lock used for per-student live scrapes
+SCRAPE_LOCK_NAMESPACE = 4201
+
+_write_listeners = []
+
+def add_write_listener(callback):
+    """callback(table, user_id, semester) after a successful marks / attendance / SGPI write."""
+    _write_listeners.append(callback)
+
+def _notify_write(table, user_id, semester):
+    for callback in _write_listeners:
+        try:
+            callback(table, user_id, semester)
+        except Exception as e:
+            print(f"Write listener error: {e}")
+
+@timing.timed("db.connect")
 def get_db_connection():
     try:
         conn = psycopg2.connect(config.NEON_CONNECTION_STRING)
@@ -14,6 +43,161 @@ def get_db_connection():
         print(f"DB Connection Error: {e}")
         return None
 
+HISTORY_TABLES = ("cie_marks_history", "attendance_history")
+
+def _month_start(d, offset=0):
+    month_index = d.year * 12 + (d.month - 1) + offset
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+def _create_history_partitions(cursor, months_ahead=None):
+    """Monthly partitions from this month to months_ahead; anything else lands in the _default partition."""
+    if months_ahead is None: months_ahead = config.HISTORY_PARTITION_MONTHS_AHEAD
+    today = date.today()
+    for table in HISTORY_TABLES:
+        for offset in range(months_ahead + 1):
+            start, end = _month_start(today, offset), _month_start(today, offset + 1)
+            # Fails if the default partition already holds rows for that month; keep going
+            cursor.execute("SAVEPOINT history_partition")
+            try:
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {table}_{start:%Y_%m} PARTITION OF {table}
+                    FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}');
+                """)
+                cursor.execute("RELEASE SAVEPOINT history_partition")
+            except psycopg2.Error as e:
+                print(f"Skipping partition {table}_{start:%Y_%m}: {e}")
+                cursor.execute("ROLLBACK TO SAVEPOINT history_partition")
+
+def ensure_history_partitions_pg():
+    """Cheap and idempotent; called at the start of each batch run so next month's partition always exists."""
+    conn = get_db_connection()
+    if not conn: return False
+    cursor = conn.cursor()
+    try:
+        _create_history_partitions(cursor)
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"Error creating history partitions: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+# name -> (table, definition after "CREATE TRIGGER <name>")
+HISTORY_TRIGGERS = {
+    "trg_cie_marks_history_ins": ("cie_marks", """
+        AFTER INSERT ON cie_marks
+        FOR EACH ROW EXECUTE FUNCTION record_cie_marks_history()"""),
+    "trg_cie_marks_history_upd": ("cie_marks", """
+        AFTER UPDATE ON cie_marks
+        FOR EACH ROW WHEN (OLD.marks IS DISTINCT FROM NEW.marks
+                        OR OLD.max_marks IS DISTINCT FROM NEW.max_marks
+                        OR OLD.semester IS DISTINCT FROM NEW.semester)
+        EXECUTE FUNCTION record_cie_marks_history()"""),
+    "trg_attendance_history_ins": ("attendance_records", """
+        AFTER INSERT ON attendance_records
+        FOR EACH ROW EXECUTE FUNCTION record_attendance_history()"""),
+    "trg_attendance_history_upd": ("attendance_records", """
+        AFTER UPDATE ON attendance_records
+        FOR EACH ROW WHEN (OLD.attended IS DISTINCT FROM NEW.attended
+                        OR OLD.conducted IS DISTINCT FROM NEW.conducted)
+        EXECUTE FUNCTION record_attendance_history()"""),
+}
+
+_history_ready = False
+_history_lock = threading.Lock()
+
+def setup_history_pg():
+    """
+    History tables (append-only, one row per observed change, partitioned by month),
+    filled by triggers on cie_marks / attendance_records so every write path records it.
+    Runs once per process, in its own transaction.
+    """
+    global _history_ready
+    with _history_lock:
+        if _history_ready: return True
+        conn = get_db_connection()
+        if not conn: return False
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS cie_marks_history (
+                    user_id INTEGER NOT NULL,
+                    semester INTEGER NOT NULL,
+                    subject_code TEXT NOT NULL,
+                    exam_type TEXT NOT NULL,
+                    marks NUMERIC(5, 2),
+                    max_marks NUMERIC(5, 2),
+                    recorded_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                ) PARTITION BY RANGE (recorded_at);
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS attendance_history (
+                    user_id INTEGER NOT NULL,
+                    semester INTEGER NOT NULL,
+                    subject_code TEXT NOT NULL,
+                    attended INTEGER,
+                    conducted INTEGER,
+                    recorded_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                ) PARTITION BY RANGE (recorded_at);
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_cie_marks_history_user ON cie_marks_history (user_id, recorded_at);")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_attendance_history_user ON attendance_history (user_id, recorded_at);")
+            for table in HISTORY_TABLES:
+                cursor.execute(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT;")
+            _create_history_partitions(cursor)
+
+            cursor.execute("""
+                CREATE OR REPLACE FUNCTION record_cie_marks_history() RETURNS trigger AS $$
+                BEGIN
+                    INSERT INTO cie_marks_history (user_id, semester, subject_code, exam_type, marks, max_marks)
+                    VALUES (NEW.user_id, NEW.semester, NEW.subject_code, NEW.exam_type, NEW.marks, NEW.max_marks);
+                    RETURN NULL;
+                END $$ LANGUAGE plpgsql;
+            """)
+            cursor.execute("""
+                CREATE OR REPLACE FUNCTION record_attendance_history() RETURNS trigger AS $$
+                BEGIN
+                    INSERT INTO attendance_history (user_id, semester, subject_code, attended, conducted)
+                    VALUES (NEW.user_id, NEW.semester, NEW.subject_code, NEW.attended, NEW.conducted);
+                    RETURN NULL;
+                END $$ LANGUAGE plpgsql;
+            """)
+            # Upserts fire UPDATE triggers even when nothing changed; the WHEN clauses keep history change-only.
+            # Only missing triggers are (re)created: trigger DDL locks the hot tables, and
+            # DROP + CREATE instead of CREATE OR REPLACE TRIGGER keeps PG < 14 working
+            cursor.execute("SELECT tgname FROM pg_trigger WHERE NOT tgisinternal AND tgname = ANY(%s);",
+                           (list(HISTORY_TRIGGERS),))
+            existing = {row[0] for row in cursor.fetchall()}
+            for name, (table, definition) in HISTORY_TRIGGERS.items():
+                if name in existing: continue
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name} ON {table};")
+                cursor.execute(f"CREATE TRIGGER {name} {definition};")
+
+            # Seed history from the current state the first time (e.g. existing deployments)
+            cursor.execute("""
+                INSERT INTO cie_marks_history (user_id, semester, subject_code, exam_type, marks, max_marks, recorded_at)
+                SELECT user_id, semester, subject_code, exam_type, marks, max_marks, scraped_at FROM cie_marks
+                WHERE NOT EXISTS (SELECT 1 FROM cie_marks_history);
+            """)
+            cursor.execute("""
+                INSERT INTO attendance_history (user_id, semester, subject_code, attended, conducted, recorded_at)
+                SELECT user_id, semester, subject_code, attended, conducted, updated_at FROM attendance_records
+                WHERE NOT EXISTS (SELECT 1 FROM attendance_history);
+            """)
+            conn.commit()
+            _history_ready = True
+            return True
+        except psycopg2.Error as e:
+            print(f"Error setting up history tables: {e}")
+            conn.rollback()
+            return False
+        finally:
+            cursor.close()
+            conn.close()
+
 def create_db_and_table_pg():
     conn = get_db_connection()
     if not conn: return
@@ -73,14 +257,105 @@ def create_db_and_table_pg():
                 PRIMARY KEY (user_id, semester)
             );
         """)
+
+        # 5. Refresh Stats (Batch Scheduler bookkeeping)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS refresh_stats (
+                user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+                last_refreshed_at TIMESTAMPTZ,
+                last_changed_at TIMESTAMPTZ,
+                refresh_count INTEGER NOT NULL DEFAULT 0,
+                change_count INTEGER NOT NULL DEFAULT 0,
+                snapshot_hash TEXT,
+                last_lookup_at TIMESTAMPTZ,
+                lookup_count INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+
+        # 6. Batch Queue (shared work queue for multi-worker update_all runs)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS batch_queue (
+                run_id TEXT NOT NULL,
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                priority DOUBLE PRECISION NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                claimed_at TIMESTAMPTZ,
+                finished_at TIMESTAMPTZ,
+                PRIMARY KEY (run_id, user_id)
+            );
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_batch_queue_pending ON batch_queue (run_id, status, priority DESC);")
+
+        # 7. Scrape Jobs (live refreshes handed from the web app to scrape_worker.py)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS scrape_jobs (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                status TEXT NOT NULL DEFAULT 'queued',
+                requested_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                started_at TIMESTAMPTZ,
+                finished_at TIMESTAMPTZ,
+                worker TEXT,
+                error TEXT
+            );
+        """)
+        # At most one queued/running job per student: duplicate requests join the existing one
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_scrape_jobs_active
+            ON scrape_jobs (user_id) WHERE status IN ('queued', 'running');
+        """)
+
+        # 8. Dashboard signatures (delta sync: detail pages are skipped while these match)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS dashboard_signatures (
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                subject_code TEXT NOT NULL,
+                signature TEXT NOT NULL,
+                skips INTEGER NOT NULL DEFAULT 0,
+                verified_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (user_id, subject_code)
+            );
+            -- Tables created before skips / verified_at existed
+            ALTER TABLE dashboard_signatures
+                ADD COLUMN IF NOT EXISTS skips INTEGER NOT NULL DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS verified_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+        """)
+
+        # 9. Archived raw pages (index only; the compressed blobs live in PAGE_ARCHIVE_DIR)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS archived_pages (
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                page_type TEXT NOT NULL,
+                subject_code TEXT NOT NULL DEFAULT '',
+                content_hash TEXT NOT NULL,
+                encoding TEXT,
+                fetched_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (user_id, page_type, subject_code, content_hash)
+            );
+        """)
+        # 10. Portal circuit breaker state shared by every replica (PORTAL_BREAKER_SHARED)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS portal_breaker (
+                name TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                opened_until TIMESTAMPTZ,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+        """)
         conn.commit()
         print("Tables checked/created successfully.")
     except psycopg2.Error as e:
         print(f"Error creating tables: {e}")
+        return
     finally:
         cursor.close()
         conn.close()
 
+    # Own transaction: if the history setup fails, the base tables above still exist
+    setup_history_pg()
+
 def add_user_to_db_pg(first_name, full_name, prn, dob_day, dob_month, dob_year):
     conn = get_db_connection()
     if not conn: return False
@@ -99,22 +374,26 @@ def add_user_to_db_pg(first_name, full_name, prn, dob_day, dob_month, dob_year):
         cursor.close()
         conn.close()
 
+GET_USER_SQL = """
+    SELECT id, full_name, prn, dob_day, dob_month, dob_year
+    FROM users WHERE first_name = %s
+"""
+
+def _user_from_row(row):
+    if not row: return None
+    return {
+        "id": row[0], "full_name": row[1], "prn": row[2],
+        "dob_day": row[3], "dob_month": row[4], "dob_year": row[5]
+    }
+
+@timing.timed("db.get_user")
 def get_user_from_db_pg(first_name_query):
     conn = get_db_connection()
     if not conn: return None
     cursor = conn.cursor()
     try:
-        cursor.execute('''
-            SELECT id, full_name, prn, dob_day, dob_month, dob_year
-            FROM users WHERE first_name = %s
-        ''', (first_name_query.lower().strip(),))
-        row = cursor.fetchone()
-        if row:
-            return {
-                "id": row[0], "full_name": row[1], "prn": row[2],
-                "dob_day": row[3], "dob_month": row[4], "dob_year": row[5]
-            }
-        return None
+        cursor.execute(GET_USER_SQL, (first_name_query.lower().strip(),))
+        return _user_from_row(cursor.fetchone())
     finally:
         cursor.close()
         conn.close()
@@ -145,120 +424,632 @@ def get_all_users_from_db_pg():
         cursor.close()
         conn.close()
 
-        
-def update_student_marks_in_db_pg(user_id, semester, cie_marks_data, scraped_timestamp):
-    """Saves Marks into the DB linked to a Semester with safety checks for connection drops."""
-    if not cie_marks_data or not semester: 
-        return False
-        
+@timing.timed("db.get_refresh_candidates")
+def get_refresh_candidates_pg():
+    """
+    Same users as get_all_users_from_db_pg, plus the signals the batch scheduler
+    ranks on: last scrape time, refresh/change history and recent lookups.
+    """
+    conn = get_db_connection()
+    if not conn: return []
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            SELECT u.id, u.full_name, u.prn, u.dob_day, u.dob_month, u.dob_year,
+                   (SELECT MAX(cm.scraped_at) FROM cie_marks cm WHERE cm.user_id = u.id),
+                   rs.last_refreshed_at, rs.last_changed_at,
+                   COALESCE(rs.refresh_count, 0), COALESCE(rs.change_count, 0),
+                   rs.last_lookup_at
+            FROM users u
+            LEFT JOIN refresh_stats rs ON rs.user_id = u.id
+            ORDER BY u.id
+        ''')
+        candidates = []
+        for row in cursor.fetchall():
+            candidates.append({
+                "id": row[0], "full_name": row[1], "prn": row[2],
+                "dob_day": row[3], "dob_month": row[4], "dob_year": row[5],
+                "scraped_at": row[6], "last_refreshed_at": row[7], "last_changed_at": row[8],
+                "refresh_count": row[9], "change_count": row[10], "last_lookup_at": row[11]
+            })
+        return candidates
+    except Exception as e:
+        print(f"Error fetching refresh candidates: {e}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+@timing.timed("db.record_refresh_result")
+def record_refresh_result_pg(user_id, snapshot_hash):
+    """Logs a completed refresh. The change counter only moves when the snapshot hash differs."""
     conn = get_db_connection()
-    if not conn: 
+    if not conn: return False
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO refresh_stats (user_id, last_refreshed_at, last_changed_at, refresh_count, change_count, snapshot_hash)
+            VALUES (%s, NOW(), NOW(), 1, 1, %s)
+            ON CONFLICT (user_id)
+            DO UPDATE SET
+                last_refreshed_at = NOW(),
+                refresh_count = refresh_stats.refresh_count + 1,
+                change_count = refresh_stats.change_count +
+                    CASE WHEN refresh_stats.snapshot_hash IS DISTINCT FROM EXCLUDED.snapshot_hash THEN 1 ELSE 0 END,
+                last_changed_at = CASE WHEN refresh_stats.snapshot_hash IS DISTINCT FROM EXCLUDED.snapshot_hash
+                    THEN NOW() ELSE refresh_stats.last_changed_at END,
+                snapshot_hash = EXCLUDED.snapshot_hash;
+        """, (user_id, snapshot_hash))
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"Error recording refresh: {e}")
+        conn.rollback()
         return False
-        
+    finally:
+        cursor.close()
+        conn.close()
+
+@timing.timed("db.record_user_lookup")
+def record_user_lookup_pg(user_id):
+    """Marks that a student looked at their data in the app (raises refresh priority)."""
+    conn = get_db_connection()
+    if not conn: return False
     cursor = conn.cursor()
     try:
-        records = []
-        for sub, exams in cie_marks_data.items():
-            for exam, val in exams.items():
-                # Handle cases where val might be a dict or a raw number
-                obt = val.get('obtained') if isinstance(val, dict) else val
-                mx = val.get('max', 0) if isinstance(val, dict) else 0
-                
-                if isinstance(obt, (int, float)):
-                    records.append((user_id, semester, sub, exam, obt, mx, scraped_timestamp))
-        
-        if records:
-            cursor.executemany("""
-                INSERT INTO cie_marks (user_id, semester, subject_code, exam_type, marks, max_marks, scraped_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (user_id, subject_code, exam_type) 
-                DO UPDATE SET 
-                    marks = EXCLUDED.marks, 
-                    max_marks = EXCLUDED.max_marks, 
-                    scraped_at = EXCLUDED.scraped_at, 
-                    semester = EXCLUDED.semester;
-            """, records)
-            
+        cursor.execute("""
+            INSERT INTO refresh_stats (user_id, last_lookup_at, lookup_count)
+            VALUES (%s, NOW(), 1)
+            ON CONFLICT (user_id)
+            DO UPDATE SET
+                last_lookup_at = NOW(),
+                lookup_count = refresh_stats.lookup_count + 1;
+        """, (user_id,))
         conn.commit()
         return True
+    except Exception as e:
+        print(f"Error recording lookup: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
 
+def enqueue_batch_run_pg(run_id, ranked_user_ids):
+    """Seeds the queue for a run. ranked_user_ids: [(user_id, priority)]. Existing rows are left alone."""
+    if not ranked_user_ids: return 0
+    conn = get_db_connection()
+    if not conn: return 0
+    cursor = conn.cursor()
+    try:
+        cursor.executemany("""
+            INSERT INTO batch_queue (run_id, user_id, priority)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (run_id, user_id) DO NOTHING;
+        """, [(run_id, uid, prio) for uid, prio in ranked_user_ids])
+        conn.commit()
+        return len(ranked_user_ids)
     except Exception as e:
-        print(f"Error updating marks: {e}")
-        # SAFETY: Only rollback if the connection is still alive
-        try:
-            if conn and not conn.closed:
-                conn.rollback()
-        except:
-            pass # Connection already dead, cannot rollback
+        print(f"Error seeding batch queue: {e}")
+        conn.rollback()
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
+
+@timing.timed("db.claim_batch_user")
+def claim_next_batch_user_pg(run_id, worker):
+    """
+    Atomically claims the highest-priority pending student of a run.
+    SKIP LOCKED lets many workers poll concurrently without ever getting the same row.
+    Stale claims (crashed worker) are handed out again after BATCH_CLAIM_TIMEOUT_MINUTES.
+    """
+    conn = get_db_connection()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            WITH next AS (
+                SELECT user_id FROM batch_queue
+                WHERE run_id = %s
+                  AND (status = 'pending'
+                       OR (status = 'running' AND claimed_at < NOW() - make_interval(mins => %s)))
+                ORDER BY priority DESC
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE batch_queue bq
+            SET status = 'running', worker = %s, claimed_at = NOW()
+            FROM next, users u
+            WHERE bq.run_id = %s AND bq.user_id = next.user_id AND u.id = bq.user_id
+            RETURNING u.id, u.full_name, u.prn, u.dob_day, u.dob_month, u.dob_year;
+        """, (run_id, config.BATCH_CLAIM_TIMEOUT_MINUTES, worker, run_id))
+        row = cursor.fetchone()
+        conn.commit()
+        if row:
+            return {
+                "id": row[0], "full_name": row[1], "prn": row[2],
+                "dob_day": row[3], "dob_month": row[4], "dob_year": row[5]
+            }
+        return None
+    except Exception as e:
+        print(f"Error claiming from batch queue: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+@timing.timed("db.finish_batch_user")
+def finish_batch_user_pg(run_id, user_id, status):
+    """Marks a claimed student as 'done'/'failed', or hands it back with 'pending'."""
+    conn = get_db_connection()
+    if not conn: return False
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            UPDATE batch_queue
+            SET status = %s,
+                finished_at = CASE WHEN %s = 'pending' THEN NULL ELSE NOW() END,
+                worker = CASE WHEN %s = 'pending' THEN NULL ELSE worker END
+            WHERE run_id = %s AND user_id = %s;
+        """, (status, status, status, run_id, user_id))
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"Error updating batch queue: {e}")
+        conn.rollback()
         return False
+    finally:
+        cursor.close()
+        conn.close()
 
+def get_batch_run_summary_pg(run_id):
+    """Status counts for a queue run across all workers: {'done': n, 'failed': n, ...}"""
+    conn = get_db_connection()
+    if not conn: return {}
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT status, COUNT(*) FROM batch_queue WHERE run_id = %s GROUP BY status", (run_id,))
+        return dict(cursor.fetchall())
+    except Exception as e:
+        print(f"Error fetching batch summary: {e}")
+        return {}
     finally:
-        # SAFETY: Ensure cursor and connection are closed properly without crashing
+        cursor.close()
+        conn.close()
+
+# --- Upserts (shared with async_db) ---
+
+def _numbered(sql):
+    """psycopg2 %s placeholders -> server-side $1, $2, ... (PREPARE, asyncpg)"""
+    counter = itertools.count(1)
+    return re.sub(r"%s", lambda m: f"${next(counter)}", sql)
+
+UPSERT_CIE_MARKS_SQL = """
+    INSERT INTO cie_marks (user_id, semester, subject_code, exam_type, marks, max_marks, scraped_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (user_id, subject_code, exam_type) 
+    DO UPDATE SET 
+        marks = EXCLUDED.marks, 
+        max_marks = EXCLUDED.max_marks, 
+        scraped_at = EXCLUDED.scraped_at, 
+        semester = EXCLUDED.semester;
+"""
+
+UPSERT_ATTENDANCE_SQL = """
+    INSERT INTO attendance_records (user_id, semester, subject_code, attended, conducted, percentage, updated_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (user_id, semester, subject_code)
+    DO UPDATE SET attended = EXCLUDED.attended, conducted = EXCLUDED.conducted, percentage = EXCLUDED.percentage, updated_at = NOW();
+"""
+
+UPSERT_SGPI_SQL = """
+    INSERT INTO student_performance (user_id, semester, sgpi, grade_details, updated_at)
+    VALUES (%s, %s, %s, %s, NOW())
+    ON CONFLICT (user_id, semester) 
+    DO UPDATE SET 
+        sgpi = EXCLUDED.sgpi,
+        grade_details = EXCLUDED.grade_details,
+        updated_at = NOW();
+"""
+
+def _marks_records(user_id, semester, cie_marks_data, scraped_timestamp):
+    records = []
+    for sub, exams in cie_marks_data.items():
+        for exam, val in exams.items():
+            # Handle cases where val might be a dict or a raw number
+            obt = val.get('obtained') if isinstance(val, dict) else val
+            mx = val.get('max', 0) if isinstance(val, dict) else 0
+
+            if isinstance(obt, (int, float)):
+                records.append((user_id, semester, sub, exam, obt, mx, scraped_timestamp))
+    return records
+
+def _attendance_records(user_id, semester, attendance_data):
+    records = []
+    # Input format: {'CSC701': {'attended': 10, 'conducted': 12}}
+    for sub, details in attendance_data.items():
+        att = details.get('attended', 0)
+        cond = details.get('conducted', 0)
+        perc = (att / cond * 100) if cond > 0 else 0
+        records.append((user_id, semester, sub, att, cond, perc, datetime.now()))
+    return records
+
+# name -> (parameter types, statement); PREPAREd once per connection by _execute_prepared
+# (as name_<hash>, see _prepared_name)
+PREPARED_STATEMENTS = {
+    "upsert_cie_marks": ("integer, integer, text, text, numeric, numeric, timestamptz", UPSERT_CIE_MARKS_SQL),
+    "upsert_attendance": ("integer, integer, text, integer, integer, numeric, timestamptz", UPSERT_ATTENDANCE_SQL),
+    "upsert_sgpi": ("integer, integer, float8, jsonb", UPSERT_SGPI_SQL),
+}
+
+class _WriteConnection(psycopg2.extensions.connection):
+    """Connection that remembers which PREPARED_STATEMENTS it holds and when it was last used."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.last_used = time.monotonic()
+
+_write_pool = None
+_write_pool_pid = None
+_write_pool_lock = threading.Lock()
+
+def _get_write_pool():
+    global _write_pool, _write_pool_pid
+    with _write_pool_lock:
+        # Worker processes (update_all --workers) must not reuse the parent's sockets
+        if _write_pool is None or _write_pool_pid != os.getpid():
+            # psycopg2 closes returned connections beyond minconn, so minconn == maxconn
+            # is what keeps connections (and their prepared statements) alive between writes
+            _write_pool = psycopg2.pool.ThreadedConnectionPool(
+                config.DB_WRITE_POOL_SIZE, config.DB_WRITE_POOL_SIZE,
+                config.NEON_CONNECTION_STRING, connection_factory=_WriteConnection)
+            _write_pool_pid = os.getpid()
+        return _write_pool
+
+def _checkout_write_connection(pool):
+    """A live pooled connection; ones idle past DB_POOL_IDLE_CHECK_SECONDS are pinged first."""
+    for _ in range(config.DB_WRITE_POOL_SIZE + 1):
+        conn = pool.getconn()
+        if conn.closed:
+            pool.putconn(conn, close=True)
+            continue
+        if time.monotonic() - conn.last_used < config.DB_POOL_IDLE_CHECK_SECONDS:
+            return conn
         try:
-            if cursor:
-                cursor.close()
-            if conn and not conn.closed:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            conn.rollback()
+            return conn
+        except psycopg2.Error:
+            # Server side went away (e.g. Neon suspended the compute)
+            pool.putconn(conn, close=True)
+    return pool.getconn()
+
+@contextmanager
+def _write_connection():
+    """
+    Connection for the upsert hot path: from the write pool when DB_WRITE_POOL_SIZE > 0,
+    otherwise (or when the pool is exhausted) a fresh one that is closed afterwards.
+    Yields None if the DB is unreachable.
+    """
+    pool, conn = None, None
+    try:
+        with timing.span("db.connect"):
+            if config.DB_WRITE_POOL_SIZE > 0:
+                pool = _get_write_pool()
+                try:
+                    conn = _checkout_write_connection(pool)
+                except psycopg2.pool.PoolError:
+                    pool = None
+            if conn is None:
+                conn = psycopg2.connect(config.NEON_CONNECTION_STRING, connection_factory=_WriteConnection)
+    except Exception as e:
+        print(f"DB Connection Error: {e}")
+        if pool and conn is not None:
+            pool.putconn(conn, close=True)
+        yield None
+        return
+
+    try:
+        yield conn
+    finally:
+        conn.last_used = time.monotonic()
+        if pool is None:
+            if not conn.closed:
                 conn.close()
-        except:
-            pass
+        elif conn.closed or conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            # Broken or left mid-transaction: don't hand it to the next caller
+            pool.putconn(conn, close=True)
+        else:
+            pool.putconn(conn)
+
+def _prepared_name(name):
+    """
+    Server-side name for a PREPARED_STATEMENTS entry. It carries a hash of the SQL and
+    parameter types, so a backend still holding an older version (from before a deploy,
+    or another client of the same pooler) is never mistaken for the current one.
+    """
+    types, sql = PREPARED_STATEMENTS[name]
+    return f"{name}_{hashlib.sha1(f'{types}|{sql}'.encode()).hexdigest()[:8]}"
+
+def _execute_prepared(conn, cursor, name, records):
+    """
+    Runs one of PREPARED_STATEMENTS for every record. The statement is planned once per
+    server session instead of once per row, and the EXECUTEs go out DB_EXECUTE_PAGE_SIZE
+    per round trip. A pooler that moves us to another backend between transactions is
+    handled by re-preparing once.
+    """
+    types, sql = PREPARED_STATEMENTS[name]
+    server_name = _prepared_name(name)
+    execute_sql = f"EXECUTE {server_name} ({', '.join(['%s'] * len(types.split(',')))})"
+    for attempt in range(2):
+        try:
+            if server_name not in conn.prepared:
+                # A pooled backend may still hold it from an earlier client
+                cursor.execute("SELECT 1 FROM pg_prepared_statements WHERE name = %s;", (server_name,))
+                if not cursor.fetchone():
+                    cursor.execute(f"PREPARE {server_name} ({types}) AS {_numbered(sql).strip().rstrip(';')};")
+                conn.prepared.add(server_name)
+            psycopg2.extras.execute_batch(cursor, execute_sql, records, page_size=config.DB_EXECUTE_PAGE_SIZE)
+            return
+        except psycopg2.errors.InvalidSqlStatementName:
+            conn.rollback()
+            conn.prepared.discard(server_name)
+            if attempt: raise
+
+@timing.timed("db.upsert_cie_marks")
+def update_student_marks_in_db_pg(user_id, semester, cie_marks_data, scraped_timestamp):
+    """Saves Marks into the DB linked to a Semester with safety checks for connection drops."""
+    if not cie_marks_data or not semester: 
+        return False
+
+    with _write_connection() as conn:
+        if not conn: 
+            return False
+
+        cursor = conn.cursor()
+        try:
+            records = _marks_records(user_id, semester, cie_marks_data, scraped_timestamp)
+            if records:
+                _execute_prepared(conn, cursor, "upsert_cie_marks", records)
+                metrics.DB_ROWS_UPSERTED.inc(len(records), table="cie_marks")
+
+            conn.commit()
+            _notify_write("cie_marks", user_id, semester)
+            return True
 
+        except Exception as e:
+            print(f"Error updating marks: {e}")
+            # SAFETY: Only rollback if the connection is still alive
+            try:
+                if not conn.closed:
+                    conn.rollback()
+            except:
+                pass # Connection already dead, cannot rollback (_write_connection drops it)
+            return False
+
+        finally:
+            cursor.close()
+
+@timing.timed("db.upsert_attendance")
 def update_attendance_in_db_pg(user_id, semester, attendance_data):
     """Saves Attendance to the DB linked to a Semester."""
     if not attendance_data or not semester: return False
+    with _write_connection() as conn:
+        if not conn: return False
+        cursor = conn.cursor()
+        try:
+            records = _attendance_records(user_id, semester, attendance_data)
+            if records:
+                _execute_prepared(conn, cursor, "upsert_attendance", records)
+                metrics.DB_ROWS_UPSERTED.inc(len(records), table="attendance_records")
+            conn.commit()
+            _notify_write("attendance_records", user_id, semester)
+            return True
+        except Exception as e:
+            print(f"Error updating attendance: {e}")
+            conn.rollback()
+            return False
+        finally:
+            cursor.close()
+
+@timing.timed("db.upsert_sgpi")
+def save_student_sgpi_pg(user_id, semester, sgpi, grade_details):
+    """Saves SGPI."""
+    with _write_connection() as conn:
+        if not conn: return False
+        cursor = conn.cursor()
+        try:
+            json_grades = json.dumps(grade_details)
+            _execute_prepared(conn, cursor, "upsert_sgpi", [(user_id, semester, sgpi, json_grades)])
+            conn.commit()
+            metrics.DB_ROWS_UPSERTED.inc(table="student_performance")
+            _notify_write("student_performance", user_id, semester)
+            return True
+        except Exception as e:
+            print(f"Error saving SGPI: {e}")
+            return False
+        finally:
+            cursor.close()
+
+@timing.timed("db.get_dashboard_signatures")
+def get_dashboard_signatures_pg(user_id):
+    """
+    {subject_code: {'sig': signature, 'due': bool}} saved by the last successful scrape.
+    'due' marks subjects that went DELTA_SYNC_MAX_SKIPS refreshes or DELTA_SYNC_MAX_AGE_HOURS
+    without their detail pages being fetched.
+    """
+    conn = get_db_connection()
+    if not conn: return {}
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT subject_code, signature,
+                   skips >= %s OR verified_at < NOW() - %s * INTERVAL '1 hour'
+            FROM dashboard_signatures WHERE user_id = %s
+        """, (config.DELTA_SYNC_MAX_SKIPS, config.DELTA_SYNC_MAX_AGE_HOURS, user_id))
+        return {sub: {"sig": sig, "due": due} for sub, sig, due in cursor.fetchall()}
+    except Exception as e:
+        print(f"Error fetching dashboard signatures: {e}")
+        return {}
+    finally:
+        cursor.close()
+        conn.close()
+
+@timing.timed("db.save_dashboard_signatures")
+def save_dashboard_signatures_pg(user_id, signatures, verified=()):
+    """
+    Call only after the matching marks / attendance were saved. Subjects in verified had
+    all their detail pages fetched: their skip count and age restart. The rest count one
+    more skipped refresh.
+    """
+    if not signatures: return False
     conn = get_db_connection()
     if not conn: return False
     cursor = conn.cursor()
     try:
-        records = []
-        # Input format: {'CSC701': {'attended': 10, 'conducted': 12}}
-        for sub, details in attendance_data.items():
-            att = details.get('attended', 0)
-            cond = details.get('conducted', 0)
-            perc = (att / cond * 100) if cond > 0 else 0
-            records.append((user_id, semester, sub, att, cond, perc, datetime.now()))
-
-        if records:
-            cursor.executemany("""
-                INSERT INTO attendance_records (user_id, semester, subject_code, attended, conducted, percentage, updated_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (user_id, semester, subject_code)
-                DO UPDATE SET attended = EXCLUDED.attended, conducted = EXCLUDED.conducted, percentage = EXCLUDED.percentage, updated_at = NOW();
-            """, records)
+        cursor.executemany("""
+            INSERT INTO dashboard_signatures (user_id, subject_code, signature, skips, verified_at, updated_at)
+            VALUES (%s, %s, %s, %s, NOW(), NOW())
+            ON CONFLICT (user_id, subject_code)
+            DO UPDATE SET
+                signature = EXCLUDED.signature,
+                skips = CASE WHEN EXCLUDED.skips = 0 THEN 0 ELSE dashboard_signatures.skips + 1 END,
+                verified_at = CASE WHEN EXCLUDED.skips = 0 THEN NOW() ELSE dashboard_signatures.verified_at END,
+                updated_at = NOW();
+        """, [(user_id, sub, sig, 0 if sub in verified else 1) for sub, sig in signatures.items()])
         conn.commit()
         return True
     except Exception as e:
-        print(f"Error updating attendance: {e}")
+        print(f"Error saving dashboard signatures: {e}")
         conn.rollback()
         return False
     finally:
         cursor.close()
         conn.close()
 
-def save_student_sgpi_pg(user_id, semester, sgpi, grade_details):
-    """Saves SGPI."""
+def record_archived_pages_pg(rows):
+    """rows = [(user_id, page_type, subject_code, content_hash, encoding)]. A page seen again just gets a new fetched_at."""
     conn = get_db_connection()
     if not conn: return False
     cursor = conn.cursor()
     try:
-        json_grades = json.dumps(grade_details)
+        cursor.executemany("""
+            INSERT INTO archived_pages (user_id, page_type, subject_code, content_hash, encoding, fetched_at)
+            VALUES (%s, %s, %s, %s, %s, NOW())
+            ON CONFLICT (user_id, page_type, subject_code, content_hash)
+            DO UPDATE SET fetched_at = NOW();
+        """, rows)
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"Error indexing archived pages: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_latest_archived_pages_pg(user_id=None):
+    """Newest archived version of every (user, page_type, subject): [(user_id, page_type, subject_code, content_hash, encoding, fetched_at)]."""
+    conn = get_db_connection()
+    if not conn: return []
+    cursor = conn.cursor()
+    try:
         cursor.execute("""
-            INSERT INTO student_performance (user_id, semester, sgpi, grade_details, updated_at)
-            VALUES (%s, %s, %s, %s, NOW())
-            ON CONFLICT (user_id, semester) 
-            DO UPDATE SET 
-                sgpi = EXCLUDED.sgpi,
-                grade_details = EXCLUDED.grade_details,
-                updated_at = NOW();
-        """, (user_id, semester, sgpi, json_grades))
+            SELECT DISTINCT ON (user_id, page_type, subject_code)
+                   user_id, page_type, subject_code, content_hash, encoding, fetched_at
+            FROM archived_pages
+            WHERE %(uid)s::int IS NULL OR user_id = %(uid)s::int
+            ORDER BY user_id, page_type, subject_code, fetched_at DESC
+        """, {"uid": user_id})
+        return cursor.fetchall()
+    except Exception as e:
+        print(f"Error fetching archived pages: {e}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+@timing.timed("db.get_portal_breaker")
+def get_portal_breaker_pg(name="portal"):
+    """(state, opened_until, updated_at) as last published by any replica, or None."""
+    conn = get_db_connection()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT state, opened_until, updated_at FROM portal_breaker WHERE name = %s;", (name,))
+        return cursor.fetchone()
+    except Exception as e:
+        print(f"Error reading breaker state: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+@timing.timed("db.save_portal_breaker")
+def save_portal_breaker_pg(state, opened_until=None, name="portal"):
+    """Publishes a breaker transition (only called when the state changes)."""
+    conn = get_db_connection()
+    if not conn: return False
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO portal_breaker (name, state, opened_until, updated_at)
+            VALUES (%s, %s, %s, NOW())
+            ON CONFLICT (name)
+            DO UPDATE SET state = EXCLUDED.state, opened_until = EXCLUDED.opened_until, updated_at = NOW();
+        """, (name, state, opened_until))
         conn.commit()
         return True
     except Exception as e:
-        print(f"Error saving SGPI: {e}")
+        print(f"Error saving breaker state: {e}")
+        conn.rollback()
         return False
     finally:
         cursor.close()
         conn.close()
 
+SNAPSHOT_MARKS_SQL = "SELECT semester, subject_code, exam_type, marks, max_marks, scraped_at FROM cie_marks WHERE user_id = %s"
+SNAPSHOT_ATTENDANCE_SQL = "SELECT semester, subject_code, attended, conducted FROM attendance_records WHERE user_id = %s"
+SNAPSHOT_SGPI_SQL = "SELECT semester, sgpi FROM student_performance WHERE user_id = %s"
+
+def _build_snapshot(mark_rows, att_rows, sgpi_rows):
+    """Organizes the three snapshot queries' rows by semester (None if there's no data)."""
+    full_data = {} # Key = Semester
+    last_scraped = None
+
+    for r in mark_rows:
+        sem, sub, exam, obt, mx, ts = r
+        if last_scraped is None or ts > last_scraped: last_scraped = ts
+
+        if sem not in full_data: full_data[sem] = {'cie': {}, 'att': {}, 'sgpi': None}
+        if sub not in full_data[sem]['cie']: full_data[sem]['cie'][sub] = {}
+
+        full_data[sem]['cie'][sub][exam] = {'obtained': float(obt), 'max': float(mx)}
+
+    for r in att_rows:
+        sem, sub, att, cond = r
+        if sem not in full_data: full_data[sem] = {'cie': {}, 'att': {}, 'sgpi': None}
+        full_data[sem]['att'][sub] = {'attended': att, 'conducted': cond}
+
+    for r in sgpi_rows:
+        sem, val = r
+        if sem in full_data:
+            full_data[sem]['sgpi'] = val
+
+    if not full_data: return None
+
+    return {
+        "semesters_data": full_data,
+        # Find the latest semester to show by default
+        "latest_sem": max(full_data.keys()),
+        "scraped_at": last_scraped
+    }
+
+@timing.timed("db.load_snapshot")
 def get_student_data_from_db(user_id):
     """
     Retrieves ALL data for a user, organized by semester.
@@ -268,72 +1059,436 @@ def get_student_data_from_db(user_id):
     if not conn: return None
     cursor = conn.cursor()
     
-    full_data = {} # Key = Semester
-    
     try:
         # 1. Fetch Marks
-        cursor.execute("SELECT semester, subject_code, exam_type, marks, max_marks, scraped_at FROM cie_marks WHERE user_id = %s", (user_id,))
+        cursor.execute(SNAPSHOT_MARKS_SQL, (user_id,))
         mark_rows = cursor.fetchall()
-        
-        last_scraped = None
-
-        for r in mark_rows:
-            sem, sub, exam, obt, mx, ts = r
-            last_scraped = ts # Just take the last one
-            
-            if sem not in full_data: full_data[sem] = {'cie': {}, 'att': {}, 'sgpi': None}
-            if sub not in full_data[sem]['cie']: full_data[sem]['cie'][sub] = {}
-            
-            full_data[sem]['cie'][sub][exam] = {'obtained': float(obt), 'max': float(mx)}
 
         # 2. Fetch Attendance
-        cursor.execute("SELECT semester, subject_code, attended, conducted FROM attendance_records WHERE user_id = %s", (user_id,))
+        cursor.execute(SNAPSHOT_ATTENDANCE_SQL, (user_id,))
         att_rows = cursor.fetchall()
-        for r in att_rows:
-            sem, sub, att, cond = r
-            if sem not in full_data: full_data[sem] = {'cie': {}, 'att': {}, 'sgpi': None}
-            full_data[sem]['att'][sub] = {'attended': att, 'conducted': cond}
 
         # 3. Fetch SGPI
-        cursor.execute("SELECT semester, sgpi FROM student_performance WHERE user_id = %s", (user_id,))
+        cursor.execute(SNAPSHOT_SGPI_SQL, (user_id,))
         sgpi_rows = cursor.fetchall()
-        for r in sgpi_rows:
-            sem, val = r
-            if sem in full_data:
-                full_data[sem]['sgpi'] = val
 
-        if not full_data: return None
+        return _build_snapshot(mark_rows, att_rows, sgpi_rows)
 
-        # Find the latest semester to show by default
-        latest_sem = max(full_data.keys()) if full_data else None
+    except Exception as e:
+        print(f"Error fetching DB: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+@timing.timed("db.marks_history")
+def get_marks_history_pg(user_id, since=None, until=None, semester=None):
+    """
+    Every recorded change of a student's marks, oldest first:
+    [(recorded_at, semester, subject_code, exam_type, marks, max_marks)].
+    since/until bound recorded_at, so only the matching monthly partitions are scanned.
+    """
+    conn = get_db_connection()
+    if not conn: return []
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT recorded_at, semester, subject_code, exam_type, marks, max_marks
+            FROM cie_marks_history
+            WHERE user_id = %(uid)s
+              AND (%(since)s::timestamptz IS NULL OR recorded_at >= %(since)s::timestamptz)
+              AND (%(until)s::timestamptz IS NULL OR recorded_at < %(until)s::timestamptz)
+              AND (%(sem)s::int IS NULL OR semester = %(sem)s::int)
+            ORDER BY recorded_at
+        """, {"uid": user_id, "since": since, "until": until, "sem": semester})
+        return [(r[0], r[1], r[2], r[3], float(r[4]), float(r[5])) for r in cursor.fetchall()]
+    except Exception as e:
+        print(f"Error fetching marks history: {e}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+@timing.timed("db.attendance_history")
+def get_attendance_history_pg(user_id, since=None, until=None, semester=None):
+    """Every recorded change of a student's attendance, oldest first: [(recorded_at, semester, subject_code, attended, conducted)]."""
+    conn = get_db_connection()
+    if not conn: return []
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT recorded_at, semester, subject_code, attended, conducted
+            FROM attendance_history
+            WHERE user_id = %(uid)s
+              AND (%(since)s::timestamptz IS NULL OR recorded_at >= %(since)s::timestamptz)
+              AND (%(until)s::timestamptz IS NULL OR recorded_at < %(until)s::timestamptz)
+              AND (%(sem)s::int IS NULL OR semester = %(sem)s::int)
+            ORDER BY recorded_at
+        """, {"uid": user_id, "since": since, "until": until, "sem": semester})
+        return cursor.fetchall()
+    except Exception as e:
+        print(f"Error fetching attendance history: {e}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+SCRAPE_JOB_CHANNEL = "scrape_jobs"
+
+def enqueue_scrape_job_pg(user_id):
+    """Queues a live refresh (or joins the active one) and wakes the workers. Returns the job id."""
+    conn = get_db_connection()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO scrape_jobs (user_id) VALUES (%s)
+            ON CONFLICT (user_id) WHERE status IN ('queued', 'running') DO NOTHING
+            RETURNING id;
+        """, (user_id,))
+        row = cursor.fetchone()
+        if row:
+            cursor.execute("SELECT pg_notify(%s, %s)", (SCRAPE_JOB_CHANNEL, str(row[0])))
+        else:
+            cursor.execute("""
+                SELECT id FROM scrape_jobs
+                WHERE user_id = %s AND status IN ('queued', 'running')
+            """, (user_id,))
+            row = cursor.fetchone()
+        conn.commit()
+        return row[0] if row else None
+    except Exception as e:
+        print(f"Error queueing scrape job: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def claim_next_scrape_job_pg(worker):
+    """Claims the oldest queued job (or a stale running one). Returns (job_id, user) or None."""
+    conn = get_db_connection()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            WITH next AS (
+                SELECT id FROM scrape_jobs
+                WHERE status = 'queued'
+                   OR (status = 'running' AND started_at < NOW() - make_interval(mins => %s))
+                ORDER BY requested_at
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE scrape_jobs sj
+            SET status = 'running', worker = %s, started_at = NOW()
+            FROM next, users u
+            WHERE sj.id = next.id AND u.id = sj.user_id
+            RETURNING sj.id, u.id, u.full_name, u.prn, u.dob_day, u.dob_month, u.dob_year;
+        """, (config.BATCH_CLAIM_TIMEOUT_MINUTES, worker))
+        row = cursor.fetchone()
+        conn.commit()
+        if row:
+            return row[0], {
+                "id": row[1], "full_name": row[2], "prn": row[3],
+                "dob_day": row[4], "dob_month": row[5], "dob_year": row[6]
+            }
+        return None
+    except Exception as e:
+        print(f"Error claiming scrape job: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def finish_scrape_job_pg(job_id, status, error=None):
+    conn = get_db_connection()
+    if not conn: return False
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            UPDATE scrape_jobs SET status = %s, error = %s, finished_at = NOW()
+            WHERE id = %s;
+        """, (status, error, job_id))
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"Error finishing scrape job: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_scrape_job_pg(job_id):
+    conn = get_db_connection()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT status, finished_at, error FROM scrape_jobs WHERE id = %s", (job_id,))
+        row = cursor.fetchone()
+        if row:
+            return {"status": row[0], "finished_at": row[1], "error": row[2]}
+        return None
+    except Exception as e:
+        print(f"Error fetching scrape job: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def listen_for_scrape_jobs_pg():
+    """Dedicated autocommit connection subscribed to new-job notifications (None if unavailable)."""
+    conn = get_db_connection()
+    if not conn: return None
+    try:
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute(f"LISTEN {SCRAPE_JOB_CHANNEL};")
+        cursor.close()
+        return conn
+    except Exception as e:
+        print(f"LISTEN not available, falling back to polling: {e}")
+        conn.close()
+        return None
+
+def try_lock_user_scrape_pg(user_id):
+    """
+    Takes the cross-replica scrape lock for a student.
+    Returns (acquired, conn). While acquired, the lock lives in conn's open transaction;
+    hand conn to release_user_scrape_lock_pg when done. Transaction-level locks are used
+    so this also works through a transaction-mode pooler (Neon).
+    If the DB is unreachable, returns (True, None) so the caller can proceed unlocked.
+    """
+    conn = get_db_connection()
+    if not conn: return True, None
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_try_advisory_xact_lock(%s, %s)", (SCRAPE_LOCK_NAMESPACE, user_id))
+        acquired = cursor.fetchone()[0]
+        cursor.close()
+        if acquired:
+            return True, conn
+        conn.rollback()
+        conn.close()
+        return False, None
+    except Exception as e:
+        print(f"Error taking scrape lock: {e}")
+        conn.close()
+        return True, None
 
+def wait_for_user_scrape_pg(user_id, timeout_seconds):
+    """Blocks until another process releases the student's scrape lock. False on timeout."""
+    conn = get_db_connection()
+    if not conn: return False
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SET LOCAL statement_timeout = %s", (int(timeout_seconds * 1000),))
+        cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", (SCRAPE_LOCK_NAMESPACE, user_id))
+        return True
+    except psycopg2.Error:
+        return False
+    finally:
+        # Ending the transaction releases the lock straight away; we only needed to wait for it
+        conn.rollback()
+        cursor.close()
+        conn.close()
+
+def release_user_scrape_lock_pg(conn):
+    if not conn: return
+    try:
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"Error releasing scrape lock: {e}")
+
+@timing.timed("db.attendance_projections")
+def get_attendance_projections_pg(threshold, misses=0, semester=None):
+    """
+    Projects every attendance row in one pass and returns those below `threshold` (percent)
+    after `misses` more missed lectures, worst first. Mirrors attendance_forecast.project.
+    """
+    conn = get_db_connection()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            WITH p AS (
+                SELECT ar.user_id, u.full_name, u.prn, ar.semester, ar.subject_code,
+                       ar.attended, ar.conducted, ar.conducted + %(k)s AS held,
+                       %(t)s / 100.0 AS t
+                FROM attendance_records ar
+                JOIN users u ON u.id = ar.user_id
+                WHERE ar.conducted > 0
+                  AND (%(sem)s::int IS NULL OR ar.semester = %(sem)s::int)
+            )
+            SELECT user_id, full_name, prn, semester, subject_code, attended, conducted,
+                   attended * 100.0 / conducted AS percentage,
+                   attended * 100.0 / held AS projected,
+                   GREATEST(CEIL((t * held - attended) / NULLIF(1 - t, 0)), 0)::int AS must_attend
+            FROM p
+            WHERE attended * 100.0 / held < %(t)s
+            ORDER BY projected, full_name, subject_code
+        """, {"t": threshold, "k": misses, "sem": semester})
+        cols = [d[0] for d in cursor.description]
+        return [dict(zip(cols, [float(v) if k in ("percentage", "projected") else v for k, v in zip(cols, row)]))
+                for row in cursor.fetchall()]
+    except Exception as e:
+        print(f"Error projecting attendance: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+# --- Cohort Analytics (aggregated in SQL; cached by cohort_analytics.py) ---
+
+# Per-student percentage for every (subject, exam) plus a 'Total' row per subject
+_COHORT_MARKS_CTE = """
+    WITH per_exam AS (
+        SELECT user_id, subject_code, exam_type,
+               LEAST(marks / max_marks, 1) * 100 AS pct
+        FROM cie_marks
+        WHERE semester = %(sem)s AND max_marks > 0
+    ),
+    scores AS (
+        SELECT * FROM per_exam
+        UNION ALL
+        SELECT cm.user_id, cm.subject_code, 'Total',
+               LEAST(SUM(cm.marks) / SUM(cm.max_marks), 1) * 100
+        FROM cie_marks cm
+        WHERE cm.semester = %(sem)s AND cm.max_marks > 0
+        GROUP BY cm.user_id, cm.subject_code
+    )
+"""
+
+@timing.timed("db.cohort_marks_stats")
+def get_cohort_marks_stats_pg(semester, buckets=10):
+    """
+    Distribution of marks/max_marks (as %) per subject and exam for a semester:
+    {(subject_code, exam_type): {count, mean, min, p25, median, p75, p90, max, histogram}}.
+    histogram is a list of `buckets` equal-width counts over 0-100%.
+    """
+    conn = get_db_connection()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute(_COHORT_MARKS_CTE + """
+            , hist AS (
+                SELECT subject_code, exam_type,
+                       LEAST(width_bucket(pct, 0, 100, %(buckets)s), %(buckets)s) AS bucket, COUNT(*) AS n
+                FROM scores GROUP BY 1, 2, 3
+            ),
+            stats AS (
+                SELECT subject_code, exam_type, COUNT(*) AS n, AVG(pct) AS mean, MIN(pct) AS lo, MAX(pct) AS hi,
+                       percentile_cont(ARRAY[0.25, 0.5, 0.75, 0.9]) WITHIN GROUP (ORDER BY pct) AS q
+                FROM scores GROUP BY 1, 2
+            )
+            SELECT s.subject_code, s.exam_type, s.n, s.mean, s.lo, s.hi, s.q,
+                   (SELECT json_object_agg(h.bucket, h.n) FROM hist h
+                    WHERE h.subject_code = s.subject_code AND h.exam_type = s.exam_type)
+            FROM stats s
+            ORDER BY s.subject_code, s.exam_type
+        """, {"sem": semester, "buckets": buckets})
+        stats = {}
+        for sub, exam, n, mean, lo, hi, q, hist in cursor.fetchall():
+            stats[(sub, exam)] = {
+                "count": n, "mean": float(mean), "min": float(lo), "max": float(hi),
+                "p25": q[0], "median": q[1], "p75": q[2], "p90": q[3],
+                "histogram": [(hist or {}).get(str(b), 0) for b in range(1, buckets + 1)],
+            }
+        return stats
+    except Exception as e:
+        print(f"Error computing marks distribution: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+@timing.timed("db.cohort_standing")
+def get_cohort_standing_pg(user_id, semester):
+    """
+    Where one student sits in the class: {(subject_code, exam_type): (pct, percentile)},
+    percentile being the share of classmates scoring strictly lower (0-100).
+    """
+    conn = get_db_connection()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute(_COHORT_MARKS_CTE + """
+            , ranked AS (
+                SELECT user_id, subject_code, exam_type, pct,
+                       percent_rank() OVER (PARTITION BY subject_code, exam_type ORDER BY pct) * 100 AS pr
+                FROM scores
+            )
+            SELECT subject_code, exam_type, pct, pr FROM ranked WHERE user_id = %(uid)s
+        """, {"sem": semester, "uid": user_id})
+        return {(sub, exam): (float(pct), float(pr)) for sub, exam, pct, pr in cursor.fetchall()}
+    except Exception as e:
+        print(f"Error computing class standing: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+@timing.timed("db.cohort_attendance_stats")
+def get_cohort_attendance_stats_pg(semester, threshold=None, buckets=10):
+    """Attendance % distribution per subject: {subject_code: {count, mean, median, p10, below_threshold, histogram}}."""
+    if threshold is None: threshold = config.ATTENDANCE_THRESHOLD
+    conn = get_db_connection()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            WITH att AS (
+                SELECT subject_code, LEAST(attended::float8 / conducted, 1) * 100 AS pct
+                FROM attendance_records
+                WHERE semester = %(sem)s AND conducted > 0
+            ),
+            hist AS (
+                SELECT subject_code, LEAST(width_bucket(pct, 0, 100, %(buckets)s), %(buckets)s) AS bucket, COUNT(*) AS n
+                FROM att GROUP BY 1, 2
+            )
+            SELECT a.subject_code, COUNT(*), AVG(pct),
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY pct),
+                   percentile_cont(0.1) WITHIN GROUP (ORDER BY pct),
+                   COUNT(*) FILTER (WHERE pct < %(t)s),
+                   (SELECT json_object_agg(h.bucket, h.n) FROM hist h WHERE h.subject_code = a.subject_code)
+            FROM att a
+            GROUP BY a.subject_code
+            ORDER BY a.subject_code
+        """, {"sem": semester, "t": threshold, "buckets": buckets})
         return {
-            "semesters_data": full_data,
-            "latest_sem": latest_sem,
-            "scraped_at": last_scraped
+            sub: {
+                "count": n, "mean": float(mean), "median": median, "p10": p10, "below_threshold": below,
+                "histogram": [(hist or {}).get(str(b), 0) for b in range(1, buckets + 1)],
+            }
+            for sub, n, mean, median, p10, below, hist in cursor.fetchall()
         }
-
     except Exception as e:
-        print(f"Error fetching DB: {e}")
+        print(f"Error computing attendance distribution: {e}")
         return None
     finally:
         cursor.close()
         conn.close()
 
+LEADERBOARD_SQL = """
+    SELECT u.full_name, sp.sgpi
+    FROM student_performance sp
+    JOIN users u ON sp.user_id = u.id
+    WHERE sp.semester = %s
+    ORDER BY sp.sgpi DESC
+    LIMIT %s
+"""
+
+@timing.timed("db.leaderboard")
 def get_semester_leaderboard_pg(semester, limit=5):
     """Gets top students for a specific semester."""
     conn = get_db_connection()
     if not conn: return []
     cursor = conn.cursor()
     try:
-        cursor.execute("""
-            SELECT u.full_name, sp.sgpi
-            FROM student_performance sp
-            JOIN users u ON sp.user_id = u.id
-            WHERE sp.semester = %s
-            ORDER BY sp.sgpi DESC
-            LIMIT %s
-        """, (semester, limit))
+        cursor.execute(LEADERBOARD_SQL, (semester, limit))
         return cursor.fetchall()
     except Exception as e:
         print(f"Error fetching leaderboard: {e}")
@@ -0,0 +1,101 @@
+# derived_views.py
+import threading
+from collections import OrderedDict
+
+import attendance_forecast
+import config
+import grading
+import metrics
+import refresh_scheduler
+import timing
+
+# Snapshots kept in memory; each entry is a handful of small lists per semester
+VIEW_CACHE_SIZE = 256
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _attendance_rows(att_data):
+    rows = []
+    for sub, det in att_data.items():
+        # --- Formatting: Name (Code) ---
+        subject_name = config.SUBJECT_CODE_TO_NAME_MAP.get(sub, sub)
+        display_name = f"{subject_name} ({sub})"
+
+        att = det.get('attended', 0)
+        cond = det.get('conducted', 0)
+
+        forecast = attendance_forecast.project(att, cond)
+        if forecast:
+            rows.append({"Subject": display_name, "Attendance": f"{forecast['percentage']:.1f}%",
+                         f"Status(For {config.ATTENDANCE_THRESHOLD}%)": attendance_forecast.status_text(forecast)})
+    return rows
+
+def _marks_panels(marks_data):
+    panels = []
+    for sub, exams in marks_data.items():
+        subject_name = config.SUBJECT_CODE_TO_NAME_MAP.get(sub, sub)
+        lines = []
+        sub_total_obt = 0
+        sub_total_max = 0
+        for ex, val in exams.items():
+            if isinstance(val, dict):
+                o = val.get('obtained', 0)
+                m = val.get('max', 0)
+                lines.append(f"**{ex}:** {o} / {m}")
+                sub_total_obt += float(o)
+                sub_total_max += float(m)
+            else:
+                # Fallback for old data formats
+                lines.append(f"**{ex}:** {val}")
+        panels.append({
+            "title": f"{subject_name} ({sub})",
+            "lines": lines,
+            "total": f"**Total:** {sub_total_obt} / {sub_total_max}",
+        })
+    return panels
+
+def build_semester_view(sem_data):
+    """Everything the results page derives from one semester bucket."""
+    marks_data = sem_data.get('cie', {})
+    att_data = sem_data.get('att', {})
+
+    sgpi, grade_details, percentages = (None, [], {})
+    if marks_data:
+        with timing.span("compute_sgpi"):
+            sgpi, grade_details, percentages = grading.compute_semester_sgpi(marks_data)
+
+    return {
+        "sgpi": sgpi,
+        "grade_details": grade_details,
+        "breakdown": [
+            f"**{d['subject_name']}**: {percentages[d['subject_code']]:.1f}% → {d['grade_letter']} ({d['grade_point']})"
+            for d in grade_details
+        ],
+        "has_marks": bool(marks_data),
+        "attendance_rows": _attendance_rows(att_data),
+        "has_attendance": bool(att_data),
+        "marks_panels": _marks_panels(marks_data),
+    }
+
+def get_snapshot_views(semesters_data):
+    """
+    {sem: view} for a whole snapshot, memoized by the snapshot's content hash so
+    reruns, semester switches and identical snapshots never recompute.
+    """
+    key = refresh_scheduler.snapshot_hash(semesters_data)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            metrics.CACHE_LOOKUPS.inc(cache="derived_views", result="hit")
+            return _cache[key]
+    metrics.CACHE_LOOKUPS.inc(cache="derived_views", result="miss")
+
+    with timing.span("build_views"):
+        views = {sem: build_semester_view(sem_data) for sem, sem_data in semesters_data.items()}
+
+    with _cache_lock:
+        _cache[key] = views
+        while len(_cache) > VIEW_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return views
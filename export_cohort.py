@@ -0,0 +1,143 @@
+# export_cohort.py
+import os
+import time
+import argparse
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+import db_utils
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Rows pulled from the server-side cursor per round trip (and per Parquet row group)
+EXPORT_BATCH_ROWS = 5000
+
+# Every dataset is ordered by semester so only one output file is open at a time
+EXPORT_QUERIES = {
+    "cie_marks": """
+        SELECT cm.semester, cm.user_id, u.prn, u.full_name, cm.subject_code, cm.exam_type,
+               cm.marks::float8 AS marks, cm.max_marks::float8 AS max_marks, cm.scraped_at
+        FROM cie_marks cm JOIN users u ON u.id = cm.user_id
+        ORDER BY cm.semester
+    """,
+    "attendance_records": """
+        SELECT ar.semester, ar.user_id, u.prn, u.full_name, ar.subject_code,
+               ar.attended, ar.conducted, ar.percentage::float8 AS percentage, ar.updated_at
+        FROM attendance_records ar JOIN users u ON u.id = ar.user_id
+        ORDER BY ar.semester
+    """,
+    "student_performance": """
+        SELECT sp.semester, sp.user_id, u.prn, u.full_name, sp.sgpi,
+               sp.grade_details::text AS grade_details, sp.updated_at
+        FROM student_performance sp JOIN users u ON u.id = sp.user_id
+        ORDER BY sp.semester
+    """,
+}
+
+def _schema(dataset):
+    ts = pa.timestamp("us", tz="UTC")
+    common = [("semester", pa.int32()), ("user_id", pa.int32()), ("prn", pa.string()), ("full_name", pa.string())]
+    fields = {
+        "cie_marks": [("subject_code", pa.string()), ("exam_type", pa.string()),
+                      ("marks", pa.float64()), ("max_marks", pa.float64()), ("scraped_at", ts)],
+        "attendance_records": [("subject_code", pa.string()), ("attended", pa.int32()), ("conducted", pa.int32()),
+                               ("percentage", pa.float64()), ("updated_at", ts)],
+        "student_performance": [("sgpi", pa.float64()), ("grade_details", pa.string()), ("updated_at", ts)],
+    }
+    return pa.schema(common + fields[dataset])
+
+def _partition_path(out_dir, dataset, semester, ext):
+    path = os.path.join(out_dir, dataset, f"semester={semester}")
+    os.makedirs(path, exist_ok=True)
+    return os.path.join(path, f"part-0.{ext}")
+
+def _export_parquet(conn, dataset, sql, out_dir):
+    """Streams one query through a named (server-side) cursor into semester=N/part-0.parquet files."""
+    cursor = conn.cursor(name=f"export_{dataset}")
+    cursor.itersize = EXPORT_BATCH_ROWS
+    schema = _schema(dataset)
+    writer, current_sem, rows = None, None, 0
+    try:
+        cursor.execute(sql)
+        while True:
+            batch = cursor.fetchmany(EXPORT_BATCH_ROWS)
+            if not batch: break
+            # Split the batch where the semester changes
+            start = 0
+            while start < len(batch):
+                sem = batch[start][0]
+                end = start
+                while end < len(batch) and batch[end][0] == sem:
+                    end += 1
+                if sem != current_sem:
+                    if writer: writer.close()
+                    writer, current_sem = None, sem
+                columns = list(zip(*batch[start:end]))
+                table = pa.Table.from_pydict({f.name: list(col) for f, col in zip(schema, columns)}, schema=schema)
+                if writer is None:
+                    writer = pq.ParquetWriter(_partition_path(out_dir, dataset, sem, "parquet"), schema)
+                writer.write_table(table)
+                rows += end - start
+                start = end
+    finally:
+        if writer: writer.close()
+        cursor.close()
+    return rows
+
+def _export_csv(conn, dataset, sql, out_dir):
+    """Fallback without pyarrow: COPY ... TO STDOUT per semester, streamed straight to disk."""
+    cursor = conn.cursor()
+    rows = 0
+    try:
+        cursor.execute(f"SELECT DISTINCT semester FROM ({sql}) q")
+        for (sem,) in cursor.fetchall():
+            with open(_partition_path(out_dir, dataset, sem, "csv"), "w", encoding="utf-8", newline="") as f:
+                cursor.copy_expert(f"COPY (SELECT * FROM ({sql}) q WHERE semester = {int(sem)}) TO STDOUT WITH CSV HEADER", f)
+                rows += max(cursor.rowcount, 0)
+    finally:
+        cursor.close()
+    return rows
+
+def export_cohort(out_dir, datasets=None):
+    """
+    Writes <out_dir>/<dataset>/semester=<n>/part-0.parquet for the whole cohort.
+    Memory stays at one batch regardless of cohort size. Runs in one read-only
+    REPEATABLE READ transaction so all datasets come from the same snapshot.
+    """
+    datasets = datasets or list(EXPORT_QUERIES)
+    conn = db_utils.get_db_connection()
+    if not conn: return False
+    if pa is None:
+        print("pyarrow not installed (pip install pyarrow). Writing CSV partitions instead.")
+    try:
+        conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        for dataset in datasets:
+            start = time.perf_counter()
+            if pa is not None:
+                rows = _export_parquet(conn, dataset, EXPORT_QUERIES[dataset], out_dir)
+            else:
+                rows = _export_csv(conn, dataset, EXPORT_QUERIES[dataset], out_dir)
+            print(f"   ✅ {dataset}: {rows} rows in {time.perf_counter() - start:.1f}s")
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"Export failed: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exports the whole cohort to Parquet files partitioned by semester.")
+    parser.add_argument("out_dir", help="Output directory")
+    parser.add_argument("--only", choices=list(EXPORT_QUERIES), action="append", help="Export just this dataset (repeatable)")
+    args = parser.parse_args()
+
+    print(f"📦 Exporting to {args.out_dir}")
+    export_cohort(args.out_dir, args.only)
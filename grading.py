@@ -0,0 +1,66 @@
+# grading.py
+import math
+import config
+
+def calculate_grade_point(percentage):
+    """Maps percentage to Grade Point (GP)."""
+    if percentage >= 85.00: return 10
+    if 80.00 <= percentage <= 84.99: return 9
+    if 70.00 <= percentage <= 79.99: return 8
+    if 60.00 <= percentage <= 69.99: return 7
+    if 55.00 <= percentage <= 59.99: return 6
+    if 50.00 <= percentage <= 54.99: return 5
+    if 45.00 <= percentage <= 49.99: return 4
+    return 0
+
+GRADE_LETTERS = {10: "O", 9: "A", 8: "B", 7: "C", 6: "D", 5: "E", 4: "P"}
+
+def subject_credits(sub_name):
+    """Credits: Lab=1, Project=3, Theory=3"""
+    if "lab" in sub_name.lower(): return 1
+    if "project" in sub_name.lower(): return 3
+    return 3
+
+def compute_semester_sgpi(cie_data):
+    """
+    SGPI for one semester bucket of CIE marks.
+    Returns (sgpi or None, grade_details, percentages):
+    grade_details is what gets saved to student_performance,
+    percentages is {subject_code: unrounded percentage} for display.
+    """
+    total_credits = 0
+    weighted_gp = 0
+    grade_details = []
+    percentages = {}
+
+    for sub_code, exams in cie_data.items():
+        sub_name = config.SUBJECT_CODE_TO_NAME_MAP.get(sub_code, sub_code)
+        cred = subject_credits(sub_name)
+
+        obt_sum = 0.0
+        max_sum = 0.0
+        for ex, val in exams.items():
+            o = val.get('obtained', 0)
+            m = val.get('max', 0)
+            if isinstance(o, (int, float)):
+                obt_sum += o
+                max_sum += m if m > 0 else config.get_max_marks(sub_code, ex)
+
+        if max_sum > 0:
+            perc = (obt_sum / max_sum) * 100
+            rnd_perc = math.floor(perc + 0.5)
+            gp = calculate_grade_point(rnd_perc)
+
+            weighted_gp += (cred * gp)
+            total_credits += cred
+
+            grade_details.append({
+                "subject_code": sub_code, "subject_name": sub_name,
+                "percentage": float(f"{perc:.2f}"), "grade_point": gp,
+                "grade_letter": GRADE_LETTERS.get(gp, "F"), "credits": cred
+            })
+            percentages[sub_code] = perc
+
+    if total_credits == 0:
+        return None, grade_details, percentages
+    return weighted_gp / total_credits, grade_details, percentages
@@ -0,0 +1,218 @@
+# live_refresh.py
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import pytz
+
+import config
+import db_utils
+import web_scraper
+import timing
+import derived_views
+import page_archive
+
+# Shared by every Streamlit session in this server process
+_executor = ThreadPoolExecutor(max_workers=config.LIVE_REFRESH_WORKERS, thread_name_prefix="live-refresh")
+_inflight = {}  # user_id -> RefreshHandle
+_inflight_lock = threading.Lock()
+
+def scrape_fresh_data(user_details, on_progress=None, known=None, stats=None, archive=None):
+    """
+    Scrapes data and organizes it.
+    - Default: Uses the Semester found on the Welcome Page (e.g., 7).
+    - Exception: Moves 'CSC8...', 'CSDC8...', 'CSDL8...' subjects to Semester 8.
+    on_progress(organized_data) is called after every subject page, for streaming UIs.
+    known: the stored snapshot per subject (web_scraper.known_subjects), lets unchanged
+    subjects be taken from the dashboard without their detail pages.
+    stats: filled by web_scraper.iter_subject_data (fetched / skipped / signatures / verified).
+    archive: page_archive.Recorder that keeps the raw pages.
+    """
+
+    # 1. Login and get the Dashboard HTML
+    session, html = web_scraper.login_and_get_welcome_page(
+        user_details["prn"], user_details["dob_day"],
+        user_details["dob_month"], user_details["dob_year"],
+        user_details["full_name"]
+    )
+    if not html: return None
+    if archive: archive.add("dashboard", None, (html.encode("utf-8"), "utf-8"))
+
+    # 2. Extract the Default Semester from the Dashboard
+    dashboard = web_scraper.parse_dashboard(html)
+    dashboard_sem = web_scraper.extract_student_semester(dashboard)
+    if not dashboard_sem:
+        dashboard_sem = 0
+
+    # 3. Scrape subject by subject, organizing as we go (Hybrid Logic)
+    organized_data = {}
+
+    for kind, sub, payload in web_scraper.iter_subject_data(session, dashboard, known, stats, user_details["prn"],
+                                                         on_page=archive.add if archive else None):
+        with timing.span("bucket_semesters"):
+            sem = web_scraper.semester_for_subject(sub, dashboard_sem)
+            if sem == 0: continue # Skip if invalid
+
+            if sem not in organized_data:
+                organized_data[sem] = {'cie': {}, 'att': {}}
+            organized_data[sem][kind][sub] = payload
+
+        if on_progress:
+            on_progress(organized_data)
+
+    return {
+        "semesters_data": organized_data,
+        "scraped_at": datetime.now(pytz.utc)
+    }
+
+def scrape_and_save(user_details, on_progress=None):
+    """Live scrape + save Marks & Attendance. Returns the display package or None."""
+    known = None
+    if config.DASHBOARD_FAST_MODE:
+        known = web_scraper.known_subjects(db_utils.get_student_data_from_db(user_details["id"]),
+                                           db_utils.get_dashboard_signatures_pg(user_details["id"]))
+    stats = {}
+    archive = page_archive.Recorder(user_details["id"])
+    result = scrape_fresh_data(user_details, on_progress, known, stats, archive)
+    archive.flush()
+    if not result: return None
+
+    all_saved = True
+    for sem, data in result["semesters_data"].items():
+        if data['cie'] and not db_utils.update_student_marks_in_db_pg(
+            user_details["id"], sem, data['cie'], result["scraped_at"]
+        ):
+            all_saved = False
+        if data['att'] and not db_utils.update_attendance_in_db_pg(
+            user_details["id"], sem, data['att']
+        ):
+            all_saved = False
+
+    # Signatures vouch for the saved rows, so a failed upsert must not record them
+    if all_saved:
+        db_utils.save_dashboard_signatures_pg(user_details["id"], stats.get("signatures"), stats.get("verified", ()))
+
+    # SGPI is saved once per scrape here, not on every page rerun
+    for sem, view in derived_views.get_snapshot_views(result["semesters_data"]).items():
+        if view["sgpi"] is not None:
+            db_utils.save_student_sgpi_pg(user_details["id"], sem, view["sgpi"], view["grade_details"])
+
+    # Add latest_sem logic for display
+    result["latest_sem"] = max(result["semesters_data"].keys()) if result["semesters_data"] else None
+    return result
+
+def scrape_and_save_single_flight(user_details, on_progress=None):
+    """
+    Cross-replica single flight: only the replica holding the student's advisory lock
+    scrapes. Others wait for it and reuse the snapshot it saved.
+    (Within one process, submit_refresh already merges callers onto one future.)
+    """
+    user_id = user_details["id"]
+    requested_at = datetime.now(pytz.utc)
+
+    acquired, lock_conn = db_utils.try_lock_user_scrape_pg(user_id)
+    if not acquired:
+        print(f"Scrape for user {user_id} already running on another replica. Waiting for it.")
+        db_utils.wait_for_user_scrape_pg(user_id, config.SCRAPE_LOCK_WAIT_SECONDS)
+        shared = db_utils.get_student_data_from_db(user_id)
+        # Only reuse it if the other scrape actually saved something after we asked
+        if shared and shared.get("scraped_at") and shared["scraped_at"] >= requested_at:
+            return shared
+        acquired, lock_conn = db_utils.try_lock_user_scrape_pg(user_id)
+        if not acquired:
+            # Still held (slow or stuck scrape elsewhere): don't scrape unlocked
+            print(f"Scrape for user {user_id} still running on another replica. Giving up.")
+            return None
+
+    try:
+        return scrape_and_save(user_details, on_progress)
+    finally:
+        db_utils.release_user_scrape_lock_pg(lock_conn)
+
+class RefreshHandle:
+    """In-process refresh: the future plus the subjects scraped so far."""
+    def __init__(self):
+        self.future = None
+        self._partial = {}
+        self._lock = threading.Lock()
+
+    def publish(self, organized_data):
+        snapshot = {sem: {'cie': dict(b['cie']), 'att': dict(b['att'])} for sem, b in organized_data.items()}
+        with self._lock:
+            self._partial = snapshot
+
+    def partial(self):
+        """{sem: {'cie': ..., 'att': ...}} of the subjects that have arrived so far."""
+        with self._lock:
+            return self._partial
+
+    def done(self):
+        return self.future.done()
+
+    def result(self):
+        return self.future.result()
+
+def _run_refresh(user_details, handle):
+    """Worker-thread body. Spans are collected here since the UI thread can't see them."""
+    spans = timing.start_collecting()
+    try:
+        result = scrape_and_save_single_flight(user_details, handle.publish)
+    except Exception as e:
+        print(f"Live refresh failed for user {user_details['id']}: {e}")
+        result = None
+    finally:
+        timing.stop_collecting()
+    if result:
+        result["timings"] = spans
+    return result
+
+def submit_refresh(user_details):
+    """
+    Starts a background live refresh, or returns the one already running for this user,
+    so repeated clicks / several tabs share a single scrape.
+    """
+    user_id = user_details["id"]
+    with _inflight_lock:
+        handle = _inflight.get(user_id)
+        if handle is not None and not handle.done():
+            return handle
+        handle = RefreshHandle()
+        handle.future = _executor.submit(_run_refresh, user_details, handle)
+        _inflight[user_id] = handle
+
+    def _forget(done_future):
+        with _inflight_lock:
+            if _inflight.get(user_id) is handle:
+                del _inflight[user_id]
+    handle.future.add_done_callback(_forget)
+    return handle
+
+class QueuedRefresh:
+    """Future-like handle for a refresh run by scrape_worker.py (SCRAPE_JOB_QUEUE mode)."""
+    def __init__(self, job_id, user_id):
+        self.job_id = job_id
+        self.user_id = user_id
+        self._status = "queued"
+
+    def done(self):
+        if self._status in ("done", "failed"): return True
+        job = db_utils.get_scrape_job_pg(self.job_id)
+        self._status = job["status"] if job else "failed"
+        return self._status in ("done", "failed")
+
+    def partial(self):
+        # The worker doesn't stream progress back through the DB
+        return {}
+
+    def result(self):
+        if self._status != "done": return None
+        # The worker saved the fresh scrape; read it back
+        return db_utils.get_student_data_from_db(self.user_id)
+
+def request_refresh(user_details):
+    """Entry point for the UI: queue the refresh for a worker, or run it on an app thread."""
+    if config.SCRAPE_JOB_QUEUE:
+        job_id = db_utils.enqueue_scrape_job_pg(user_details["id"])
+        if job_id:
+            return QueuedRefresh(job_id, user_details["id"])
+        print("Could not queue scrape job. Running it in-process instead.")
+    return submit_refresh(user_details)
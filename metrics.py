@@ -0,0 +1,163 @@
+# metrics.py
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+import timing
+
+# Seconds. Covers fast parses (ms) up to slow portal pages (30s+)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+def _format_labels(labelnames, values):
+    if not labelnames: return ""
+    pairs = ",".join(f'{k}="{str(v)}"' for k, v in zip(labelnames, values))
+    return "{" + pairs + "}"
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(k, "") for k in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_series(key, value))
+        return lines
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def _render_series(self, key, state):
+        lines = []
+        names = self.labelnames + ("le",)
+        for bound, count in zip(self.buckets, state["counts"]):
+            lines.append(f"{self.name}_bucket{_format_labels(names, key + (bound,))} {count}")
+        lines.append(f"{self.name}_bucket{_format_labels(names, key + ('+Inf',))} {state['count']}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state['sum']}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state['count']}")
+        return lines
+
+# --- Metric Definitions ---
+
+PORTAL_REQUESTS = Counter("contineo_portal_requests_total", "Portal HTTP requests by page type and outcome", ("page_type", "outcome"))
+PORTAL_REQUEST_SECONDS = Histogram("contineo_portal_request_seconds", "Portal HTTP request latency", ("page_type",))
+DETAIL_PAGES = Counter("contineo_detail_pages_total", "Subject detail pages fetched vs answered from the dashboard", ("page_type", "result"))
+LAYOUT_LOOKUPS = Counter("contineo_layout_lookups_total", "Dashboard layout detection: remembered layout hit, probed, or none matched", ("kind", "result"))
+PORTAL_BODY_BYTES = Counter("contineo_portal_body_bytes_total", "Detail page bytes read by streaming fetches (partial = stopped early)", ("page_type", "read"))
+PORTAL_HEDGES = Counter("contineo_portal_hedged_requests_total", "Backup requests fired after p95, and how often the backup won", ("page_type", "result"))
+PORTAL_BREAKER_STATE = Gauge("contineo_portal_breaker_open", "1 while the portal circuit breaker is open (0 closed, 0.5 half-open)")
+PORTAL_BREAKER_REJECTED = Counter("contineo_portal_breaker_rejected_total", "Portal requests failed fast by the open circuit breaker", ("page_type",))
+LOGINS = Counter("contineo_portal_logins_total", "Portal login attempts by result", ("result",))
+PARSE_SECONDS = Histogram("contineo_parse_seconds", "HTML parse duration by stage", ("stage",))
+DB_CALL_SECONDS = Histogram("contineo_db_call_seconds", "Duration of db_utils calls (db.connect = connection time)", ("call",))
+DB_ROWS_UPSERTED = Counter("contineo_db_rows_upserted_total", "Rows written per table", ("table",))
+CACHE_LOOKUPS = Counter("contineo_cache_lookups_total", "Snapshot lookups served from cache (hit) or the portal (miss)", ("cache", "result"))
+BATCH_STUDENTS = Counter("contineo_batch_students_total", "Students processed by update_all", ("result",))
+BATCH_THROUGHPUT = Gauge("contineo_batch_students_per_minute", "update_all throughput for the current run")
+
+def _on_span(stage, duration_ms, status):
+    """Feeds timing spans into the matching histograms."""
+    seconds = duration_ms / 1000
+    kind, _, rest = stage.partition(".")
+    if kind == "fetch":
+        page_type = rest.split(".")[0]
+        PORTAL_REQUEST_SECONDS.observe(seconds, page_type=page_type)
+        PORTAL_REQUESTS.inc(page_type=page_type, outcome=status)
+    elif kind == "parse":
+        PARSE_SECONDS.observe(seconds, stage=rest)
+    elif kind == "db":
+        DB_CALL_SECONDS.observe(seconds, call=rest)
+
+timing.add_listener(_on_span)
+
+# --- Exposition ---
+
+def render():
+    """Prometheus text exposition format (version 0.0.4)."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep scrapes out of the console
+
+_server = None
+
+def start_metrics_server(port=None, host="0.0.0.0"):
+    """Serves /metrics on a daemon thread. Safe to call more than once (first call wins)."""
+    global _server
+    port = port if port is not None else config.METRICS_PORT
+    if _server or not port: return _server
+    try:
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"Metrics server not started on port {port}: {e}")
+        return None
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    print(f"📈 Metrics available at http://localhost:{port}/metrics")
+    return _server
@@ -0,0 +1,191 @@
+# page_archive.py
+import os
+import zlib
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+import config
+import db_utils
+import grading
+import web_scraper
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Blob suffix per codec; zlib is only used when zstandard isn't installed
+_ZSTD_SUFFIX = ".zst"
+_ZLIB_SUFFIX = ".zz"
+
+def _blob_path(archive_dir, content_hash, suffix):
+    return os.path.join(archive_dir, "objects", content_hash[:2], content_hash[2:] + suffix)
+
+def store_blob(content, archive_dir=None):
+    """
+    Stores raw page bytes under their sha256 and returns the hash.
+    Identical pages (most re-scrapes) are written once, however many runs see them.
+    """
+    archive_dir = archive_dir or config.PAGE_ARCHIVE_DIR
+    content_hash = hashlib.sha256(content).hexdigest()
+    for suffix in (_ZSTD_SUFFIX, _ZLIB_SUFFIX):
+        if os.path.exists(_blob_path(archive_dir, content_hash, suffix)):
+            return content_hash
+
+    if zstandard is not None:
+        suffix, data = _ZSTD_SUFFIX, zstandard.ZstdCompressor(level=config.PAGE_ARCHIVE_ZSTD_LEVEL).compress(content)
+    else:
+        suffix, data = _ZLIB_SUFFIX, zlib.compress(content, 6)
+
+    path = _blob_path(archive_dir, content_hash, suffix)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write-then-rename so concurrent writers never expose a partial blob
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return content_hash
+
+def load_blob(content_hash, archive_dir=None):
+    archive_dir = archive_dir or config.PAGE_ARCHIVE_DIR
+    path = _blob_path(archive_dir, content_hash, _ZSTD_SUFFIX)
+    if os.path.exists(path):
+        if zstandard is None:
+            raise RuntimeError("Archive blob is zstd-compressed; pip install zstandard to read it")
+        with open(path, "rb") as f:
+            return zstandard.ZstdDecompressor().decompress(f.read())
+    with open(_blob_path(archive_dir, content_hash, _ZLIB_SUFFIX), "rb") as f:
+        return zlib.decompress(f.read())
+
+class Recorder:
+    """
+    Collects the pages of one student's scrape. add() stores the blob right away;
+    flush() writes the index rows in one round trip. No-op when PAGE_ARCHIVE_DIR is unset.
+    """
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.enabled = bool(config.PAGE_ARCHIVE_DIR)
+        self._rows = []
+
+    def add(self, page_type, subject, raw):
+        """raw = (bytes, encoding), as returned by web_scraper.fetch_detail_page."""
+        if not self.enabled or not raw: return
+        content, encoding = raw
+        try:
+            content_hash = store_blob(content)
+        except OSError as e:
+            print(f"Page archive write failed: {e}")
+            return
+        self._rows.append((self.user_id, page_type, subject or "", content_hash, encoding))
+
+    def flush(self):
+        if self._rows:
+            db_utils.record_archived_pages_pg(self._rows)
+            self._rows = []
+
+# --- Offline Re-parse ---
+
+def _parse_archived_page(archive_dir, page_type, content_hash, encoding):
+    """Worker-process body: decompress + parse one archived page."""
+    raw = (load_blob(content_hash, archive_dir), encoding)
+    if page_type == "dashboard":
+        dashboard = web_scraper.parse_dashboard(raw[0].decode(encoding or "utf-8", errors="replace"))
+        return {
+            "sem": web_scraper.extract_student_semester(dashboard) or 0,
+            # Subjects still linked from the dashboard; older detail pages are left out
+            "ciedetails": {sub.strip() for sub in web_scraper.get_cie_detail_urls(dashboard)},
+            "attendencelist": set(web_scraper.get_attendance_detail_urls(dashboard)),
+        }
+    return web_scraper.parse_detail_page(page_type, raw)
+
+def reparse(user_id=None, workers=None, dry_run=False):
+    """
+    Rebuilds cie_marks / attendance_records (and SGPI) from the newest archived version
+    of every page still linked from the student's newest archived dashboard, parsing in
+    a process pool. No portal traffic.
+    """
+    archive_dir = config.PAGE_ARCHIVE_DIR
+    if not archive_dir:
+        print("❌ PAGE_ARCHIVE_DIR is not set.")
+        return
+    pages = db_utils.get_latest_archived_pages_pg(user_id)
+    if not pages:
+        print("Nothing archived yet.")
+        return
+    print(f"🗃️ Re-parsing {len(pages)} archived pages with {workers or os.cpu_count()} processes...")
+
+    by_user = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            (uid, page_type, subject, scraped_at,
+             pool.submit(_parse_archived_page, archive_dir, page_type, content_hash, encoding))
+            for uid, page_type, subject, content_hash, encoding, scraped_at in pages
+        ]
+        for uid, page_type, subject, scraped_at, future in futures:
+            entry = by_user.setdefault(uid, {"dashboard": None, "pages": [], "cie": {}, "att": {}, "scraped_at": scraped_at})
+            entry["scraped_at"] = max(entry["scraped_at"], scraped_at)
+            try:
+                parsed = future.result()
+            except Exception as e:
+                print(f"   ⚠️ User {uid}: could not re-parse {page_type} {subject}: {e}")
+                continue
+            if page_type == "dashboard":
+                entry["dashboard"] = parsed
+            elif parsed:
+                entry["pages"].append((page_type, subject, parsed))
+
+    for uid, entry in list(by_user.items()):
+        dashboard = entry["dashboard"]
+        if not dashboard:
+            print(f"   ⚠️ User {uid}: no archived dashboard, skipped")
+            del by_user[uid]
+            continue
+        entry["sem"] = dashboard["sem"]
+        # The newest page of a subject that has since left the dashboard belongs to an
+        # earlier semester; filing it under the current one would overwrite good rows
+        dropped = 0
+        for page_type, subject, parsed in entry["pages"]:
+            if subject not in dashboard[page_type]:
+                dropped += 1
+                continue
+            entry["cie" if page_type == "ciedetails" else "att"][subject] = parsed
+        if dropped:
+            print(f"   🗑️ User {uid}: ignored {dropped} pages for subjects no longer on the dashboard")
+
+    for uid, entry in by_user.items():
+        organized = {}
+        for kind in ("cie", "att"):
+            for sub, data in entry[kind].items():
+                sem = web_scraper.semester_for_subject(sub, entry["sem"])
+                if sem == 0: continue
+                organized.setdefault(sem, {'cie': {}, 'att': {}})[kind][sub] = data
+
+        print(f"   👤 User {uid}: " + ", ".join(
+            f"Sem {sem} ({len(d['cie'])} marks, {len(d['att'])} attendance)" for sem, d in sorted(organized.items())))
+        if dry_run: continue
+        for sem, data in organized.items():
+            if data['cie']:
+                db_utils.update_student_marks_in_db_pg(uid, sem, data['cie'], entry["scraped_at"])
+                sgpi, grade_details, _ = grading.compute_semester_sgpi(data['cie'])
+                if sgpi is not None:
+                    db_utils.save_student_sgpi_pg(uid, sem, sgpi, grade_details)
+            if data['att']:
+                db_utils.update_attendance_in_db_pg(uid, sem, data['att'])
+    print(f"✅ Re-parsed {len(by_user)} students" + (" (dry run, nothing saved)" if dry_run else ""))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Raw page archive tools.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rp = sub.add_parser("reparse", help="Rebuild marks/attendance from archived pages (no portal traffic)")
+    rp.add_argument("--user-id", type=int, default=None, help="Only this student")
+    rp.add_argument("--workers", type=int, default=None, help="Parser processes (default: all cores)")
+    rp.add_argument("--dry-run", action="store_true", help="Parse and report, but don't write to the DB")
+    args = parser.parse_args()
+
+    if args.command == "reparse":
+        reparse(args.user_id, args.workers, args.dry_run)
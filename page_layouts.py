@@ -0,0 +1,119 @@
+# page_layouts.py
+import re
+import threading
+from collections import OrderedDict
+
+import metrics
+
+# Students whose winning layout is remembered (per process)
+LAYOUT_MEMORY_SIZE = 5000
+
+_strategies = {}           # kind -> OrderedDict(name -> fn(soup) -> {subject: url})
+_remembered = OrderedDict()  # (kind, key) -> strategy name
+_last_winner = {}          # kind -> strategy name (cohort-wide guess for unseen students)
+_lock = threading.Lock()
+
+def register(kind, name):
+    """
+    Decorator: adds a layout strategy. Strategies are probed in registration order
+    and must return a non-empty {subject: url} dict when their layout matches.
+    Plugins can register new layouts from any module imported before scraping.
+    """
+    def decorator(fn):
+        _strategies.setdefault(kind, OrderedDict())[name] = fn
+        return fn
+    return decorator
+
+def _probe_order(kind, key):
+    names = list(_strategies.get(kind, {}))
+    with _lock:
+        first = [_remembered.get((kind, key)), _last_winner.get(kind)]
+    preferred = [n for n in dict.fromkeys(first) if n in names]
+    return preferred + [n for n in names if n not in preferred]
+
+def extract(kind, soup, key=None):
+    """
+    Runs the strategies of `kind` against a parsed page, starting with the one that
+    last worked for `key` (e.g. a PRN), then the last cohort-wide winner, then the rest.
+    Returns (subject_urls, strategy_name); ({}, None) when no layout matches.
+    """
+    for position, name in enumerate(_probe_order(kind, key)):
+        try:
+            result = _strategies[kind][name](soup)
+        except Exception as e:
+            print(f"Layout strategy {kind}/{name} failed: {e}")
+            result = None
+        if result:
+            remember(kind, key, name)
+            metrics.LAYOUT_LOOKUPS.inc(kind=kind, result="hit" if position == 0 else "probe")
+            return result, name
+    metrics.LAYOUT_LOOKUPS.inc(kind=kind, result="none")
+    return {}, None
+
+def remember(kind, key, name):
+    with _lock:
+        _last_winner[kind] = name
+        if key is None: return
+        _remembered[(kind, key)] = name
+        _remembered.move_to_end((kind, key))
+        while len(_remembered) > LAYOUT_MEMORY_SIZE:
+            _remembered.popitem(last=False)
+
+def forget(key=None):
+    """Drops remembered layouts for one key, or everything."""
+    with _lock:
+        if key is None:
+            _remembered.clear()
+            _last_winner.clear()
+        else:
+            for k in [k for k in _remembered if k[1] == key]:
+                del _remembered[k]
+
+# --- Built-in Layouts ---
+
+def _rows_with_links(container, task):
+    """{first cell text: href} for every table row in container linking to task."""
+    subject_urls = {}
+    for link in container.find_all("a", href=re.compile(f"task={task}")):
+        row = link.find_parent("tr")
+        if row:
+            cols = row.find_all("td")
+            if cols:
+                subject = cols[0].get_text(strip=True)
+                if subject:
+                    subject_urls[subject] = link['href']
+    return subject_urls
+
+# Every linked row on the page, so pages mixing dash_even_row and dash_od_row tables
+# keep all their subjects; tabs are only used when there are no such rows
+@register("attendance_links", "rows")
+def _attendance_rows(soup):
+    return _rows_with_links(soup, "attendencelist")
+
+@register("attendance_links", "uk_tab")
+def _attendance_tabs(soup):
+    tab_container = soup.find("ul", attrs={"uk-tab": ""})
+    if not tab_container: return {}
+    subject_urls = {}
+    for tab in tab_container.find_all("li"):
+        link_tag = tab.find("a")
+        if link_tag and link_tag.get('href', '#') not in ('', '#'):
+            subject = link_tag.get_text(strip=True)
+            if subject:
+                subject_urls[subject] = link_tag['href']
+    return subject_urls
+
+@register("cie_links", "href_rows")
+def _cie_href_rows(soup):
+    return _rows_with_links(soup, "ciedetails")
+
+@register("cie_links", "onclick")
+def _cie_onclick(soup):
+    subject_urls = {}
+    for tab in soup.find_all("a", onclick=re.compile(r"task=ciedetails")):
+        match = re.search(r"href=['\"](.*?)['\"]", tab['onclick'])
+        if match:
+            subject = tab.get_text(strip=True)
+            if subject:
+                subject_urls[subject] = match.group(1)
+    return subject_urls
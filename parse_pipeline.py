@@ -0,0 +1,132 @@
+# parse_pipeline.py
+import os
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import config
+import web_scraper
+
+class ParsePipeline:
+    """
+    Fetcher for web_scraper.iter_subject_data that splits a student's detail pages into
+      fetch stage: PORTAL_MAX_CONCURRENCY threads doing the HTTP requests
+      parse stage: a ProcessPoolExecutor running web_scraper.parse_detail_page on the raw bytes
+    with a bounded queue between them, so fetchers block when parsers fall behind.
+    One pipeline (and one process pool) is reused for a whole batch run.
+    """
+    def __init__(self, parse_workers=None, fetch_workers=None, queue_size=None):
+        self.parse_workers = parse_workers or config.PARSE_WORKERS or os.cpu_count() or 1
+        self.fetch_workers = fetch_workers or config.PORTAL_MAX_CONCURRENCY
+        self.queue_size = queue_size or config.PARSE_QUEUE_SIZE
+        self._pool = ProcessPoolExecutor(max_workers=self.parse_workers)
+
+    def __call__(self, session, pages, on_page=None):
+        if not pages: return
+        raw_pages = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()  # Set when the consumer stops early, so fetchers don't block forever
+
+        def put(entry):
+            while not stop.is_set():
+                try:
+                    raw_pages.put(entry, timeout=0.5)  # Blocks while the queue is full (backpressure)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def fetch_one(page):
+            if stop.is_set(): return page, None
+            return page, web_scraper.fetch_detail_page(session, web_scraper.DETAIL_PAGE_TYPES[page[0]], page[2])
+
+        def fetch_all():
+            try:
+                with ThreadPoolExecutor(max_workers=self.fetch_workers, thread_name_prefix="fetch") as fetch_pool:
+                    for page, raw in fetch_pool.map(fetch_one, pages):
+                        if not put((page, raw)): break
+            finally:
+                put(None)
+
+        threading.Thread(target=fetch_all, daemon=True).start()
+
+        in_flight = {}
+        fetching = True
+        try:
+            while fetching or in_flight:
+                # Hand newly fetched pages to the parsers
+                while fetching:
+                    try:
+                        entry = raw_pages.get(timeout=0.05 if in_flight else None)
+                    except queue.Empty:
+                        break
+                    if entry is None:
+                        fetching = False
+                        break
+                    (kind, subject, url), raw = entry
+                    if raw is not None and on_page:
+                        on_page(web_scraper.DETAIL_PAGE_TYPES[kind], subject, raw)
+                    if raw is not None:
+                        future = self._pool.submit(web_scraper.parse_detail_page, web_scraper.DETAIL_PAGE_TYPES[kind], raw)
+                        in_flight[future] = (kind, subject, url)
+
+                if not in_flight: continue
+                done, _ = wait(list(in_flight), timeout=0 if fetching else None, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, subject, url = in_flight.pop(future)
+                    try:
+                        data = future.result()
+                    except Exception as e:
+                        print(f"Error parsing {kind} page {url}: {e}")
+                        continue
+                    if data:
+                        yield kind, subject, data
+        finally:
+            # Consumer done, failed or closed the generator: release the fetch thread
+            stop.set()
+            for future in in_flight:
+                future.cancel()
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+# --- Benchmark ---
+
+def _synthetic_cie_page(rows=400):
+    """A CIE detail page with the chart script plus a padded table, roughly portal-sized."""
+    exams = ["MSE", "TH-ISE1", "TH-ISE2", "ESE"]
+    chart = ",".join(f'{{"xaxis": "{e}", "maxmarks": 20, "optainmarks": {10 + i}}}' for i, e in enumerate(exams))
+    header = "".join(f"<th>{e}</th>" for e in exams)
+    cells = "".join(f"<td>{10 + i}/20</td>" for i in range(len(exams)))
+    filler = "".join(f"<tr><td>row {i}</td><td>{'x' * 40}</td></tr>" for i in range(rows))
+    html = (f"<html><body><script>var chartData = [{chart}];</script>"
+            f"<table class='cn-cie-table'><thead><tr>{header}</tr></thead><tbody><tr>{cells}</tr></tbody></table>"
+            f"<table>{filler}</table></body></html>")
+    return html.encode("utf-8"), "utf-8"
+
+def benchmark(pages=400, max_workers=None):
+    """Parses the same synthetic page `pages` times with 1, 2, 4... processes and prints pages/s."""
+    raw = _synthetic_cie_page()
+    max_workers = max_workers or os.cpu_count() or 1
+    counts = sorted({1, max_workers} | {2 ** i for i in range(1, max_workers.bit_length()) if 2 ** i < max_workers})
+
+    print(f"Parsing {pages} CIE pages ({len(raw[0]) // 1024} KB each) on {os.cpu_count()} cores")
+    baseline = None
+    for workers in counts:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(web_scraper.parse_detail_page, ["ciedetails"] * workers, [raw] * workers))  # Warm up
+            start = time.perf_counter()
+            list(pool.map(web_scraper.parse_detail_page, ["ciedetails"] * pages, [raw] * pages, chunksize=8))
+            elapsed = time.perf_counter() - start
+        rate = pages / elapsed
+        baseline = baseline or rate
+        print(f"   {workers:>2} process(es): {rate:8.1f} pages/s  ({rate / baseline:.2f}x)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the process-pool parse stage.")
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--max-workers", type=int, default=None)
+    args = parser.parse_args()
+
+    benchmark(args.pages, args.max_workers)
@@ -0,0 +1,451 @@
+# portal_http.py
+import random
+import threading
+import time
+from collections import deque
+from importlib.util import find_spec
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+import config
+import timing
+import metrics
+import db_utils
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# urllib3 decodes 'br' only when one of these is installed
+if find_spec("brotli") or find_spec("brotlicffi"):
+    ACCEPT_ENCODING = "gzip, deflate, br"
+else:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+# Status codes worth retrying: rate limiting and server-side hiccups
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# --- Transport ---
+
+def _default_headers():
+    return {
+        "User-Agent": config.PORTAL_USER_AGENT,
+        "Referer": config.LOGIN_URL,
+        "Accept-Encoding": ACCEPT_ENCODING,
+    }
+
+class LatencyTracker:
+    """Rolling window of successful request latencies (seconds) per page type."""
+    def __init__(self, window):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, page_type, seconds):
+        with self._lock:
+            samples = self._samples.get(page_type)
+            if samples is None:
+                samples = self._samples[page_type] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, page_type, p, min_samples=None):
+        """None until min_samples latencies have been seen for this page type."""
+        if min_samples is None: min_samples = config.PORTAL_LATENCY_MIN_SAMPLES
+        with self._lock:
+            values = list(self._samples.get(page_type, ()))
+        if len(values) < min_samples: return None
+        return timing.percentile(values, p)
+
+    def snapshot(self):
+        """{page_type: (count, p50, p95)} for logs / debugging."""
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._samples.items()]
+        return {k: (len(v), timing.percentile(v, 50), timing.percentile(v, 95)) for k, v in items}
+
+latency = LatencyTracker(config.PORTAL_LATENCY_WINDOW)
+
+def timeout_for(page_type=None):
+    """
+    (connect, read) timeout tuple for a page type. The configured read timeout is the
+    ceiling; once enough samples exist it tightens to p95 * PORTAL_TIMEOUT_P95_MULTIPLIER.
+    """
+    read = config.PORTAL_READ_TIMEOUTS.get(page_type, config.PORTAL_READ_TIMEOUTS["default"])
+    if config.PORTAL_ADAPTIVE_TIMEOUTS:
+        p95 = latency.percentile(page_type, 95)
+        if p95 is not None:
+            read = min(read, max(config.PORTAL_MIN_READ_TIMEOUT, p95 * config.PORTAL_TIMEOUT_P95_MULTIPLIER))
+    return (config.PORTAL_CONNECT_TIMEOUT, read)
+
+class _HttpxSession:
+    """Minimal requests.Session look-alike over an HTTP/2 httpx.Client."""
+    def __init__(self, pool_size):
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self._client = httpx.Client(http2=True, limits=limits, follow_redirects=True, headers=_default_headers())
+        self.headers = self._client.headers
+
+    def request(self, method, url, timeout=None, **kwargs):
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            timeout = httpx.Timeout(read, connect=connect)
+        return self._client.request(method, url, timeout=timeout, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        self._client.close()
+
+def new_session(pool_size=None):
+    """
+    Portal session with a keep-alive pool sized for the concurrency level and
+    compressed responses. Retries are handled by request(), not the adapter.
+    """
+    pool_size = pool_size or config.PORTAL_MAX_CONCURRENCY
+    if config.PORTAL_HTTP2:
+        if httpx is not None:
+            return _HttpxSession(pool_size)
+        print("PORTAL_HTTP2 is set but httpx is not installed. Falling back to requests.")
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(_default_headers())
+    return session
+
+# --- Retry Policy ---
+
+def is_transient(exc):
+    """
+    Transient = worth retrying (timeouts, dropped connections, 5xx).
+    Anything else (4xx, bad credentials, parse errors) is permanent.
+    """
+    if isinstance(exc, (requests.exceptions.Timeout,
+                        requests.exceptions.ConnectionError,
+                        requests.exceptions.ChunkedEncodingError)):
+        return True
+    if isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+        return exc.response.status_code in TRANSIENT_STATUS_CODES
+    if httpx is not None:
+        if isinstance(exc, httpx.TransportError):
+            return True
+        if isinstance(exc, httpx.HTTPStatusError):
+            return exc.response.status_code in TRANSIENT_STATUS_CODES
+    return False
+
+class RetryBudget:
+    """
+    Caps the number of retries so a portal outage can't turn into a retry storm.
+    window_seconds=None: the budget lasts until reset (one batch run).
+    window_seconds=N: sliding window for long-lived processes (Streamlit).
+    """
+    def __init__(self, limit, window_seconds=None):
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self._spent = deque()
+        self._lock = threading.Lock()
+
+    def try_spend(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.window_seconds:
+                while self._spent and now - self._spent[0] > self.window_seconds:
+                    self._spent.popleft()
+            if len(self._spent) >= self.limit:
+                return False
+            self._spent.append(now)
+            return True
+
+    @property
+    def used(self):
+        return len(self._spent)
+
+_budget = RetryBudget(config.PORTAL_RETRY_BUDGET, config.PORTAL_RETRY_WINDOW_SECONDS)
+
+def reset_retry_budget(limit=None):
+    """Starts a fresh per-run budget (called at the start of a batch run)."""
+    global _budget
+    _budget = RetryBudget(limit if limit is not None else config.PORTAL_RETRY_BUDGET)
+    return _budget
+
+def get_retry_budget():
+    return _budget
+
+# --- Circuit Breaker ---
+
+class PortalUnavailable(Exception):
+    """Raised instead of contacting the portal while the circuit breaker is open."""
+
+class CircuitBreaker:
+    """
+    closed: requests go through; `failure_threshold` consecutive failed requests open it.
+    open: requests fail fast with PortalUnavailable until `cooldown_seconds` pass.
+    half_open: a single probe request is let through; success closes, failure reopens.
+    shared=True publishes open/close transitions to Postgres and adopts newer ones
+    from other replicas, so the whole deployment backs off together.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold, cooldown_seconds, shared=False, name="portal"):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.shared = shared
+        self.name = name
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_until = 0.0   # Wall clock, so it means the same thing on every replica
+        self._changed_at = 0.0
+        self._probing = False
+        self._synced_at = 0.0
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        self.state = state
+        self._changed_at = time.time()
+        metrics.PORTAL_BREAKER_STATE.set({self.CLOSED: 0, self.HALF_OPEN: 0.5, self.OPEN: 1}[state])
+
+    def _sync(self):
+        """Adopts a transition another replica published after our own last one."""
+        if not self.shared: return
+        now = time.monotonic()
+        if now - self._synced_at < config.PORTAL_BREAKER_SYNC_SECONDS: return
+        self._synced_at = now
+        row = db_utils.get_portal_breaker_pg(self.name)
+        if not row: return
+        state, opened_until, updated_at = row
+        with self._lock:
+            if updated_at.timestamp() <= self._changed_at: return
+            if state == self.OPEN and self.state != self.OPEN:
+                self._set_state(self.OPEN)
+                self.opened_until = opened_until.timestamp() if opened_until else time.time()
+            elif state == self.CLOSED and self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+                self.failures = 0
+
+    def _publish(self):
+        if not self.shared: return
+        until = datetime.fromtimestamp(self.opened_until, timezone.utc) if self.state == self.OPEN else None
+        db_utils.save_portal_breaker_pg(self.state, until, self.name)
+
+    def allow(self):
+        """True if a request may go out now (claims the probe slot when half-open)."""
+        self._sync()
+        with self._lock:
+            if self.state == self.CLOSED: return True
+            if self.state == self.OPEN:
+                if time.time() < self.opened_until: return False
+                self._set_state(self.HALF_OPEN)
+            if self._probing: return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state == self.CLOSED: return
+            self._set_state(self.CLOSED)
+        print("  -> Portal reachable again, circuit closed")
+        self._publish()
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            probe_failed = self.state == self.HALF_OPEN
+            self._probing = False
+            if self.state == self.OPEN: return
+            if not probe_failed and self.failures < self.failure_threshold: return
+            self.opened_until = time.time() + self.cooldown_seconds
+            self._set_state(self.OPEN)
+        print(f"  -> Portal looks down ({self.failures} failed requests), circuit open for {self.cooldown_seconds}s")
+        self._publish()
+
+    def retry_after(self):
+        """Seconds until the next probe may go out; 0 when requests can be sent."""
+        self._sync()
+        with self._lock:
+            if self.state != self.OPEN: return 0.0
+            return max(0.0, self.opened_until - time.time())
+
+    def is_open(self):
+        return self.retry_after() > 0
+
+breaker = CircuitBreaker(config.PORTAL_BREAKER_FAILURES, config.PORTAL_BREAKER_COOLDOWN_SECONDS,
+                         shared=config.PORTAL_BREAKER_SHARED)
+
+def _backoff_delay(attempt):
+    """Full jitter: uniform(0, min(cap, base * 2^attempt))."""
+    ceiling = min(config.PORTAL_RETRY_MAX_DELAY, config.PORTAL_RETRY_BASE_DELAY * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+def request(session, method, url, page_type=None, **kwargs):
+    """
+    session.request() with raise_for_status() and retries for transient failures.
+    page_type ('login', 'ciedetails', 'attendencelist') selects the read timeout.
+    Permanent errors and exhausted retries are re-raised for the caller to handle;
+    while the circuit breaker is open it raises PortalUnavailable without a request.
+    """
+    if not breaker.allow():
+        metrics.PORTAL_BREAKER_REJECTED.inc(page_type=page_type or "other")
+        raise PortalUnavailable(f"Portal circuit open, next probe in {breaker.retry_after():.0f}s")
+    kwargs.setdefault("timeout", timeout_for(page_type))
+    stage = f"fetch.{page_type or 'other'}.{method.lower()}"
+    attempt = 0
+    while True:
+        try:
+            started = time.perf_counter()
+            with timing.span(stage, attempt=attempt):
+                response = session.request(method, url, **kwargs)
+                response.raise_for_status()
+            # A streamed response has only its headers so far; get_until records it once
+            # the body is read, so adaptive timeouts stay based on full-page latencies
+            if not kwargs.get("stream"):
+                latency.observe(page_type, time.perf_counter() - started)
+            breaker.record_success()
+            return response
+        except Exception as e:
+            attempt += 1
+            if not is_transient(e):
+                breaker.record_success()  # Not an outage (4xx, bad input); don't count it
+                raise
+            if attempt >= config.PORTAL_MAX_ATTEMPTS or breaker.is_open():
+                breaker.record_failure()
+                raise
+            if not _budget.try_spend():
+                print(f"  -> Retry budget exhausted, giving up on {url}")
+                breaker.record_failure()
+                raise
+            delay = _backoff_delay(attempt)
+            print(f"  -> Transient error ({e.__class__.__name__}), retry {attempt} in {delay:.1f}s")
+            time.sleep(delay)
+
+def get(session, url, page_type=None, **kwargs):
+    return request(session, "GET", url, page_type=page_type, **kwargs)
+
+def post(session, url, page_type=None, **kwargs):
+    return request(session, "POST", url, page_type=page_type, **kwargs)
+
+# --- Hedged Requests ---
+
+_hedge_executor = ThreadPoolExecutor(max_workers=config.PORTAL_MAX_CONCURRENCY * 2, thread_name_prefix="hedge")
+# Backup requests are extra portal load, so they share a small sliding-window budget
+_hedge_budget = RetryBudget(config.PORTAL_HEDGE_BUDGET, 60)
+
+def get_hedged(session, url, page_type=None, **kwargs):
+    """
+    GET that fires one backup request if the first hasn't answered by the page type's
+    rolling p95, and returns whichever succeeds first. Without enough latency samples,
+    or with the hedge budget spent, it is a plain get().
+    """
+    hedge_after = latency.percentile(page_type, 95)
+    if hedge_after is None:
+        return get(session, url, page_type=page_type, **kwargs)
+
+    # Keep the fetch spans in the caller's per-refresh collector (debug panel)
+    hedged_get = timing.carry_collector(get)
+    primary = _hedge_executor.submit(hedged_get, session, url, page_type, **kwargs)
+    done, _ = wait([primary], timeout=hedge_after)
+    if done or not _hedge_budget.try_spend():
+        return primary.result()
+
+    metrics.PORTAL_HEDGES.inc(page_type=page_type or "other", result="fired")
+    backup = _hedge_executor.submit(hedged_get, session, url, page_type, **kwargs)
+    pending = {primary, backup}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                response = future.result()
+            except Exception as e:
+                error = e
+                continue
+            if future is backup:
+                metrics.PORTAL_HEDGES.inc(page_type=page_type or "other", result="won")
+            # The loser finishes in the background and is dropped
+            for other in pending:
+                other.add_done_callback(_close_response)
+            return response
+    raise error
+
+def _close_response(future):
+    try:
+        future.result().close()
+    except Exception:
+        pass
+
+# --- Streaming Fetch ---
+
+class MarkerScanner:
+    """
+    Incremental scanner over a growing body. markers = [(start, end)] byte strings;
+    complete once every start token has been seen followed by its end token.
+    Each feed() only searches the new bytes (plus a token-length overlap).
+    """
+    def __init__(self, markers):
+        self.markers = [(start.encode(), end.encode()) for start, end in markers]
+        self.buffer = bytearray()
+        self._pos = [0] * len(self.markers)        # where to resume searching
+        self._started = [False] * len(self.markers)
+        self._done = [False] * len(self.markers)
+
+    def feed(self, chunk):
+        self.buffer.extend(chunk)
+        for i, (start, end) in enumerate(self.markers):
+            if self._done[i]: continue
+            if not self._started[i]:
+                idx = self.buffer.find(start, self._pos[i])
+                if idx < 0:
+                    self._pos[i] = max(0, len(self.buffer) - len(start) + 1)
+                    continue
+                self._started[i] = True
+                self._pos[i] = idx + len(start)
+            idx = self.buffer.find(end, self._pos[i])
+            if idx < 0:
+                self._pos[i] = max(self._pos[i], len(self.buffer) - len(end) + 1)
+                continue
+            self._done[i] = True
+        return self.complete
+
+    @property
+    def complete(self):
+        return all(self._done)
+
+def get_until(session, url, markers, page_type=None, chunk_size=None, **kwargs):
+    """
+    GET that streams the body and stops reading as soon as every (start, end) marker
+    pair has been captured. Returns (body_prefix_bytes, encoding); the prefix is the
+    whole body when some marker never shows up.
+    Closing a half-read response drops its keep-alive connection, so this pays off
+    only for pages much larger than the part we need. HTTP/2 (httpx) sessions fall
+    back to a normal full read.
+    Only bodies read to the end feed the latency tracker: a truncated read is shorter
+    than the full fetches the adaptive timeouts are for.
+    """
+    if not isinstance(session, requests.Session):
+        response = get(session, url, page_type=page_type, **kwargs)
+        return response.content, response.encoding
+
+    response = get(session, url, page_type=page_type, stream=True, **kwargs)
+    scanner = MarkerScanner(markers)
+    truncated = False
+    download_started = time.perf_counter()
+    try:
+        with timing.span(f"download.{page_type or 'other'}"):
+            for chunk in response.iter_content(chunk_size=chunk_size or config.PORTAL_STREAM_CHUNK_SIZE):
+                if scanner.feed(chunk):
+                    truncated = True
+                    break
+    finally:
+        response.close()
+    if not truncated:
+        latency.observe(page_type, response.elapsed.total_seconds() + time.perf_counter() - download_started)
+    metrics.PORTAL_BODY_BYTES.inc(len(scanner.buffer), page_type=page_type or "other",
+                                  read="partial" if truncated else "full")
+    return bytes(scanner.buffer), response.encoding
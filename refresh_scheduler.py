@@ -0,0 +1,51 @@
+# refresh_scheduler.py
+import hashlib
+import json
+from datetime import datetime
+import pytz
+
+import config
+
+# Students who were never refreshed always go first
+NEVER_REFRESHED_SCORE = float("inf")
+
+def snapshot_hash(organized_data):
+    """Stable content hash of a {sem: {'cie': ..., 'att': ...}} snapshot."""
+    payload = json.dumps(organized_data, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _hours_since(ts, now):
+    if ts is None: return None
+    return max((now - ts).total_seconds() / 3600.0, 0.0)
+
+def score_candidate(candidate, now=None):
+    """
+    Refresh priority for one student (higher = refresh sooner).
+    - Staleness: hours since the last refresh / scrape.
+    - Change likelihood: smoothed share of past refreshes that found new data.
+    - Demand: a recent Streamlit lookup doubles the priority.
+    """
+    now = now or datetime.now(pytz.utc)
+
+    last_seen = [ts for ts in (candidate.get("last_refreshed_at"), candidate.get("scraped_at")) if ts]
+    if not last_seen:
+        return NEVER_REFRESHED_SCORE
+    staleness = _hours_since(max(last_seen), now)
+
+    # Laplace smoothing so a student with 1 refresh isn't pinned at 0% or 100%
+    change_rate = (candidate.get("change_count", 0) + 1) / (candidate.get("refresh_count", 0) + 2)
+
+    demand = 1.0
+    lookup_age = _hours_since(candidate.get("last_lookup_at"), now)
+    if lookup_age is not None and lookup_age <= config.LOOKUP_BOOST_WINDOW_HOURS:
+        demand = 2.0
+
+    return staleness * (0.25 + change_rate) * demand
+
+def plan_refresh(candidates, max_students=None, now=None):
+    """Orders candidates by priority and trims to the per-run student cap."""
+    now = now or datetime.now(pytz.utc)
+    ranked = sorted(candidates, key=lambda c: score_candidate(c, now), reverse=True)
+    if max_students:
+        ranked = ranked[:max_students]
+    return ranked
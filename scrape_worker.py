@@ -0,0 +1,82 @@
+# scrape_worker.py
+
+import os
+import select
+import socket
+import argparse
+import threading
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+import db_utils
+import live_refresh
+import metrics
+import config
+
+def process_job(job_id, user, worker_name):
+    print(f"[{worker_name}] Job {job_id}: refreshing {user['full_name']} (PRN: {user['prn']})")
+    try:
+        result = live_refresh.scrape_and_save_single_flight(user)
+    except Exception as e:
+        print(f"[{worker_name}] Job {job_id} crashed: {e}")
+        db_utils.finish_scrape_job_pg(job_id, "failed", str(e))
+        return
+    if result:
+        db_utils.finish_scrape_job_pg(job_id, "done")
+        print(f"[{worker_name}] Job {job_id}: ✅ done")
+    else:
+        db_utils.finish_scrape_job_pg(job_id, "failed", "Login failed or no data")
+        print(f"[{worker_name}] Job {job_id}: ❌ failed")
+
+def worker_loop(worker_name, wait):
+    """Drains the queue, then calls wait() until there may be more work."""
+    while True:
+        claimed = db_utils.claim_next_scrape_job_pg(worker_name)
+        if claimed:
+            process_job(claimed[0], claimed[1], worker_name)
+            continue
+        wait()
+
+def run_worker(threads=1):
+    """
+    The main thread owns the LISTEN connection and wakes the helper threads through an Event.
+    Every thread claims jobs with SKIP LOCKED, so any number of worker processes can run.
+    """
+    base_name = f"{socket.gethostname()}:{os.getpid()}"
+    listen_conn = db_utils.listen_for_scrape_jobs_pg()
+    wake_event = threading.Event()
+
+    def wait_for_notify():
+        # Falls back to plain polling when LISTEN is unavailable (e.g. transaction pooler)
+        if listen_conn is None:
+            wake_event.wait(config.SCRAPE_WORKER_POLL_SECONDS)
+            wake_event.clear()
+            return
+        ready, _, _ = select.select([listen_conn], [], [], config.SCRAPE_WORKER_POLL_SECONDS)
+        if ready:
+            listen_conn.poll()
+            listen_conn.notifies.clear()
+            wake_event.set()
+
+    def wait_for_wake():
+        wake_event.wait(config.SCRAPE_WORKER_POLL_SECONDS)
+        wake_event.clear()
+
+    print(f"🛠️ Scrape worker {base_name} started with {threads} thread(s). "
+          f"{'Listening for NOTIFY' if listen_conn else 'Polling'} on '{db_utils.SCRAPE_JOB_CHANNEL}'.")
+
+    for n in range(1, threads):
+        threading.Thread(target=worker_loop, args=(f"{base_name}/t{n}", wait_for_wake), daemon=True).start()
+    worker_loop(f"{base_name}/t0", wait_for_notify)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs live scrape jobs queued by the Streamlit app.")
+    parser.add_argument("--threads", type=int, default=1, help="Concurrent scrapes in this process")
+    parser.add_argument("--metrics-port", type=int, default=config.METRICS_PORT, help="Serve Prometheus metrics on this port (0 = off)")
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        metrics.start_metrics_server(args.metrics_port)
+    run_worker(max(args.threads, 1))
@@ -4,9 +4,7 @@ import streamlit as st
 import os
 from dotenv import load_dotenv
 from streamlit_local_storage import LocalStorage
-from datetime import datetime
 import pytz
-import math 
 import re 
 
 
@@ -26,6 +24,13 @@ load_dotenv()
 import config
 import db_utils
 import web_scraper
+import timing
+import metrics
+import live_refresh
+import portal_http
+import derived_views
+import attendance_forecast
+import cohort_analytics
 
 # --- Email Function ---
 import resend
@@ -71,84 +76,22 @@ def identify_semester(subject_code):
     match = re.search(r'\d', subject_code)
     return int(match.group()) if match else 0
 
-def scrape_fresh_data(user_details):
-    """
-    Scrapes data and organizes it.
-    - Default: Uses the Semester found on the Welcome Page (e.g., 7).
-    - Exception: Moves 'CSC8...', 'CSDC8...', 'CSDL8...' subjects to Semester 8.
-    """
-    
-    # 1. Login and get the Dashboard HTML
-    session, html = web_scraper.login_and_get_welcome_page(
-        user_details["prn"], user_details["dob_day"], 
-        user_details["dob_month"], user_details["dob_year"], 
-        user_details["full_name"]
-    )
-    if not html: return None
-
-    # 2. Extract the Default Semester from the Dashboard
-    dashboard_sem = web_scraper.extract_student_semester(html)
-    if not dashboard_sem: 
-        dashboard_sem = 0 
-
-    # 3. Scrape Raw Data
-    raw_marks = web_scraper.extract_cie_marks(session, html)
-    raw_att = web_scraper.extract_detailed_attendance_info(session, html)
-    
-    # 4. Organize Data (Hybrid Logic)
-    organized_data = {}
-
-    def get_sem_for_subject(sub_code, default_sem):
-        """Checks if subject is explicitly Sem 8, otherwise returns default."""
-        code = sub_code.strip().upper()
-        
-        # RULE: If code starts with CSC8, CSDC8, or CSDL8 -> Force Sem 8
-        if re.search(r"^(CSC|CSDC|CSDL|CSL)8", code):
-            return 8
-        
-        # Otherwise, stick to what the dashboard says (e.g., Sem 7)
-        return default_sem
-
-    # --- Process Marks ---
-    for sub, exams in raw_marks.items():
-        sem = get_sem_for_subject(sub, dashboard_sem)
-        
-        if sem == 0: continue # Skip if invalid
-
-        if sem not in organized_data: 
-            organized_data[sem] = {'cie': {}, 'att': {}}
-        organized_data[sem]['cie'][sub] = exams
+# --- Init ---
+@st.cache_resource
+def _start_metrics_server():
+    # Once per Streamlit server process, not per session
+    return metrics.start_metrics_server()
 
-    # --- Process Attendance ---
-    for sub, details in raw_att.items():
-        sem = get_sem_for_subject(sub, dashboard_sem)
-        
-        if sem == 0: continue
-
-        if sem not in organized_data: 
-            organized_data[sem] = {'cie': {}, 'att': {}}
-        organized_data[sem]['att'][sub] = details
-
-    return {
-        "semesters_data": organized_data,
-        "scraped_at": datetime.now(pytz.utc)
-    }
-
-def calculate_grade_point(percentage):
-    if percentage >= 85.00: return 10
-    if 80.00 <= percentage <= 84.99: return 9
-    if 70.00 <= percentage <= 79.99: return 8
-    if 60.00 <= percentage <= 69.99: return 7
-    if 55.00 <= percentage <= 59.99: return 6
-    if 50.00 <= percentage <= 54.99: return 5
-    if 45.00 <= percentage <= 49.99: return 4
-    return 0
+_start_metrics_server()
 
-# --- Init ---
-if 'db_initialized' not in st.session_state:
+@st.cache_resource
+def _init_db():
+    # Once per Streamlit server process: the schema checks take locks on the hot tables
     db_utils.create_db_and_table_pg()
     db_utils.create_feedback_table_pg()
-    st.session_state.db_initialized = True
+    return True
+
+_init_db()
 
 st.set_page_config(page_title="Student Portal Viewer",page_icon="static/contineo.png", layout="wide")
 st.header("🎓 Student Portal Data Viewer")
@@ -174,6 +117,7 @@ if 'student_data_result' not in st.session_state:
 
 def on_user_change():
     st.session_state.student_data_result = None
+    st.session_state.pending_refresh = None
 
 st.sidebar.header("Student Lookup")
 st.sidebar.text_input("Enter your username:", key="first_name", on_change=on_user_change)
@@ -191,6 +135,8 @@ with col2:
     st.caption("🌐 **From Portal**\n(Current Data)")
 st.sidebar.markdown("---")
 
+show_timings = st.sidebar.checkbox("🐞 Show timings", value=False)
+
 # --- Add User Form (WITH VALIDATION) ---
 if st.sidebar.button("➕ Register New Student"):
     st.session_state.show_add_user_form = not st.session_state.show_add_user_form
@@ -263,7 +209,17 @@ if st.session_state.show_add_user_form:
                         3. Portal is currently down.
                         """)
 # --- Fetch Logic ---
-should_fetch = (fetch_button or force_refresh_button or (first_name_input and not st.session_state.student_data_result))
+if fetch_button or force_refresh_button:
+    st.session_state.pop("auto_fetch_failed", None)
+# Fetch on page load only once per name: a name whose live scrape already failed (no
+# snapshot to show either) waits for the buttons instead of re-scraping on every rerun
+auto_fetch = (first_name_input and not st.session_state.student_data_result
+              and not st.session_state.get("pending_refresh")
+              and st.session_state.get("auto_fetch_failed") != first_name_input.lower())
+should_fetch = (fetch_button or force_refresh_button or auto_fetch)
+
+# Spans recorded while fetching feed the optional debug panel
+fetch_spans = timing.start_collecting()
 
 if should_fetch and first_name_input:
     set_item("last_username", first_name_input)
@@ -273,39 +229,110 @@ if should_fetch and first_name_input:
         result = None
         source = "Database"
 
-        # 1. Try DB Cache
-        if not force_refresh_button:
-            with st.spinner("Checking cache..."):
-                result = db_utils.get_student_data_from_db(user_details["id"])
-        
-        # 2. Scrape if needed
+        # Recent lookups bump this student's priority in the batch refresh
+        db_utils.record_user_lookup_pg(user_details["id"])
+
+        # 1. DB snapshot first, so the page renders instantly (even on "Get Live Data")
+        with st.spinner("Checking cache..."):
+            result = db_utils.get_student_data_from_db(user_details["id"])
+        metrics.CACHE_LOOKUPS.inc(cache="db_snapshot", result="hit" if result else "miss")
+
+        # 2. Live scrape in the background (stale-while-revalidate), unless the portal is known to be down
         if not result or force_refresh_button:
-            source = "Live Portal"
-            with st.spinner("Fetching from portal..."):
-                scrape_res = scrape_fresh_data(user_details)
-                if scrape_res:
-                    result = scrape_res
-                    # Save to DB (Marks & Attendance linked to Current Semester)
-                    for sem, data in result["semesters_data"].items():
-                        db_utils.update_student_marks_in_db_pg(
-                            user_details["id"], sem, data['cie'], result["scraped_at"]
-                        )
-                        db_utils.update_attendance_in_db_pg(
-                            user_details["id"], sem, data['att']
-                        )
-                    
-                    # Add latest_sem logic for display
-                    latest = max(result["semesters_data"].keys()) if result["semesters_data"] else None
-                    result["latest_sem"] = latest
+            if portal_http.breaker.is_open():
+                st.session_state.portal_unavailable = True
+            else:
+                st.session_state.pending_refresh = {
+                    "user_details": user_details,
+                    "future": live_refresh.request_refresh(user_details),
+                    "lookup": first_name_input.lower(),
+                }
 
         if result:
-            st.session_state.student_data_result = {"user_details": user_details, "data_pkg": result, "source": source}
+            st.session_state.student_data_result = {
+                "user_details": user_details, "data_pkg": result, "source": source,
+                "views": derived_views.get_snapshot_views(result["semesters_data"]),
+            }
         else:
-            st.error("Login Failed or No Data.")
             st.session_state.student_data_result = None
     else:
         st.error("User not found.")
 
+timing.stop_collecting()
+if fetch_spans:
+    st.session_state.last_fetch_timings = fetch_spans
+
+# --- Background Refresh ---
+def render_live_preview(partial):
+    """Subjects from the in-flight scrape, rendered as soon as each detail page arrives."""
+    for sem in sorted(partial.keys(), reverse=True):
+        sem_data = partial[sem]
+        st.markdown(f"##### 📡 Semester {sem} (live, {len(sem_data['cie']) + len(sem_data['att'])} pages in)")
+        p1, p2 = st.columns(2)
+        with p1:
+            rows = []
+            for sub, det in sem_data['att'].items():
+                att = det.get('attended', 0)
+                cond = det.get('conducted', 0)
+                if cond > 0:
+                    subject_name = config.SUBJECT_CODE_TO_NAME_MAP.get(sub, sub)
+                    rows.append({"Subject": f"{subject_name} ({sub})", "Attendance": f"{(att/cond)*100:.1f}%", "Lectures": f"{att}/{cond}"})
+            if rows:
+                st.dataframe(rows, width='stretch', hide_index=True)
+        with p2:
+            for sub, exams in sem_data['cie'].items():
+                subject_name = config.SUBJECT_CODE_TO_NAME_MAP.get(sub, sub)
+                with st.expander(f"{subject_name} ({sub})"):
+                    for ex, val in exams.items():
+                        if isinstance(val, dict):
+                            st.write(f"**{ex}:** {val.get('obtained', 0)} / {val.get('max', 0)}")
+
+@st.fragment(run_every=config.LIVE_REFRESH_POLL_SECONDS)
+def live_refresh_status():
+    """Polls the background scrape and swaps in the live data once it lands."""
+    pending = st.session_state.get("pending_refresh")
+    if not pending: return
+
+    if not pending["future"].done():
+        if st.session_state.student_data_result:
+            st.info("🔄 Fetching live data from the portal... showing cached data meanwhile.")
+        else:
+            st.info("🔄 Fetching live data from the portal...")
+        partial = pending["future"].partial()
+        if partial:
+            render_live_preview(partial)
+        return
+
+    st.session_state.pending_refresh = None
+    fresh = pending["future"].result()
+    if fresh:
+        st.session_state.last_fetch_timings = fresh.pop("timings", None)
+        st.session_state.student_data_result = {
+            "user_details": pending["user_details"], "data_pkg": fresh, "source": "Live Portal",
+            "views": derived_views.get_snapshot_views(fresh["semesters_data"]),
+        }
+    else:
+        st.session_state.live_refresh_failed = True
+        if not st.session_state.student_data_result:
+            st.session_state.auto_fetch_failed = pending["lookup"]
+    st.rerun()
+
+if st.session_state.get("pending_refresh"):
+    live_refresh_status()
+
+live_refresh_failed = st.session_state.pop("live_refresh_failed", False)
+if st.session_state.pop("portal_unavailable", False) or (live_refresh_failed and portal_http.breaker.is_open()):
+    retry_in = portal_http.breaker.retry_after()
+    if st.session_state.student_data_result:
+        st.warning(f"🚧 The university portal is unavailable. Showing saved data (live refresh retries in ~{retry_in:.0f}s).")
+    else:
+        st.error("🚧 The university portal is unavailable and there is no saved data yet. Please try again in a few minutes.")
+elif live_refresh_failed:
+    if st.session_state.student_data_result:
+        st.warning("⚠️ Could not fetch live data from the portal. Showing cached data.")
+    else:
+        st.error("Login Failed or No Data.")
+
 # --- Display Logic ---
 if st.session_state.student_data_result:
     pkg = st.session_state.student_data_result
@@ -328,72 +355,21 @@ if st.session_state.student_data_result:
         sem_options = sorted(all_sem_data.keys(), reverse=True)
         selected_sem = st.selectbox("Select Semester", sem_options, index=0)
         
-        # Get data for selected semester
-        current_data = all_sem_data[selected_sem]
-        marks_data = current_data.get('cie', {})
-        att_data = current_data.get('att', {})
+        # Derived views are computed once per snapshot (memoized by content hash)
+        view = pkg.get("views") or derived_views.get_snapshot_views(all_sem_data)
+        sem_view = view[selected_sem]
 
-        # --- SGPI Calculation ---
+        # --- SGPI ---
         st.markdown(f"### 📈 Semester {selected_sem} Performance")
-        
-        total_credits = 0
-        weighted_gp = 0
-        breakdown = []
-        db_details = [] # For saving
-
-        if marks_data:
-            for sub_code, exams in marks_data.items():
-                sub_name = config.SUBJECT_CODE_TO_NAME_MAP.get(sub_code, sub_code)
-                
-                if "lab" in sub_name.lower(): cred = 1
-                elif "project" in sub_name.lower(): cred = 3
-                else: cred = 3
-
-                obt_sum = 0.0
-                max_sum = 0.0
-                
-                for ex, val in exams.items():
-                    o = val.get('obtained', 0)
-                    m = val.get('max', 0)
-                    if isinstance(o, (int, float)):
-                        obt_sum += o
-                        max_sum += m if m > 0 else config.get_max_marks(sub_code, ex)
-
-                if max_sum > 0:
-                    perc = (obt_sum / max_sum) * 100
-                    rnd_perc = math.floor(perc + 0.5)
-                    gp = calculate_grade_point(rnd_perc)
-                    
-                    weighted_gp += (cred * gp)
-                    total_credits += cred
-                    
-                    grade = "F"
-                    if gp == 10: grade = "O"
-                    elif gp == 9: grade = "A"
-                    elif gp == 8: grade = "B"
-                    elif gp == 7: grade = "C"
-                    elif gp == 6: grade = "D"
-                    elif gp == 5: grade = "E"
-                    elif gp == 4: grade = "P"
-
-                    breakdown.append(f"**{sub_name}**: {perc:.1f}% → {grade} ({gp})")
-                    db_details.append({
-                        "subject_code": sub_code, "subject_name": sub_name,
-                        "percentage": float(f"{perc:.2f}"), "grade_point": gp, "grade_letter": grade, "credits": cred
-                    })
-
-            if total_credits > 0:
-                sgpi = weighted_gp / total_credits
-                
-                # Save SGPI if from Live Source
-                if source == "Live Portal":
-                    db_utils.save_student_sgpi_pg(user["id"], selected_sem, sgpi, db_details)
 
+        if sem_view["has_marks"]:
+            sgpi = sem_view["sgpi"]
+            if sgpi is not None:
                 c1, c2, c3 = st.columns([2, 3, 2])
                 c1.metric("SGPI", f"{sgpi:.2f}")
                 with c2:
                     with st.expander("Subject Breakdown"):
-                        for b in breakdown: st.markdown(f"- {b}")
+                        for b in sem_view["breakdown"]: st.markdown(f"- {b}")
                 with c3:
                     if st.button(f"🏆 Sem {selected_sem} Leaderboard"):
                         lb = db_utils.get_semester_leaderboard_pg(selected_sem)
@@ -407,6 +383,14 @@ if st.session_state.student_data_result:
                             st.caption("No leaderboard data.")
         else:
             st.info("No marks available for this semester.")
+
+        # --- Class comparison (SQL aggregates, cached per semester) ---
+        if sem_view["has_marks"] and st.toggle("📊 How do I compare?", key="show_cohort"):
+            rows = cohort_analytics.comparison_rows(user['id'], selected_sem)
+            if rows:
+                st.dataframe(rows, width='stretch', hide_index=True)
+            else:
+                st.caption("Not enough class data yet.")
         
         st.divider()
 
@@ -415,62 +399,46 @@ if st.session_state.student_data_result:
         
         with col1:
             st.subheader("📊 Attendance")
-            if att_data:
-                att_display = []
-                for sub, det in att_data.items():
-                    # --- Formatting: Name (Code) ---
-                    subject_name = config.SUBJECT_CODE_TO_NAME_MAP.get(sub, sub)
-                    display_name = f"{subject_name} ({sub})"
-                    
-                    att = det.get('attended', 0)
-                    cond = det.get('conducted', 0)
-                    
-                    if cond > 0:
-                        p = (att/cond)*100
-                        status = "N/A"
-                        if p >= 75:
-                            miss = math.floor((att/0.75) - cond)
-                            status = f"✅ Safe. Miss {int(miss)}"
-                        else:
-                            need = math.ceil(((0.75*cond) - att)/0.25)
-                            status = f"⚠️ Low. Attend {int(need)}"
-                        
-                        att_display.append({"Subject": display_name, "Attendance": f"{p:.1f}%", "Status(For 75%)": status})
-                st.dataframe(att_display, width='stretch', hide_index=True)
+            if sem_view["has_attendance"]:
+                st.dataframe(sem_view["attendance_rows"], width='stretch', hide_index=True)
+
+                # What-if: project every subject after N more missed lectures
+                misses = st.number_input("What if I miss the next N lectures of each subject?",
+                                         min_value=0, max_value=50, value=0, step=1, key="what_if_misses")
+                if misses:
+                    projections = []
+                    for sub, det in all_sem_data[selected_sem]['att'].items():
+                        f = attendance_forecast.project(det.get('attended', 0), det.get('conducted', 0), misses=misses)
+                        if f:
+                            subject_name = config.SUBJECT_CODE_TO_NAME_MAP.get(sub, sub)
+                            projections.append({"Subject": f"{subject_name} ({sub})",
+                                                "Projected": f"{f['projected']:.1f}%",
+                                                "Status": attendance_forecast.status_text(f)})
+                    st.dataframe(projections, width='stretch', hide_index=True)
+
+                # Trend: one point per recorded change (attendance_history)
+                if st.toggle("📈 Show attendance trend", key="show_att_trend"):
+                    history = db_utils.get_attendance_history_pg(user['id'], semester=selected_sem)
+                    points = [{"Recorded": ts, "Subject": sub, "Attendance %": round(att / cond * 100, 1)}
+                              for ts, _, sub, att, cond in history if cond]
+                    if points:
+                        st.line_chart(points, x="Recorded", y="Attendance %", color="Subject")
+                    else:
+                        st.caption("No history recorded yet.")
             else:
                 st.info("No attendance records.")
 
         with col2:
             st.subheader("📝 Marks")
-            if marks_data:
-                for sub, exams in marks_data.items():
-                    # --- Formatting: Name (Code) ---
-                    subject_name = config.SUBJECT_CODE_TO_NAME_MAP.get(sub, sub)
-                    display_name = f"{subject_name} ({sub})"
-                    
-                    # Initialize totals for this subject
-                    sub_total_obt = 0
-                    sub_total_max = 0
-
-                    with st.expander(f"{display_name}"):
-                        for ex, val in exams.items():
-                            if isinstance(val, dict):
-                                o = val.get('obtained', 0)
-                                m = val.get('max', 0)
-                                
-                                # Display the individual exam line
-                                st.write(f"**{ex}:** {o} / {m}")
-                                
-                                # Add to running total
-                                sub_total_obt += float(o)
-                                sub_total_max += float(m)
-                            else:
-                                # Fallback for old data formats
-                                st.write(f"**{ex}:** {val}")
+            if sem_view["has_marks"]:
+                for panel in sem_view["marks_panels"]:
+                    with st.expander(panel["title"]):
+                        for line in panel["lines"]:
+                            st.write(line)
                         
                         # Display the Total at the very end
                         st.markdown("---") 
-                        st.markdown(f"**Total:** {sub_total_obt} / {sub_total_max}")
+                        st.markdown(panel["total"])
 
             else:
                 st.info("No marks records.")
@@ -480,6 +448,18 @@ if st.session_state.student_data_result:
 elif (fetch_button or force_refresh_button) and not first_name_input:
     st.sidebar.warning("Please enter a username to fetch data.")
 
+# --- Debug Panel: per-stage timings of the last fetch ---
+if show_timings and st.session_state.get("last_fetch_timings"):
+    with st.sidebar.expander("⏱️ Last fetch timings", expanded=True):
+        grouped = {}
+        for sp in st.session_state.last_fetch_timings:
+            grouped.setdefault(sp["stage"], []).append(sp["ms"])
+        st.dataframe(
+            [{"Stage": stage, "Count": n, "p50 ms": round(p50, 1), "p95 ms": round(p95, 1), "Total ms": round(total, 1)}
+             for stage, n, p50, p95, _, total in timing.summarize(grouped)],
+            hide_index=True
+        )
+
 
 # --- Append this to the very end of app.py ---
 st.divider()
@@ -0,0 +1,128 @@
+# stub_portal.py
+import re
+import time
+import random
+import hashlib
+import argparse
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+# Minimal stand-in for the Contineo parent portal, for running update_all locally:
+#   python stub_portal.py --port 8765
+#   CONTINEO_LOGIN_URL="http://127.0.0.1:8765/parents/index.php?option=com_studentdashboard&controller=studentdashboard&task=dashboard"
+# Any PRN logs in. Marks and attendance are derived from the PRN, so re-runs are stable.
+
+SUBJECTS = ("CSC701", "CSC702", "CSDC7013", "CSL701", "CSL702")
+EXAMS = (("MSE", 20), ("TH-ISE1", 20), ("TH-ISE2", 20))
+
+def _number(*parts, modulo):
+    return int(hashlib.sha1("|".join(parts).encode()).hexdigest(), 16) % modulo
+
+def cie_marks(prn, subject):
+    return [(exam, mx, _number(prn, subject, exam, modulo=mx + 1)) for exam, mx in EXAMS]
+
+def attendance_counts(prn, subject):
+    """(present, conducted)"""
+    conducted = 30 + _number(prn, subject, modulo=10)
+    return conducted - _number(prn, subject, "absent", modulo=12), conducted
+
+LOGIN_PAGE = f"""<html><body>
+<form id="login-form" method="post" action="index.php">
+  <input type="text" name="{config.PRN_FIELD_NAME}">
+  <input type="hidden" name="option" value="com_user">
+  <input type="hidden" name="token" value="stub">
+</form></body></html>"""
+
+def dashboard_page(prn, semester):
+    rows = "".join(
+        f"<tr><td>{sub}</td><td>Course {sub}</td>"
+        f"<td><a href='index.php?option=com_studentdashboard&task=ciedetails&prn={prn}&subject={sub}'>CIE</a></td>"
+        f"<td><a href='index.php?option=com_studentdashboard&task=attendencelist&prn={prn}&subject={sub}'>Attendance</a></td></tr>"
+        for sub in SUBJECTS)
+    # Same scripts as the real dashboard: attendance gauge and CIE stacked bar chart
+    gauge = ", ".join(f'["{sub}", {round(p / c * 100)}]' for sub in SUBJECTS for p, c in [attendance_counts(prn, sub)])
+    marks = {sub: cie_marks(prn, sub) for sub in SUBJECTS}
+    columns = ", ".join(f'["{exam}", ' + ", ".join(str(marks[sub][i][2]) for sub in SUBJECTS) + "]"
+                        for i, (exam, _) in enumerate(EXAMS))
+    categories = ", ".join(f'"{sub}"' for sub in SUBJECTS)
+    return f"""<html><body>
+<h3>Student {prn}</h3><p>Course: B.E. Computer Engineering | SEM {semester}</p>
+<script>var gaugeTypeMulti = bb.generate({{data: {{columns: [{gauge}], type: "gauge"}}, bindto: "#gaugeTypeMulti"}});</script>
+<script>var stackedBarChart_1 = bb.generate({{data: {{columns: [{columns}], type: "bar"}},
+  axis: {{x: {{type: "category", categories: [{categories}]}}}}, bindto: "#stackedBarChart_1"}});</script>
+<table class="dash_even_row"><tbody>{rows}</tbody></table>
+<a href="index.php?option=com_user&task=logout">Logout</a>
+</body></html>"""
+
+def cie_page(prn, subject):
+    marks = cie_marks(prn, subject)
+    chart = ", ".join(f'{{"xaxis": "{e}", "maxmarks": {mx}, "optainmarks": {obt}}}' for e, mx, obt in marks)
+    header = "".join(f"<th>{e}</th>" for e, _, _ in marks)
+    cells = "".join(f"<td>{obt}/{mx}</td>" for _, mx, obt in marks)
+    return f"""<html><body><script>var chartData = [{chart}];</script>
+<table class="cn-cie-table"><thead><tr>{header}</tr></thead><tbody><tr>{cells}</tr></tbody></table>
+</body></html>"""
+
+def attendance_page(prn, subject):
+    present, conducted = attendance_counts(prn, subject)
+    return f"""<html><body>
+<span class="cn-color-green">Present [{present}]</span>
+<span class="cn-color-red">Absent [{conducted - present}]</span>
+</body></html>"""
+
+class StubPortalHandler(BaseHTTPRequestHandler):
+    delay = 0.0
+    fail_rate = 0.0
+    semester = 7
+
+    def _send(self, html, status=200):
+        body = html.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _maybe_fail(self):
+        if random.random() < self.fail_rate:
+            self._send("<html><body>Service Unavailable</body></html>", 503)
+            return True
+        return False
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        task = query.get("task", [""])[0]
+        if task in ("ciedetails", "attendencelist"):
+            time.sleep(self.delay)
+            if self._maybe_fail(): return
+            prn, subject = query.get("prn", [""])[0], query.get("subject", [""])[0]
+            self._send(cie_page(prn, subject) if task == "ciedetails" else attendance_page(prn, subject))
+        else:
+            self._send(LOGIN_PAGE)
+
+    def do_POST(self):
+        if self._maybe_fail(): return
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        prn = re.sub(r"[^A-Za-z0-9]", "", form.get(config.PRN_FIELD_NAME, [""])[0])
+        self._send(dashboard_page(prn, self.semester))
+
+    def log_message(self, format, *args):
+        pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stub of the student portal for update_all test runs.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds added to every detail page")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--semester", type=int, default=7)
+    args = parser.parse_args()
+
+    StubPortalHandler.delay = args.delay
+    StubPortalHandler.fail_rate = args.fail_rate
+    StubPortalHandler.semester = args.semester
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), StubPortalHandler)
+    print(f"Stub portal on http://127.0.0.1:{args.port}/parents/index.php?option=com_studentdashboard&controller=studentdashboard&task=dashboard")
+    server.serve_forever()
@@ -0,0 +1,48 @@
+# test_db_utils.py
+"""
+Round-trips the prepared upserts against a real Postgres. Point DATABASE_URL at a
+throwaway database (see "Batch Updates" in the README), then:
+    python -m pytest -q test_db_utils.py
+"""
+import os
+import uuid
+import unittest
+from datetime import datetime
+
+import pytz
+
+@unittest.skipUnless(os.environ.get("DATABASE_URL"), "DATABASE_URL not set")
+class PreparedUpsertTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # config exits at import without DB settings, so only import once we know they exist
+        global db_utils
+        import db_utils
+        db_utils.create_db_and_table_pg()
+        cls.first_name = f"upsert-test-{uuid.uuid4().hex[:8]}"
+        assert db_utils.add_user_to_db_pg(cls.first_name, "Upsert Test", cls.first_name, "01", "01", "2004")
+        cls.user_id = db_utils.get_user_from_db_pg(cls.first_name)["id"]
+
+    @classmethod
+    def tearDownClass(cls):
+        conn = db_utils.get_db_connection()
+        with conn, conn.cursor() as cursor:
+            cursor.execute("DELETE FROM users WHERE id = %s;", (cls.user_id,))
+        conn.close()
+
+    def test_upserts_insert_then_update(self):
+        now = datetime.now(pytz.utc)
+        for obtained, attended in ((12, 36), (15, 40)):
+            self.assertTrue(db_utils.update_student_marks_in_db_pg(
+                self.user_id, 7, {"CSC701": {"MSE": {"obtained": obtained, "max": 20}}}, now))
+            self.assertTrue(db_utils.update_attendance_in_db_pg(
+                self.user_id, 7, {"CSC701": {"attended": attended, "conducted": 43}}))
+        self.assertTrue(db_utils.save_student_sgpi_pg(self.user_id, 7, 8.5, {"CSC701": "A"}))
+
+        sem = db_utils.get_student_data_from_db(self.user_id)["semesters_data"][7]
+        self.assertEqual(sem["cie"]["CSC701"]["MSE"], {"obtained": 15, "max": 20})
+        self.assertEqual(sem["att"]["CSC701"], {"attended": 40, "conducted": 43})
+        self.assertEqual(sem["sgpi"], 8.5)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+# timing.py
+import inspect
+import json
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from functools import wraps
+
+import config
+
+# Keep the most recent samples per stage so long-lived processes don't grow forever
+MAX_SAMPLES_PER_STAGE = 5000
+
+_samples = defaultdict(lambda: deque(maxlen=MAX_SAMPLES_PER_STAGE))
+_lock = threading.Lock()
+_local = threading.local()
+_listeners = []
+
+def add_listener(callback):
+    """Registers callback(stage, duration_ms, status) to be called for every span (e.g. metrics)."""
+    _listeners.append(callback)
+
+def record(stage, duration_ms, status="ok", started_at=None, **attrs):
+    """Stores one finished span and emits it as a JSON log line if TIMING_LOG is on."""
+    with _lock:
+        _samples[stage].append(duration_ms)
+
+    for callback in _listeners:
+        try:
+            callback(stage, duration_ms, status)
+        except Exception as e:
+            print(f"Timing listener error: {e}")
+
+    collector = getattr(_local, "collector", None)
+    if collector is not None:
+        collector.append({"stage": stage, "ms": duration_ms, "status": status})
+
+    if config.TIMING_LOG:
+        print(json.dumps({
+            "span": stage,
+            "start": started_at,
+            "duration_ms": round(duration_ms, 2),
+            "status": status,
+            "attributes": attrs,
+        }, default=str))
+
+@contextmanager
+def span(stage, **attrs):
+    """
+    Times a block of work under a stage name, e.g.
+        with timing.span("parse.ciedetails", subject=code): ...
+    """
+    started_at = time.time()
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        record(stage, (time.perf_counter() - start) * 1000, status, started_at, **attrs)
+
+def timed(stage=None):
+    """Decorator form of span(). Defaults the stage name to the function name. Works on coroutines too."""
+    def decorator(func):
+        name = stage or func.__name__
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def start_collecting():
+    """
+    Starts capturing the spans recorded by the current thread (used by the
+    Streamlit debug panel). Returns the list the spans are appended to.
+    """
+    _local.collector = []
+    return _local.collector
+
+def stop_collecting():
+    _local.collector = None
+
+def carry_collector(func):
+    """
+    Wraps func so that, run on another thread (e.g. an executor), its spans still go
+    to the collector of the thread that called carry_collector.
+    """
+    collector = getattr(_local, "collector", None)
+    if collector is None: return func
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_local, "collector", None)
+        _local.collector = collector
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.collector = previous
+    return wrapper
+
+def percentile(values, p):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values: return None
+    ordered = sorted(values)
+    rank = max(math.ceil(p / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+def summarize(samples):
+    """{stage: [ms]} -> rows of (stage, count, p50, p95, max, total) sorted by total time."""
+    rows = []
+    for stage, values in samples.items():
+        values = list(values)
+        if not values: continue
+        rows.append((stage, len(values), percentile(values, 50), percentile(values, 95), max(values), sum(values)))
+    rows.sort(key=lambda r: r[5], reverse=True)
+    return rows
+
+def summary():
+    with _lock:
+        snapshot = {stage: list(values) for stage, values in _samples.items()}
+    return summarize(snapshot)
+
+def print_summary():
+    rows = summary()
+    if not rows: return
+    print(f"{'Stage':<36}{'Count':>7}{'p50 ms':>10}{'p95 ms':>10}{'Max ms':>10}{'Total s':>10}")
+    for stage, count, p50, p95, mx, total in rows:
+        print(f"{stage:<36}{count:>7}{p50:>10.1f}{p95:>10.1f}{mx:>10.1f}{total / 1000:>10.1f}")
+
+def reset():
+    with _lock:
+        _samples.clear()
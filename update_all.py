@@ -1,11 +1,13 @@
 # update_all_students.py
 
+import os
 import time
+import socket
+import argparse
+import multiprocessing
 from datetime import datetime
 import pytz
 from dotenv import load_dotenv
-import math
-import re
 
 # Load environment variables
 load_dotenv()
@@ -13,170 +15,320 @@ load_dotenv()
 import db_utils
 import web_scraper
 import config
+import portal_http
+import refresh_scheduler
+import grading
+import parse_pipeline
+import page_archive
+import timing
+import metrics
 
 # --- Configuration ---
 DELAY_BETWEEN_REQUESTS = 5  # Seconds to wait between students
 
 # --- Helper Functions ---
 
-def identify_target_semester(sub_code, default_sem):
+def refresh_student(user, sync_stats=None, fetcher=None):
     """
-    Logic: Use dashboard sem as default. 
-    Force to 8 if code starts with CSC8, CSDC8, or CSDL8.
+    Scrapes one student and saves every semester bucket. Returns True on success,
+    None if the portal circuit breaker opened before the student could be scraped.
+    sync_stats (optional dict) accumulates detail pages 'fetched' / 'skipped'.
+    fetcher: detail page fetch/parse stage (parse_pipeline.ParsePipeline), default in-process.
     """
-    code = sub_code.strip().upper()
-    if re.search(r"^(CSC|CSDC|CSDL|CSL)8", code):
-        return 8
-    return default_sem
-
-def calculate_grade_point(percentage):
-    """Maps percentage to Grade Point (GP)."""
-    if percentage >= 85.00: return 10
-    if 80.00 <= percentage <= 84.99: return 9
-    if 70.00 <= percentage <= 79.99: return 8
-    if 60.00 <= percentage <= 69.99: return 7
-    if 55.00 <= percentage <= 59.99: return 6
-    if 50.00 <= percentage <= 54.99: return 5
-    if 45.00 <= percentage <= 49.99: return 4
-    return 0
-
-def run_update():
-    print("="*60)
-    print("🚀 Starting BATCH UPDATE: Hybrid Sem 7/8 Logic")
-    print("="*60)
-
-    all_users = db_utils.get_all_users_from_db_pg()
+    user_id = user['id']
+    full_name = user['full_name']
+    prn = user['prn']
 
-    if not all_users:
-        print("❌ No users found in the database. Exiting.")
-        return
+    try:
+        # 1. Login
+        session, html = web_scraper.login_and_get_welcome_page(
+            prn, user['dob_day'], user['dob_month'], user['dob_year'], full_name
+        )
 
-    total_users = len(all_users)
-    print(f"✅ Found {total_users} users to process.\n")
-    
-    success_count = 0
-    fail_count = 0
+        if not html:
+            if portal_http.breaker.is_open():
+                print("   🚧 Portal unavailable. Not attempted.")
+                return None
+            print("   ❌ Login FAILED. Skipping.")
+            return False
+        archive = page_archive.Recorder(user_id)
+        archive.add("dashboard", None, (html.encode("utf-8"), "utf-8"))
 
-    for i, user in enumerate(all_users):
-        user_id = user['id']
-        full_name = user['full_name']
-        prn = user['prn']
+        # 2. Scrape Mixed Raw Data (unchanged subjects come straight from the dashboard)
+        known = None
+        if config.DASHBOARD_FAST_MODE:
+            known = web_scraper.known_subjects(db_utils.get_student_data_from_db(user_id),
+                                               db_utils.get_dashboard_signatures_pg(user_id))
+        stats = {}
+        dashboard = web_scraper.parse_dashboard(html)
+        raw_marks, raw_att = web_scraper.extract_subject_data(session, dashboard, known, stats, prn, fetcher, archive.add)
+        archive.flush()
+        if sync_stats is not None:
+            sync_stats["fetched"] = sync_stats.get("fetched", 0) + stats["fetched"]
+            sync_stats["skipped"] = sync_stats.get("skipped", 0) + stats["skipped"]
+        print(f"   🧭 Detail pages: {stats['fetched']} fetched, {stats['skipped']} skipped")
+        dashboard_sem = web_scraper.extract_student_semester(dashboard) or 0
         
-        print("-" * 50)
-        print(f"[{i+1}/{total_users}] Processing: {full_name} (PRN: {prn})")
-
-        try:
-            # 1. Login
-            session, html = web_scraper.login_and_get_welcome_page(
-                prn, user['dob_day'], user['dob_month'], user['dob_year'], full_name
-            )
-
-            if not html:
-                print(f"   ❌ Login FAILED. Skipping.")
-                fail_count += 1
-                continue
-
-            # 2. Scrape Mixed Raw Data
-            raw_marks = web_scraper.extract_cie_marks(session, html)
-            raw_att = web_scraper.extract_detailed_attendance_info(session, html)
-            dashboard_sem = web_scraper.extract_student_semester(html) or 0
-            
-            # 3. Organize into Buckets (Hybrid Logic)
-            # Structure: { 7: {'cie': {}, 'att': {}}, 8: {...} }
-            organized_data = {}
+        # 3. Organize into Buckets (Hybrid Logic)
+        # Structure: { 7: {'cie': {}, 'att': {}}, 8: {...} }
+        organized_data = {}
 
+        with timing.span("bucket_semesters"):
             # Sort Marks
             for sub, exams in raw_marks.items():
-                sem = identify_target_semester(sub, dashboard_sem)
+                sem = web_scraper.semester_for_subject(sub, dashboard_sem)
                 if sem not in organized_data: organized_data[sem] = {'cie': {}, 'att': {}}
                 organized_data[sem]['cie'][sub] = exams
 
             # Sort Attendance
             for sub, details in raw_att.items():
-                sem = identify_target_semester(sub, dashboard_sem)
+                sem = web_scraper.semester_for_subject(sub, dashboard_sem)
                 if sem not in organized_data: organized_data[sem] = {'cie': {}, 'att': {}}
                 organized_data[sem]['att'][sub] = details
 
-            timestamp = datetime.now(pytz.utc)
-
-            # 4. Process each semester found
-            for sem, data in organized_data.items():
-                print(f"   💾 Updating Semester {sem}...")
-                
-                # Save Marks & Attendance to DB
-                if data['cie']:
-                    db_utils.update_student_marks_in_db_pg(user_id, sem, data['cie'], timestamp)
-                if data['att']:
-                    db_utils.update_attendance_in_db_pg(user_id, sem, data['att'])
-
-                # 5. Calculate SGPI for this specific semester bucket
-                if data['cie']:
-                    total_credits = 0
-                    weighted_gp = 0
-                    db_grade_details = []
-
-                    for sub_code, exams in data['cie'].items():
-                        sub_name = config.SUBJECT_CODE_TO_NAME_MAP.get(sub_code, sub_code)
-                        
-                        # Credits: Lab=1, Project=3, Theory=3
-                        if "lab" in sub_name.lower(): cred = 1
-                        elif "project" in sub_name.lower(): cred = 3
-                        else: cred = 3
-
-                        obt_sum = 0.0
-                        max_sum = 0.0
-                        for ex, val in exams.items():
-                            o = val.get('obtained', 0)
-                            m = val.get('max', 0)
-                            if isinstance(o, (int, float)):
-                                obt_sum += o
-                                max_sum += m if m > 0 else config.get_max_marks(sub_code, ex)
-
-                        if max_sum > 0:
-                            perc = (obt_sum / max_sum) * 100
-                            rnd_perc = math.floor(perc + 0.5)
-                            gp = calculate_grade_point(rnd_perc)
-                            
-                            weighted_gp += (cred * gp)
-                            total_credits += cred
-                            
-                            # Letter Grades
-                            grade = "F"
-                            if gp == 10: grade = "O"
-                            elif gp == 9: grade = "A"
-                            elif gp == 8: grade = "B"
-                            elif gp == 7: grade = "C"
-                            elif gp == 6: grade = "D"
-                            elif gp == 5: grade = "E"
-                            elif gp == 4: grade = "P"
-
-                            db_grade_details.append({
-                                "subject_code": sub_code, "subject_name": sub_name,
-                                "percentage": float(f"{perc:.2f}"), "grade_point": gp, 
-                                "grade_letter": grade, "credits": cred
-                            })
-
-                    if total_credits > 0:
-                        sgpi = weighted_gp / total_credits
-                        db_utils.save_student_sgpi_pg(user_id, sem, sgpi, db_grade_details)
-                        print(f"      ✅ Saved SGPI: {sgpi:.2f}")
-
-            print(f"   ✅ {full_name} updated successfully.")
-            success_count += 1
-
-        except Exception as e:
-            print(f"   🚨 Error processing {full_name}: {e}")
-            fail_count += 1
-        
+        timestamp = datetime.now(pytz.utc)
+
+        # 4. Process each semester found
+        all_saved = True
+        for sem, data in organized_data.items():
+            print(f"   💾 Updating Semester {sem}...")
+            
+            # Save Marks & Attendance to DB
+            if data['cie'] and not db_utils.update_student_marks_in_db_pg(user_id, sem, data['cie'], timestamp):
+                all_saved = False
+            if data['att'] and not db_utils.update_attendance_in_db_pg(user_id, sem, data['att']):
+                all_saved = False
+
+            # 5. Calculate SGPI for this specific semester bucket
+            if data['cie']:
+                with timing.span("compute_sgpi"):
+                    sgpi, db_grade_details, _ = grading.compute_semester_sgpi(data['cie'])
+
+                if sgpi is not None:
+                    db_utils.save_student_sgpi_pg(user_id, sem, sgpi, db_grade_details)
+                    print(f"      ✅ Saved SGPI: {sgpi:.2f}")
+
+        # Signatures vouch for the saved rows, so a failed upsert must not record them
+        if all_saved:
+            db_utils.save_dashboard_signatures_pg(user_id, stats["signatures"], stats["verified"])
+        else:
+            print("   ⚠️ Some rows failed to save; dashboard signatures not updated.")
+        db_utils.record_refresh_result_pg(user_id, refresh_scheduler.snapshot_hash(organized_data))
+
+        print(f"   ✅ {full_name} updated successfully.")
+        return True
+
+    except Exception as e:
+        print(f"   🚨 Error processing {full_name}: {e}")
+        return False
+
+def parse_shard(value):
+    """'1/4' -> (1, 4). Shard indexes are 0-based."""
+    try:
+        index, count = (int(x) for x in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Shard must look like i/N, e.g. 0/4")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError("Shard index must be in [0, N)")
+    return index, count
+
+def _planned_users(max_students, shard):
+    """List mode: rank every candidate up front, keeping only this shard's users."""
+    candidates = db_utils.get_refresh_candidates_pg()
+    if shard:
+        index, count = shard
+        candidates = [c for c in candidates if c['id'] % count == index]
+    return refresh_scheduler.plan_refresh(candidates, max_students=max_students)
+
+def _queued_users(run_id, worker_name):
+    """Queue mode: claim one student at a time until the shared run is drained."""
+    while True:
+        user = db_utils.claim_next_batch_user_pg(run_id, worker_name)
+        if not user: return
+        yield user
+
+def seed_batch_run(run_id, max_students=None):
+    """Fills the shared queue for run_id in priority order. Safe to call from every worker."""
+    planned = refresh_scheduler.plan_refresh(db_utils.get_refresh_candidates_pg(), max_students=max_students)
+    # Queue priority is the plan position, so the first worker to claim gets the most urgent student
+    ranked = [(user['id'], len(planned) - pos) for pos, user in enumerate(planned)]
+    return db_utils.enqueue_batch_run_pg(run_id, ranked)
+
+def run_update(budget_seconds=None, max_students=None, shard=None, run_id=None, worker_name=None, seed=True,
+               parse_workers=None):
+    """
+    Refreshes students in priority order (see refresh_scheduler).
+    budget_seconds: stop starting new students once the time budget would be exceeded.
+    max_students: hard cap on students refreshed this run.
+    shard: (index, count) -> only handle users with id % count == index.
+    run_id: pull students from the shared Postgres queue for this run instead (multi-worker mode).
+    seed: fill the queue for run_id before claiming (idempotent; run_workers seeds once itself).
+    parse_workers: parse detail pages in a process pool of this size (0 = in-process).
+    """
+    if budget_seconds is None: budget_seconds = config.REFRESH_BUDGET_SECONDS
+    if max_students is None: max_students = config.REFRESH_MAX_STUDENTS
+    if parse_workers is None: parse_workers = config.PARSE_WORKERS
+    worker_name = worker_name or f"{socket.gethostname()}:{os.getpid()}"
+
+    print("="*60)
+    print("🚀 Starting BATCH UPDATE: Hybrid Sem 7/8 Logic")
+    if shard: print(f"   Shard {shard[0]}/{shard[1]}")
+    if run_id: print(f"   Queue run '{run_id}' as worker {worker_name}")
+    print("="*60)
+
+    db_utils.ensure_history_partitions_pg()
+
+    if run_id:
+        if seed: seed_batch_run(run_id, max_students)
+        users = _queued_users(run_id, worker_name)
+        total_label = "?"
+    else:
+        planned = _planned_users(max_students, shard)
+        if not planned:
+            print("❌ No users found in the database. Exiting.")
+            return
+        users = iter(planned)
+        total_label = str(len(planned))
+        print(f"✅ {len(planned)} users scheduled for this run.")
+    if budget_seconds:
+        print(f"⏱️ Time budget: {budget_seconds}s")
+    print()
+
+    # One retry budget per run (per worker in queue mode)
+    portal_http.reset_retry_budget()
+
+    pipeline = None
+    if parse_workers:
+        pipeline = parse_pipeline.ParsePipeline(parse_workers=parse_workers)
+        print(f"🧵 Fetching with {pipeline.fetch_workers} threads, parsing in {pipeline.parse_workers} processes")
+    
+    success_count = 0
+    fail_count = 0
+    sync_stats = {"fetched": 0, "skipped": 0}
+    deferred = False
+    not_attempted = 0
+    paused_seconds = 0.0
+    run_started = time.monotonic()
+
+    for i, user in enumerate(users):
+        # Budget check: only start a student if the average cost so far still fits
+        if budget_seconds and i > 0:
+            elapsed = time.monotonic() - run_started
+            avg_per_student = elapsed / i
+            if elapsed + avg_per_student > budget_seconds:
+                deferred = True
+                if run_id:
+                    db_utils.finish_batch_user_pg(run_id, user['id'], 'pending')
+                print(f"⏱️ Budget reached after {i} students. Deferring the rest to the next run.")
+                break
+
+        # Portal down: wait for the breaker's probe window instead of failing every student
+        wait = portal_http.breaker.retry_after()
+        if wait:
+            if budget_seconds and time.monotonic() - run_started + wait > budget_seconds:
+                deferred = True
+                if run_id:
+                    db_utils.finish_batch_user_pg(run_id, user['id'], 'pending')
+                print("🚧 Portal unavailable and the pause would exceed the budget. Deferring the rest.")
+                break
+            print(f"🚧 Portal unavailable. Pausing {wait:.0f}s before the next attempt...")
+            paused_seconds += wait
+            time.sleep(wait)
+
         # Rate Limiting
-        if i + 1 < total_users:
+        if i > 0:
             time.sleep(DELAY_BETWEEN_REQUESTS)
+        
+        print("-" * 50)
+        print(f"[{i+1}/{total_label}] Processing: {user['full_name']} (PRN: {user['prn']})")
+
+        with timing.span("student.total"):
+            ok = refresh_student(user, sync_stats, pipeline)
+        if ok is None:
+            # Back to the queue for whichever worker runs once the portal is up again
+            if run_id:
+                db_utils.finish_batch_user_pg(run_id, user['id'], 'pending')
+            not_attempted += 1
+            continue
+        if ok: success_count += 1
+        else: fail_count += 1
+        metrics.BATCH_STUDENTS.inc(result="success" if ok else "failed")
+        metrics.BATCH_THROUGHPUT.set((success_count + fail_count) / max((time.monotonic() - run_started) / 60, 1e-9))
+        if run_id:
+            db_utils.finish_batch_user_pg(run_id, user['id'], 'done' if ok else 'failed')
+
+    if pipeline:
+        pipeline.close()
 
     print("\n" + "="*60)
-    print("🎉 BATCH UPDATE COMPLETE")
+    print("🎉 BATCH UPDATE COMPLETE" + (f" ({worker_name})" if run_id else ""))
     print(f"   ✅ Success: {success_count}")
     print(f"   ❌ Failed:  {fail_count}")
+    if deferred:
+        print("   ⏭️ Stopped early on time budget")
+    if paused_seconds or not_attempted:
+        print(f"   🚧 Portal outage: paused {paused_seconds:.0f}s, {not_attempted} students not attempted")
+    print(f"   🔁 Retries used: {portal_http.get_retry_budget().used}/{config.PORTAL_RETRY_BUDGET}")
+    detail_total = sync_stats["fetched"] + sync_stats["skipped"]
+    if detail_total:
+        print(f"   🧭 Detail pages skipped: {sync_stats['skipped']}/{detail_total} "
+              f"({sync_stats['skipped'] / detail_total:.0%}, unchanged on the dashboard)")
+    print("="*60)
+    timing.print_summary()
+    return {"success": success_count, "failed": fail_count, "detail_pages": sync_stats}
+
+def print_run_summary(run_id):
+    """Aggregated result of every worker that took part in a queue run."""
+    summary = db_utils.get_batch_run_summary_pg(run_id)
+    print("\n" + "="*60)
+    print(f"📋 RUN SUMMARY: {run_id}")
+    for status in ("done", "failed", "running", "pending"):
+        print(f"   {status:<8} {summary.get(status, 0)}")
     print("="*60)
 
+def run_workers(worker_count, run_id, budget_seconds=None, max_students=None, parse_workers=None):
+    """Spawns local worker processes that share one queue run, then prints the combined summary."""
+    # Seed once up front so workers don't race to rank the whole user list
+    seed_batch_run(run_id, max_students)
+    procs = []
+    for n in range(worker_count):
+        p = multiprocessing.Process(
+            target=run_update,
+            kwargs={"budget_seconds": budget_seconds, "max_students": max_students,
+                    "run_id": run_id, "worker_name": f"{socket.gethostname()}:w{n}", "seed": False,
+                    "parse_workers": parse_workers}
+        )
+        p.start()
+        procs.append(p)
+    for p in procs:
+        p.join()
+    print_run_summary(run_id)
+
 if __name__ == "__main__":
-    run_update()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Batch refresh all registered students.")
+    parser.add_argument("--budget-seconds", type=int, default=None, help="Per-run time budget (0 = unlimited)")
+    parser.add_argument("--max-students", type=int, default=None, help="Max students to refresh this run (0 = all)")
+    parser.add_argument("--shard", type=parse_shard, default=None, help="Only process users with id %% N == i (format i/N)")
+    parser.add_argument("--queue", metavar="RUN_ID", default=None, help="Pull students from the shared Postgres queue for this run")
+    parser.add_argument("--workers", type=int, default=1, help="Local worker processes to start (requires --queue)")
+    parser.add_argument("--summary", metavar="RUN_ID", default=None, help="Print the aggregated summary of a queue run and exit")
+    parser.add_argument("--parse-workers", type=int, default=None, help="Parse detail pages in this many processes (0 = in-process)")
+    parser.add_argument("--metrics-port", type=int, default=config.METRICS_PORT, help="Serve Prometheus metrics on this port (0 = off)")
+    args = parser.parse_args()
+
+    if args.shard and args.queue:
+        parser.error("--shard can't be combined with --queue (queue workers share one run instead)")
+    if args.workers > 1 and not args.queue:
+        parser.error("--workers N>1 requires --queue RUN_ID")
+
+    if args.metrics_port:
+        metrics.start_metrics_server(args.metrics_port)
+
+    if args.summary:
+        print_run_summary(args.summary)
+    elif args.queue and args.workers > 1:
+        run_workers(args.workers, args.queue, budget_seconds=args.budget_seconds, max_students=args.max_students,
+                    parse_workers=args.parse_workers)
+    else:
+        run_update(budget_seconds=args.budget_seconds, max_students=args.max_students,
+                   shard=args.shard, run_id=args.queue, parse_workers=args.parse_workers)
@@ -1,21 +1,22 @@
-import requests
 from bs4 import BeautifulSoup
 import re
+import json
+import hashlib
 from urllib.parse import urljoin
 import config
+import portal_http
+import timing
+import metrics
+import page_layouts
 
 def login_and_get_welcome_page(prn, dob_day, dob_month_val, dob_year, user_full_name_for_check):
-    session = requests.Session()
-    session.headers.update({
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36",
-        "Referer": config.LOGIN_URL
-    })
+    session = portal_http.new_session()
     try:
         # 1. GET Login Page
-        response_get = session.get(config.LOGIN_URL, timeout=20)
-        response_get.raise_for_status()
-        soup_login = BeautifulSoup(response_get.content, "html.parser")
-        login_form = soup_login.find("form", {"id": "login-form"})
+        response_get = portal_http.get(session, config.LOGIN_URL, page_type="login")
+        with timing.span("parse.login_form"):
+            soup_login = BeautifulSoup(response_get.content, "html.parser")
+            login_form = soup_login.find("form", {"id": "login-form"})
         
         if not login_form: return None, None
 
@@ -41,8 +42,7 @@ def login_and_get_welcome_page(prn, dob_day, dob_month_val, dob_year, user_full_
         form_action = login_form.get("action")
         actual_post_url = urljoin(config.LOGIN_URL, form_action) if form_action else config.FORM_ACTION_URL
         
-        response_post = session.post(actual_post_url, data=payload, timeout=20)
-        response_post.raise_for_status()
+        response_post = portal_http.post(session, actual_post_url, page_type="login", data=payload)
         welcome_page_html = response_post.text
         lower_html = welcome_page_html.lower()
 
@@ -55,6 +55,7 @@ def login_and_get_welcome_page(prn, dob_day, dob_month_val, dob_year, user_full_
             "user not found", "login failed", "try again"
         ]
         if any(fail_msg in lower_html for fail_msg in failure_keywords):
+            metrics.LOGINS.inc(result="rejected")
             return None, None
 
         # B. Check for explicit SUCCESS indicators
@@ -77,17 +78,31 @@ def login_and_get_welcome_page(prn, dob_day, dob_month_val, dob_year, user_full_
         # Final Decision:
         # Must NOT have failure keywords AND (Name matches OR definitely looks like dashboard)
         if name_matched or (has_dashboard_elements and has_logout_link):
+            metrics.LOGINS.inc(result="success")
             return session, welcome_page_html
         else:
+            metrics.LOGINS.inc(result="rejected")
             return None, None
 
     except Exception as e:
         print(f"Scraper Error: {e}")
+        metrics.LOGINS.inc(result="error")
         return None, None
 
+@timing.timed("parse.dashboard")
+def parse_dashboard(welcome_page_html):
+    """
+    The welcome page parsed once. Every dashboard helper below takes either the HTML or
+    this soup, so a scrape that needs several of them doesn't re-parse the page each time.
+    """
+    return BeautifulSoup(welcome_page_html, "html.parser")
+
+def _dashboard_soup(page):
+    return page if isinstance(page, BeautifulSoup) else parse_dashboard(page)
+
 def extract_attendance_from_welcome_page(welcome_page_html):
     if not welcome_page_html: return []
-    soup = BeautifulSoup(welcome_page_html, "html.parser")
+    soup = _dashboard_soup(welcome_page_html)
     attendance_data = []
     
     scripts = soup.find_all("script")
@@ -105,32 +120,128 @@ def extract_attendance_from_welcome_page(welcome_page_html):
                 return attendance_data
     return []
 
-def get_cie_detail_urls(dashboard_html):
-    soup = BeautifulSoup(dashboard_html, "html.parser")
-    subject_urls = {}
-
-    links = soup.find_all("a", href=True)
-    for link in links:
-        if "task=ciedetails" in link['href']:
-            row = link.find_parent("tr")
-            if row:
-                cols = row.find_all("td")
-                if cols:
-                    subject_code = cols[0].get_text(strip=True)
-                    subject_urls[subject_code] = link['href']
-
-    if not subject_urls:
-        tabs = soup.find_all("a", onclick=True)
-        for tab in tabs:
-            onclick_text = tab['onclick']
-            if "task=ciedetails" in onclick_text:
-                match = re.search(r"href=['\"](.*?)['\"]", onclick_text)
-                if match:
-                    url = match.group(1)
-                    subject_code = tab.get_text(strip=True)
-                    if subject_code:
-                        subject_urls[subject_code] = url
-    return subject_urls
+@timing.timed("parse.dashboard_cie_chart")
+def extract_cie_chart_from_welcome_page(welcome_page_html):
+    """
+    Reads the stackedBarChart_1 bb.generate config on the welcome page.
+    Returns {subject: {exam: obtained or None}}. The chart has no max marks.
+    """
+    if not welcome_page_html: return {}
+    soup = _dashboard_soup(welcome_page_html)
+
+    for script in soup.find_all("script"):
+        content = script.string
+        if not content or "stackedBarChart_1" not in content: continue
+
+        config_match = re.search(r"bb\.generate\s*\(\s*(\{[\s\S]*?bindto\s*:\s*[\"']#stackedBarChart_1[\"'][\s\S]*?\}\s*)\s*\)\s*;", content)
+        if not config_match: continue
+        chart = config_match.group(1)
+
+        categories_match = re.search(r"categories\s*:\s*(\[[\s\S]*?\])", chart)
+        columns_match = re.search(r"columns\s*:\s*(\[[\s\S]*?\])\s*,\s*type\s*:\s*\"bar\"", chart)
+        if not categories_match or not columns_match: continue
+        subjects = [s.strip() for s in re.findall(r"['\"]([^'\"]+)['\"]", categories_match.group(1))]
+
+        cie_data = {sub: {} for sub in subjects}
+        for exam, values_str in re.findall(r"\[\s*['\"]([^'\"]+)['\"]\s*([^\]]*)?\s*\]", columns_match.group(1)):
+            values = []
+            for raw in values_str.strip().strip(',').split(',') if values_str.strip() else []:
+                raw = raw.strip().strip('"\'')
+                try:
+                    values.append(float(raw))
+                except ValueError:
+                    values.append(None)  # null / empty / text
+            for idx, sub in enumerate(subjects):
+                cie_data[sub][exam] = values[idx] if idx < len(values) else None
+        return cie_data
+    return {}
+
+@timing.timed("parse.dashboard_rows")
+def dashboard_row_text(welcome_page_html):
+    """{subject: whitespace-normalized text of its dashboard table row}"""
+    soup = _dashboard_soup(welcome_page_html)
+    rows = {}
+    for link in soup.find_all("a", href=re.compile(r"task=(ciedetails|attendencelist)")):
+        row = link.find_parent("tr")
+        if row:
+            cols = row.find_all("td")
+            if cols:
+                rows[cols[0].get_text(strip=True)] = " ".join(row.get_text(" ").split())
+    return rows
+
+def subject_signature(signals):
+    """Stable hash of a subject's dashboard signals (gauge %, chart values, row text)."""
+    return hashlib.sha1(json.dumps(signals, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def dashboard_shows(kind, signals):
+    """
+    Whether the dashboard carries data that changes with this kind of subject data: the
+    attendance gauge, or a posted (non-zero) CIE chart value. The row text alone never
+    changes, so a signature without these can't tell that the detail page did.
+    """
+    if kind == "att":
+        return signals.get("att_pct") is not None
+    return any((signals.get("cie") or {}).values())
+
+def dashboard_summary(welcome_page_html):
+    """
+    Per-subject signals available on the welcome page alone (no extra requests):
+    {subject: {'att_pct': gauge % or None, 'cie': {exam: chart value or None}, 'row': row text or None}}
+    """
+    dashboard = _dashboard_soup(welcome_page_html)
+    summary = {}
+    for sub, text in dashboard_row_text(dashboard).items():
+        summary.setdefault(sub, {"att_pct": None, "cie": {}})["row"] = text
+    for item in extract_attendance_from_welcome_page(dashboard):
+        summary.setdefault(item["subject"], {"att_pct": None, "cie": {}})["att_pct"] = item["percentage"]
+    for sub, exams in extract_cie_chart_from_welcome_page(dashboard).items():
+        summary.setdefault(sub, {"att_pct": None, "cie": {}})["cie"] = exams
+    return summary
+
+def marks_from_dashboard(subject, chart_values, known_marks=None):
+    """
+    CIE marks for one subject from the dashboard chart, or None when the detail page is needed.
+    - With stored marks: reuse them if every exam shows the same value on the chart as
+      stored, compared by exam name (0 and missing both mean "not posted").
+    - Without: build them from the chart, unless a value is 0 (the chart also uses 0 as a
+      placeholder) or an exam's max marks are not configured.
+    """
+    if not chart_values: return None
+    posted = [v for v in chart_values.values() if v]
+
+    if known_marks:
+        for exam in set(chart_values) | set(known_marks):
+            stored = known_marks.get(exam)
+            obtained = stored.get('obtained') if isinstance(stored, dict) else None
+            if (chart_values.get(exam) or None) != (obtained or None):
+                return None
+        return known_marks
+
+    if not posted or any(v == 0 for v in chart_values.values()): return None
+    marks = {}
+    for exam, value in chart_values.items():
+        if value is None: continue
+        rules = config.MAX_MARKS_CONFIG.get(subject, {})
+        if exam not in rules and exam not in config.MAX_MARKS_CONFIG["DEFAULT"]: return None
+        marks[exam] = {"obtained": float(value), "max": float(config.get_max_marks(subject, exam))}
+    return marks
+
+def attendance_from_dashboard(gauge_pct, known_att=None):
+    """
+    Stored attendance counts if they round to the gauge percentage, else None.
+    The gauge is a whole number without counts (36/39 and 40/43 are 92 and 93, but
+    36/39 and 37/40 are both 92), so this only vouches for counts whose gauge is
+    unchanged since they were fetched. A changed gauge always means a fetch.
+    """
+    if gauge_pct is None or not known_att or not known_att.get('conducted'): return None
+    stored_pct = known_att['attended'] / known_att['conducted'] * 100
+    return known_att if round(stored_pct) == gauge_pct else None
+
+@timing.timed("parse.dashboard_cie_links")
+def get_cie_detail_urls(dashboard_html, layout_key=None):
+    """{subject: url} via the page_layouts registry (layout_key, e.g. the PRN, picks the remembered layout)."""
+    soup = _dashboard_soup(dashboard_html)
+    return page_layouts.extract("cie_links", soup, layout_key)[0]
 
 def _parse_table_marks_safely(soup):
     """
@@ -169,114 +280,299 @@ def _parse_table_marks_safely(soup):
     return table_marks
 
 def scrape_subject_detail_page(session, url):
-    full_url = urljoin(config.LOGIN_URL, url)
+    raw = fetch_detail_page(session, "ciedetails", url)
+    if raw is None: return {}
     try:
-        response = session.get(full_url, timeout=15)
-        html = response.text
-        soup = BeautifulSoup(html, "html.parser")
-        
-        final_marks_data = {}
-        
-        # 1. Parse Table Data (Source of Truth for "Is exam taken?")
-        table_data = _parse_table_marks_safely(soup)
+        with timing.span("parse.ciedetails"):
+            return parse_detail_page("ciedetails", raw)
+    except Exception as e:
+        print(f"Error scraping detail page {url}: {e}")
+        return {}
+
+def _parse_subject_detail_html(html):
+    """Chart + table parsing for one CIE detail page."""
+    soup = BeautifulSoup(html, "html.parser")
+
+    final_marks_data = {}
 
-        # 2. Parse Chart Data (Source of Truth for "Correct Column Mapping")
-        chart_match = re.search(r'var\s+chartData\s*=\s*(\[\{.*?\}\]);', html, re.DOTALL)
+    # 1. Parse Table Data (Source of Truth for "Is exam taken?")
+    table_data = _parse_table_marks_safely(soup)
+
+    # 2. Parse Chart Data (Source of Truth for "Correct Column Mapping")
+    chart_match = re.search(r'var\s+chartData\s*=\s*(\[\{.*?\}\]);', html, re.DOTALL)
+    
+    if chart_match:
+        json_str = chart_match.group(1)
+        # Extract: { "xaxis": "ExamName", "maxmarks": 20, "optainmarks": 15.5 }
+        objects = re.findall(r'\{[^{}]*?"xaxis"\s*:\s*"([^"]+)"[^{}]*?"maxmarks"\s*:\s*([\d\.]+)[^{}]*?"optainmarks"\s*:\s*([\d\.]+)[^{}]*?\}', json_str, re.DOTALL)
         
-        if chart_match:
-            json_str = chart_match.group(1)
-            # Extract: { "xaxis": "ExamName", "maxmarks": 20, "optainmarks": 15.5 }
-            objects = re.findall(r'\{[^{}]*?"xaxis"\s*:\s*"([^"]+)"[^{}]*?"maxmarks"\s*:\s*([\d\.]+)[^{}]*?"optainmarks"\s*:\s*([\d\.]+)[^{}]*?\}', json_str, re.DOTALL)
-            
-            for exam_name, max_val, obt_val in objects:
-                try:
-                    obt = float(obt_val)
-                    max_m = float(max_val)
-                    
-                    # --- HYBRID VALIDATION ---
-                    if obt == 0:
-                        # If Chart says 0, verify with Table.
-                        # If Table has an explicit entry for this exam and it is 0, accept it.
-                        # If Table does NOT have this exam (cell was empty), reject the 0.
-                        if exam_name in table_data and table_data[exam_name]['obtained'] == 0:
-                            final_marks_data[exam_name] = {"obtained": 0.0, "max": max_m}
-                        else:
-                            # Placeholder 0 in chart, Empty in table -> Skip
-                            continue
+        for exam_name, max_val, obt_val in objects:
+            try:
+                obt = float(obt_val)
+                max_m = float(max_val)
+                
+                # --- HYBRID VALIDATION ---
+                if obt == 0:
+                    # If Chart says 0, verify with Table.
+                    # If Table has an explicit entry for this exam and it is 0, accept it.
+                    # If Table does NOT have this exam (cell was empty), reject the 0.
+                    if exam_name in table_data and table_data[exam_name]['obtained'] == 0:
+                        final_marks_data[exam_name] = {"obtained": 0.0, "max": max_m}
                     else:
-                        # Non-zero marks are trusted from Chart
-                        final_marks_data[exam_name] = {"obtained": obt, "max": max_m}
-                except ValueError:
-                    pass
-            
-            if final_marks_data:
-                return final_marks_data
-
-        # 3. Fallback: If Chart failed entirely, return Table Data
-        return table_data
+                        # Placeholder 0 in chart, Empty in table -> Skip
+                        continue
+                else:
+                    # Non-zero marks are trusted from Chart
+                    final_marks_data[exam_name] = {"obtained": obt, "max": max_m}
+            except ValueError:
+                pass
+        
+        if final_marks_data:
+            return final_marks_data
 
-    except Exception as e:
-        print(f"Error scraping detail page {url}: {e}")
-        return {}
+    # 3. Fallback: If Chart failed entirely, return Table Data
+    return table_data
 
-def extract_cie_marks(session, html_content=None):
-    if not isinstance(session, requests.Session): return {}
-    all_subjects_data = {}
+def iter_cie_marks(session, html_content=None):
+    """Yields (subject, marks) as each CIE detail page completes."""
+    if not session: return
     subject_links = get_cie_detail_urls(html_content)
-    
+
     for subject, url in subject_links.items():
         subject = subject.strip()
         marks = scrape_subject_detail_page(session, url)
         if marks:
-            all_subjects_data[subject] = marks
-    return all_subjects_data
+            yield subject, marks
+
+def extract_cie_marks(session, html_content=None):
+    return dict(iter_cie_marks(session, html_content))
+
+def _scrape_attendance_detail_page(session, url):
+    """Visits an attendance detail page and extracts Present/Absent counts. None on failure."""
+    raw = fetch_detail_page(session, "attendencelist", url)
+    if raw is None: return None
+    try:
+        with timing.span("parse.attendencelist"):
+            return parse_detail_page("attendencelist", raw)
+    except Exception as e:
+        print(f"Error scraping attendance page {url}: {e}")
+        return None
+
+def _parse_attendance_detail_html(html):
+    """Present/Absent spans -> {'attended': n, 'conducted': n}"""
+    det_soup = BeautifulSoup(html, "html.parser")
+
+    green_span = det_soup.find("span", class_="cn-color-green")
+    red_span = det_soup.find("span", class_="cn-color-red")
+
+    present = 0
+    absent = 0
+
+    if green_span:
+        m = re.search(r"\[(\d+)\]", green_span.get_text())
+        if m: present = int(m.group(1))
+
+    if red_span:
+        m = re.search(r"\[(\d+)\]", red_span.get_text())
+        if m: absent = int(m.group(1))
+
+    return {"attended": present, "conducted": present + absent}
+
+@timing.timed("parse.dashboard_attendance_links")
+def get_attendance_detail_urls(dashboard_html, layout_key=None):
+    soup = _dashboard_soup(dashboard_html)
+    return page_layouts.extract("attendance_links", soup, layout_key)[0]
+
+def iter_detailed_attendance_info(session, welcome_page_html):
+    """Yields (subject, {'attended', 'conducted'}) as each attendance page completes."""
+    if not welcome_page_html or not session: return
+
+    for subject, url in get_attendance_detail_urls(welcome_page_html).items():
+        details = _scrape_attendance_detail_page(session, url)
+        # A failed fetch is skipped rather than saved as 0/0
+        if details:
+            yield subject, details
 
 def extract_detailed_attendance_info(session, welcome_page_html):
     """
     Extracts detailed attendance (Conducted vs Attended).
     """
-    if not welcome_page_html or not session: return {}
+    return dict(iter_detailed_attendance_info(session, welcome_page_html))
 
-    soup = BeautifulSoup(welcome_page_html, "html.parser")
-    detailed_data = {}
-    
-    links = soup.find_all("a", href=True)
-    for link in links:
-        if "task=attendencelist" in link['href']:
-            row = link.find_parent("tr")
-            if row:
-                cols = row.find_all("td")
-                if cols:
-                    subject = cols[0].get_text(strip=True)
-                    try:
-                        full_url = urljoin(config.LOGIN_URL, link['href'])
-                        resp = session.get(full_url, timeout=10)
-                        det_soup = BeautifulSoup(resp.content, "html.parser")
-                        
-                        green_span = det_soup.find("span", class_="cn-color-green")
-                        red_span = det_soup.find("span", class_="cn-color-red")
-                        
-                        present = 0
-                        absent = 0
-                        
-                        if green_span:
-                            m = re.search(r"\[(\d+)\]", green_span.get_text())
-                            if m: present = int(m.group(1))
-                        
-                        if red_span:
-                            m = re.search(r"\[(\d+)\]", red_span.get_text())
-                            if m: absent = int(m.group(1))
-
-                        detailed_data[subject] = {
-                            "attended": present,
-                            "conducted": present + absent
-                        }
-                    except:
-                        pass
-    return detailed_data
+# page_type of the detail page behind each kind of subject data
+DETAIL_PAGE_TYPES = {"cie": "ciedetails", "att": "attendencelist"}
+
+# Fragments each detail page parser needs (PORTAL_STREAMING_FETCH stops reading after them)
+DETAIL_PAGE_MARKERS = {
+    "ciedetails": [("chartData", "];"), ("cn-cie-table", "</table>")],
+    "attendencelist": [("cn-color-green", "</span>"), ("cn-color-red", "</span>")],
+}
+
+def fetch_detail_page(session, page_type, url):
+    """Raw detail page as (bytes, encoding), or None if the fetch failed."""
+    try:
+        full_url = urljoin(config.LOGIN_URL, url)
+        # Streaming and hedging are mutually exclusive; streaming wins (see config)
+        if config.PORTAL_STREAMING_FETCH:
+            return portal_http.get_until(session, full_url, DETAIL_PAGE_MARKERS[page_type], page_type=page_type)
+        if config.PORTAL_HEDGE_REQUESTS:
+            response = portal_http.get_hedged(session, full_url, page_type=page_type)
+        else:
+            response = portal_http.get(session, full_url, page_type=page_type)
+        return response.content, response.encoding
+    except Exception as e:
+        print(f"Error fetching {page_type} page {url}: {e}")
+        return None
+
+def parse_detail_page(page_type, raw):
+    """
+    Pure parse of a page from fetch_detail_page. Module-level and free of shared
+    state so it can run in a worker process (see parse_pipeline).
+    """
+    content, encoding = raw
+    if page_type == "ciedetails":
+        return _parse_subject_detail_html(content.decode(encoding or "utf-8", errors="replace"))
+    return _parse_attendance_detail_html(content)
+
+def fetch_and_parse_pages(session, pages, on_page=None):
+    """
+    Default fetcher for iter_subject_data: one page at a time, parsed in-process.
+    pages = [(kind, subject, url)]; yields (kind, subject, data) for the pages that worked.
+    on_page(page_type, subject, raw) sees every fetched page (e.g. page_archive.Recorder.add).
+    """
+    for kind, subject, url in pages:
+        page_type = DETAIL_PAGE_TYPES[kind]
+        raw = fetch_detail_page(session, page_type, url)
+        if raw is None: continue
+        if on_page: on_page(page_type, subject, raw)
+        try:
+            with timing.span(f"parse.{page_type}"):
+                data = parse_detail_page(page_type, raw)
+        except Exception as e:
+            print(f"Error parsing {page_type} page {url}: {e}")
+            continue
+        if data:
+            yield kind, subject, data
+
+def iter_subject_data(session, welcome_page_html, known=None, stats=None, layout_key=None, fetcher=None, on_page=None):
+    """
+    Streaming scrape: yields ('cie', subject, marks) and ('att', subject, attendance)
+    subject by subject, as each detail page completes.
+    known = {subject: {'cie': marks, 'att': counts, 'sig': signature, 'due': bool}} from
+    the stored snapshot. In DASHBOARD_FAST_MODE it enables two shortcuts:
+      1. Delta sync: a subject whose dashboard signature is unchanged reuses the stored
+         data, for each kind the dashboard_shows() a signal for.
+      2. Otherwise marks_from_dashboard may still answer its CIE marks. Attendance is
+         fetched: a changed gauge can't say what the new counts are.
+    Neither applies to a subject that is 'due' a full fetch (see get_dashboard_signatures_pg).
+    Detail pages are fetched only for what is left, by fetcher(session, [(kind, subject, url)], on_page)
+    (default fetch_and_parse_pages; update_all can plug in a parse_pipeline.ParsePipeline).
+    stats (optional dict) is filled with 'fetched' / 'skipped' page counts, the
+    'signatures' of the subjects returned and the subjects 'verified' from detail pages
+    alone, to be saved with the snapshot.
+    layout_key (the PRN) lets page_layouts go straight to this student's known layout.
+    welcome_page_html may also be a parse_dashboard soup.
+    """
+    if stats is None: stats = {}
+    stats.setdefault("fetched", 0)
+    stats.setdefault("skipped", 0)
+    stats.setdefault("signatures", {})
+    stats.setdefault("verified", set())
+    if not welcome_page_html or not session: return
+
+    dashboard = _dashboard_soup(welcome_page_html)
+    cie_links = {sub.strip(): url for sub, url in get_cie_detail_urls(dashboard, layout_key).items()}
+    att_links = get_attendance_detail_urls(dashboard, layout_key)
+    summary = dashboard_summary(dashboard) if config.DASHBOARD_FAST_MODE else {}
+    known = known or {}
+    fetcher = fetcher or fetch_and_parse_pages
+
+    expected = {}    # subject -> kinds it should end up with
+    received = {}    # subject -> kinds we have
+    reused = set()   # subjects with a kind answered without its detail page
+    signatures = {}
+    to_fetch = []
+
+    # 1. Answer what we can without detail pages (dashboard order, each subject once)
+    for subject in dict.fromkeys(list(cie_links) + list(att_links)):
+        signals = summary.get(subject, {})
+        stored = known.get(subject, {})
+        links = {"cie": cie_links.get(subject), "att": att_links.get(subject)}
+        expected[subject] = {kind for kind, url in links.items() if url}
+        if any(dashboard_shows(kind, signals) for kind in expected[subject]):
+            signatures[subject] = subject_signature(signals)
+        due = stored.get("due")
+        unchanged = (not due and subject in signatures and signatures[subject] == stored.get("sig")
+                     and all(stored.get(kind) for kind in expected[subject]))
+
+        for kind in ("cie", "att"):
+            if not links[kind]: continue
+            data = None
+            if unchanged and dashboard_shows(kind, signals):
+                data = stored[kind]
+                if kind == "att":
+                    data = attendance_from_dashboard(signals["att_pct"], data)
+            elif summary and kind == "cie" and not due:
+                data = marks_from_dashboard(subject, signals.get("cie"), stored.get("cie"))
+
+            if data:
+                stats["skipped"] += 1
+                metrics.DETAIL_PAGES.inc(page_type=DETAIL_PAGE_TYPES[kind], result="skipped")
+                received.setdefault(subject, set()).add(kind)
+                reused.add(subject)
+                yield kind, subject, data
+            else:
+                to_fetch.append((kind, subject, links[kind]))
+
+    # 2. Detail pages for the rest
+    for kind, subject, url in to_fetch:
+        stats["fetched"] += 1
+        metrics.DETAIL_PAGES.inc(page_type=DETAIL_PAGE_TYPES[kind], result="fetched")
+    for kind, subject, data in fetcher(session, to_fetch, on_page):
+        received.setdefault(subject, set()).add(kind)
+        yield kind, subject, data
+
+    # Only vouch for subjects whose data we actually have
+    for subject, sig in signatures.items():
+        if expected.get(subject) and received.get(subject, set()) >= expected[subject]:
+            stats["signatures"][subject] = sig
+            if subject not in reused:
+                stats["verified"].add(subject)
+
+def extract_subject_data(session, welcome_page_html, known=None, stats=None, layout_key=None, fetcher=None, on_page=None):
+    """Non-streaming iter_subject_data: (cie_marks, attendance) dicts."""
+    cie, att = {}, {}
+    for kind, subject, data in iter_subject_data(session, welcome_page_html, known, stats, layout_key, fetcher, on_page):
+        (cie if kind == "cie" else att)[subject] = data
+    return cie, att
+
+def known_subjects(snapshot, signatures=None):
+    """
+    Flattens a DB snapshot ({'semesters_data': {sem: {'cie', 'att'}}}) plus the stored
+    dashboard signatures (get_dashboard_signatures_pg) to {subject: {'cie', 'att', 'sig', 'due'}}.
+    """
+    known = {}
+    for sem_data in ((snapshot or {}).get("semesters_data") or {}).values():
+        for kind in ("cie", "att"):
+            for sub, data in sem_data.get(kind, {}).items():
+                known.setdefault(sub, {})[kind] = data
+    for sub, row in (signatures or {}).items():
+        if sub in known:
+            known[sub].update(row)
+    return known
 
 def extract_student_semester(html_content):
     if not html_content: return None
-    soup = BeautifulSoup(html_content, "html.parser")
+    soup = _dashboard_soup(html_content)
     match = re.search(r"SEM\s+(\d+)", soup.get_text(), re.IGNORECASE)
-    return int(match.group(1)) if match else None
\ No newline at end of file
+    return int(match.group(1)) if match else None
+
+def semester_for_subject(sub_code, default_sem):
+    """
+    Semester a subject's data belongs to: the dashboard semester, except that CSC8,
+    CSDC8, CSDL8 and CSL8 codes always go to Semester 8.
+    """
+    code = sub_code.strip().upper()
+    if re.search(r"^(CSC|CSDC|CSDL|CSL)8", code):
+        return 8
+    return default_sem
\ No newline at end of file
@@ -4,17 +4,14 @@ from bs4 import BeautifulSoup
 import re
 from urllib.parse import urljoin # Moved import here
 import config # Import your config file
+import portal_http
+import page_layouts
 
 def login_and_get_welcome_page(prn, dob_day, dob_month_val, dob_year, user_full_name_for_check):
-    session = requests.Session()
-    session.headers.update({
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36",
-        "Referer": config.LOGIN_URL
-    })
+    session = portal_http.new_session()
     try:
         # print(f"Navigating to login page: {config.LOGIN_URL}")
-        response_get = session.get(config.LOGIN_URL, timeout=20)
-        response_get.raise_for_status()
+        response_get = portal_http.get(session, config.LOGIN_URL, page_type="login")
         # print("Successfully fetched login page.")
         soup_login = BeautifulSoup(response_get.content, "html.parser")
         login_form = soup_login.find("form", {"id": "login-form"})
@@ -49,8 +46,7 @@ def login_and_get_welcome_page(prn, dob_day, dob_month_val, dob_year, user_full_
         if form_action:
             actual_post_url = urljoin(config.LOGIN_URL, form_action)
         # print(f"Attempting to POST login data to: {actual_post_url}")
-        response_post = session.post(actual_post_url, data=payload, timeout=20)
-        response_post.raise_for_status()
+        response_post = portal_http.post(session, actual_post_url, page_type="login", data=payload)
         # print(f"POST request completed. Status: {response_post.status_code}")
         # print(f"Current URL after POST: {response_post.url}")
         welcome_page_html = response_post.text
@@ -173,76 +169,33 @@ def extract_cie_marks(welcome_page_html):
         return None
     return cie_data
 
-def extract_detailed_attendance_info(session, welcome_page_html):
+def extract_detailed_attendance_info(session, welcome_page_html, layout_key=None):
     """
     Parses the welcome page to find links to detailed attendance pages.
-    This version handles THREE layouts and returns a DICTIONARY to match the old app structure.
+    Layouts (linked table rows, uk-tab tabs, ...) live in page_layouts.
+    Returns a DICTIONARY to match the old app structure.
     """
     if not welcome_page_html or not session:
         return {}
 
     soup = BeautifulSoup(welcome_page_html, "html.parser")
-    detailed_data = {}
-    
-    # List of potential identifiers for the main subjects table.
-    potential_table_identifiers = [
-        {"class": "dash_even_row"},  # Your class's layout
-        {"class": "dash_od_row"},    # Luke's class's layout
-    ]
-    
-    table = None
-    for identifier in potential_table_identifiers:
-        found_table = soup.find("table", identifier)
-        if found_table and found_table.tbody and len(found_table.tbody.find_all("tr")) > 0:
-            print(f"Scraping Strategy: Found table-based layout using identifier: {identifier}")
-            table = found_table
-            break
-            
-    # STRATEGY 1: If we found a table
-    if table:
-        for row in table.tbody.find_all("tr"):
-            try:
-                cells = row.find_all("td")
-                if len(cells) < 2: continue
-                
-                subject_code = cells[0].text.strip() # Strip whitespace
-                link_tag = row.find("a", href=re.compile(r"task=attendencelist"))
-                
-                if link_tag and subject_code:
-                    details = _scrape_attendance_detail_page(session, link_tag['href'])
-                    detailed_data[subject_code] = details
-                    
-            except Exception as e:
-                print(f"Error scraping a row in table layout: {e}")
-        return detailed_data
-
-    # STRATEGY 2: If no table was found, try the Tab-Based Layout
-    tab_container = soup.find("ul", attrs={"uk-tab": ""})
-    if tab_container:
-        print("Scraping Strategy: Found tab-based layout.")
-        for tab in tab_container.find_all("li"):
-            try:
-                link_tag = tab.find("a")
-                if not link_tag: continue
-                
-                subject_code = link_tag.text.strip() # Strip whitespace
-                
-                if link_tag.has_attr('href') and subject_code:
-                    details = _scrape_attendance_detail_page(session, link_tag['href'])
-                    detailed_data[subject_code] = details
-                    
-            except Exception as e:
-                print(f"Error scraping a tab in tabbed layout: {e}")
-        return detailed_data
+    subject_urls, layout = page_layouts.extract("attendance_links", soup, layout_key)
+    if not layout:
+        print("CRITICAL: Could not find attendance data using any known layout.")
+        return {}
+    print(f"Scraping Strategy: {layout}")
 
-    print("CRITICAL: Could not find attendance data using any known layout.")
-    return {}
+    detailed_data = {}
+    for subject_code, url in subject_urls.items():
+        details = _scrape_attendance_detail_page(session, url)
+        if details:
+            detailed_data[subject_code.strip()] = details
+    return detailed_data
 
 def _scrape_attendance_detail_page(session, url):
-    """ Helper function to visit a detail page and extract Present/Absent numbers. """
+    """ Helper function to visit a detail page and extract Present/Absent numbers. None if the fetch failed. """
     try:
-        response = session.get(urljoin(config.LOGIN_URL, url), timeout=30)
-        response.raise_for_status()
+        response = portal_http.get(session, urljoin(config.LOGIN_URL, url), page_type="attendencelist")
         soup = BeautifulSoup(response.content, "html.parser")
         present_text = soup.find("span", class_="cn-color-green").text if soup.find("span", class_="cn-color-green") else ""
         absent_text = soup.find("span", class_="cn-color-red").text if soup.find("span", class_="cn-color-red") else ""
@@ -251,4 +204,4 @@ def _scrape_attendance_detail_page(session, url):
         return {'attended': present, 'conducted': present + absent}
     except Exception as e:
         print(f"  -> Failed to scrape detail page {url}: {e}")
-        return {'attended': 0, 'conducted': 0}
\ No newline at end of file
+        return None
\ No newline at end of file